@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for Ghanaian Pharmacy POS System
+Times the DatabaseManager hot paths against generated databases of several
+sizes and compares the results with a stored baseline
+
+Usage:
+    python benchmark.py [--sizes small medium] [--output results.json]
+    python benchmark.py --baseline baseline.json [--tolerance 0.25]
+    python benchmark.py --db copy_of_pharmacy.db
+
+Datasets are built with generate_data.py on first use and kept in
+--data-dir; every run works on a fresh copy, so results are repeatable.
+Save a run's --output file and pass it as --baseline to later runs: the
+command exits with status 1 if any hot path got slower than the tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from database import DatabaseManager
+from generate_data import SCALES, generate
+from utils import create_backup
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Generated datasets end on a fixed day so they are identical on every run
+DATASET_END_DATE = date(2025, 12, 31)
+DATASET_DAYS = 730
+SEARCH_TERMS = ['para', 'amox', 'coartem', 'lonart', 'vitamin', 'metro', 'cipro', 'omepra',
+                'herbal', 'letap', 'kinapharma', 'zyrtec', 'ORS', 'ibu', 'folic']
+# Regressions smaller than this are treated as timer noise
+MIN_REGRESSION_MS = 0.5
+
+class BenchmarkContext:
+    """The database under test and the inputs the benchmarks draw from"""
+
+    def __init__(self, db, seed):
+        self.db = db
+        self.rng = random.Random(seed)
+        with db.reader() as conn:
+            first_sale, last_sale = conn.execute("SELECT MIN(sale_date), MAX(sale_date) FROM sales").fetchone()
+            self.first_day = date.fromisoformat(first_sale[:10]) if first_sale else date.today()
+            self.last_day = date.fromisoformat(last_sale[:10]) if last_sale else date.today()
+            # Expired lots are never sold, so only unexpired units count
+            self.in_stock = [tuple(row) for row in conn.execute('''
+                SELECT id, unit_price FROM drugs d
+                WHERE (SELECT SUM(quantity) FROM stock_lots
+                       WHERE drug_id = d.id AND expiry_date >= date('now', 'localtime')) >= 100
+            ''')]
+
+    def recent_day(self, within_days):
+        """A random day among the last within_days days of sales"""
+        return self.last_day - timedelta(days=self.rng.randrange(within_days))
+
+    def any_day(self):
+        """A random day in the sales history"""
+        return self.first_day + timedelta(days=self.rng.randrange((self.last_day - self.first_day).days + 1))
+
+def bench_search_drugs(ctx):
+    return ctx.db.search_drugs(ctx.rng.choice(SEARCH_TERMS))
+
+def bench_get_all_drugs(ctx):
+    return ctx.db.get_all_drugs()
+
+def bench_sales_by_day(ctx):
+    day = ctx.recent_day(30).isoformat()
+    return ctx.db.get_sales_by_date(day, day)
+
+def bench_sales_by_week(ctx):
+    end = ctx.recent_day(90)
+    return ctx.db.get_sales_by_date((end - timedelta(days=6)).isoformat(), end.isoformat())
+
+def bench_get_daily_sales(ctx):
+    return ctx.db.get_daily_sales(ctx.any_day().isoformat())
+
+def bench_generate_receipt_number(ctx):
+    return ctx.db.generate_receipt_number()
+
+def bench_checkout(ctx):
+    items = []
+    for drug_id, unit_price in ctx.rng.sample(ctx.in_stock, min(ctx.rng.randint(1, 4), len(ctx.in_stock))):
+        items.append({'drug_id': drug_id, 'quantity': 1, 'unit_price': unit_price, 'total_price': unit_price})
+    sale_data = {
+        'total_amount': round(sum(item['total_price'] for item in items), 2),
+        'payment_method': 'Cash',
+        'cashier_name': 'Benchmark',
+    }
+    return ctx.db.checkout(sale_data, items)
+
+def bench_get_inventory_alerts(ctx):
+    return ctx.db.get_inventory_alerts()
+
+def bench_get_low_stock_drugs(ctx):
+    return ctx.db.get_low_stock_drugs()
+
+def bench_get_expiring_drugs(ctx):
+    return ctx.db.get_expiring_drugs()
+
+def bench_create_backup(ctx):
+    path = create_backup()
+    shutil.rmtree(os.path.dirname(path))
+    return path
+
+# (name, function, iterations); a None result counts as an error
+BENCHMARKS = [
+    ('search_drugs', bench_search_drugs, 200),
+    ('get_all_drugs', bench_get_all_drugs, 50),
+    ('get_sales_by_date (day)', bench_sales_by_day, 100),
+    ('get_sales_by_date (week)', bench_sales_by_week, 20),
+    ('get_daily_sales', bench_get_daily_sales, 200),
+    ('generate_receipt_number', bench_generate_receipt_number, 500),
+    ('checkout', bench_checkout, 200),
+    ('get_inventory_alerts', bench_get_inventory_alerts, 100),
+    ('get_low_stock_drugs', bench_get_low_stock_drugs, 50),
+    ('get_expiring_drugs', bench_get_expiring_drugs, 50),
+    ('create_backup', bench_create_backup, 3),
+]
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    index = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+def run_benchmark(ctx, func, iterations):
+    """Time func(ctx) iterations times, then once more to measure memory
+
+    One untimed call first fills the caches, so short runs are not skewed
+    by a single cold call.
+    """
+    try:
+        func(ctx)
+    except Exception:
+        pass
+
+    latencies = []
+    errors = 0
+    for _ in range(iterations):
+        started = time.perf_counter()
+        try:
+            if func(ctx) is None:
+                errors += 1
+        except Exception:
+            errors += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    # Separate call, since tracing allocations slows everything down
+    tracemalloc.start()
+    try:
+        func(ctx)
+    except Exception:
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    latencies.sort()
+    total_ms = sum(latencies)
+    return {
+        'iterations': iterations,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(total_ms / iterations, 3),
+        'max_ms': round(latencies[-1], 3),
+        'ops_per_second': round(iterations * 1000 / total_ms, 1) if total_ms else 0.0,
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+def dataset_path(data_dir, size, seed):
+    """Path of the generated database for size, building it if needed"""
+    path = os.path.join(data_dir, f"{size}_seed{seed}.db")
+    if os.path.exists(path):
+        return path
+
+    drugs, sales, items = SCALES[size]
+    print(f"Generating {size} dataset ({drugs} drugs, {sales} sales); this is done once...")
+    os.makedirs(data_dir, exist_ok=True)
+    building = path + '.building'
+    if os.path.exists(building):
+        os.remove(building)
+    db = DatabaseManager(building)
+    try:
+        db.initialize_database()
+        generate(db, seed=seed, drugs=drugs, sales=sales, items=items, days=DATASET_DAYS,
+                 end_date=DATASET_END_DATE)
+    finally:
+        db.close()
+    # Fold the WAL in so the dataset is a single file that can be copied
+    conn = sqlite3.connect(building)
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        conn.close()
+    os.replace(building, path)
+    return path
+
+def run_suite(source_path, seed, iteration_factor):
+    """Run every benchmark against a working copy of source_path"""
+    work_dir = tempfile.mkdtemp(prefix="pharmacy_bench_")
+    previous_dir = os.getcwd()
+    # create_backup works on pharmacy.db in the current directory. The
+    # backup API also copies anything still in the source's WAL
+    source = sqlite3.connect(source_path)
+    copy = sqlite3.connect(os.path.join(work_dir, "pharmacy.db"))
+    try:
+        source.backup(copy)
+    finally:
+        copy.close()
+        source.close()
+    os.chdir(work_dir)
+    db = DatabaseManager("pharmacy.db")
+    try:
+        db.initialize_database()
+        ctx = BenchmarkContext(db, seed)
+        results = {}
+        for name, func, iterations in BENCHMARKS:
+            iterations = max(int(iterations * iteration_factor), 3)
+            results[name] = run_benchmark(ctx, func, iterations)
+            stats = results[name]
+            print(f"  {name:<28} p50 {stats['p50_ms']:>9.3f}ms  p95 {stats['p95_ms']:>9.3f}ms  "
+                  f"p99 {stats['p99_ms']:>9.3f}ms  {stats['ops_per_second']:>9.1f} ops/s"
+                  + (f"  {stats['errors']} errors" if stats['errors'] else ""))
+        return results
+    finally:
+        db.close()
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare(results, baseline, tolerance):
+    """List (dataset, benchmark, metric, baseline ms, current ms) for each regression"""
+    regressions = []
+    for dataset, benchmarks in results['datasets'].items():
+        for name, stats in benchmarks.items():
+            before = baseline.get('datasets', {}).get(dataset, {}).get(name)
+            if before is None:
+                continue
+            for metric in ('p50_ms', 'p95_ms'):
+                limit = before[metric] * (1 + tolerance)
+                if stats[metric] > limit and stats[metric] - before[metric] > MIN_REGRESSION_MS:
+                    regressions.append((dataset, name, metric, before[metric], stats[metric]))
+    return regressions
+
+def main():
+    """Parse the command line, run the benchmarks and report"""
+    parser = argparse.ArgumentParser(description="Benchmark the pharmacy POS database hot paths")
+    parser.add_argument('--sizes', nargs='+', choices=sorted(SCALES), default=['small', 'medium'],
+                        help="generated dataset sizes to run against (default: small medium)")
+    parser.add_argument('--db', help="benchmark a copy of this database instead of generated datasets")
+    parser.add_argument('--seed', type=int, default=42, help="seed for datasets and inputs (default: 42)")
+    parser.add_argument('--quick', action='store_true', help="run a tenth of the iterations")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'pharmacy_benchmark_data'),
+                        help="where generated datasets are kept between runs")
+    parser.add_argument('--output', default='benchmark_results.json', help="results file (default: %(default)s)")
+    parser.add_argument('--baseline', help="results file from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="allowed slowdown of p50/p95 against the baseline (default: 0.25 = 25%%)")
+    args = parser.parse_args()
+
+    if args.db:
+        datasets = {os.path.basename(args.db): os.path.abspath(args.db)}
+    else:
+        datasets = {size: dataset_path(args.data_dir, size, args.seed) for size in args.sizes}
+
+    results = {
+        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'seed': args.seed,
+        'datasets': {},
+    }
+    for dataset, path in datasets.items():
+        print(f"\nBenchmarking {dataset} ({os.path.getsize(path) / (1024 * 1024):.1f} MB)...")
+        results['datasets'][dataset] = run_suite(path, args.seed, 0.1 if args.quick else 1.0)
+    if resource is not None:
+        # Kilobytes on Linux
+        results['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    try:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Results saved to {args.output}")
+    except Exception as e:
+        print(f"Error saving results: {e}")
+        return 1
+
+    if not args.baseline:
+        return 0
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except Exception as e:
+        print(f"Error reading baseline: {e}")
+        return 1
+
+    regressions = compare(results, baseline, args.tolerance)
+    for dataset, name, metric, before, after in regressions:
+        change = f"+{(after / before - 1) * 100:.0f}%" if before else "new cost"
+        print(f"❌ {dataset} {name}: {metric} {before:.3f}ms -> {after:.3f}ms ({change})")
+    if regressions:
+        return 1
+    print(f"✅ No hot path slower than {args.baseline} by more than {args.tolerance:.0%}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
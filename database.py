@@ -5,131 +5,609 @@ Handles all database operations with SQLite
 
 import sqlite3
 import os
+import base64
+import json
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Tuple
+from typing import Callable, Iterable, Iterator, List, Dict, Optional, Tuple
+
+class InsufficientStockError(Exception):
+    """Raised by checkout when cart lines ask for more than is in stock.
+    
+    shortages lists one dict per offending line with drug_id, generic_name,
+    brand_name, requested, available (sellable units) and expired (units
+    held in lots past their expiry date, which are never sold).
+    """
+    
+    def __init__(self, shortages: List[Dict]):
+        self.shortages = shortages
+        lines = ', '.join(f"{s['generic_name']} ({s['requested']} requested, {s['available']} available"
+                          + (f", {s['expired']} expired)" if s.get('expired') else ")")
+                          for s in shortages)
+        super().__init__(f"Insufficient stock: {lines}")
 
 class DatabaseManager:
-    def __init__(self, db_path="pharmacy.db"):
+    # Connection pool settings
+    READER_POOL_SIZE = 4
+    BUSY_TIMEOUT_MS = 5000
+    # Rows pulled per fetchmany() call by the iter_* methods
+    ITER_BATCH_SIZE = 500
+    # Rows staged per executemany() call by import_drugs
+    IMPORT_BATCH_SIZE = 1000
+    # Minimum age of the last stock snapshot before another is taken
+    SNAPSHOT_INTERVAL_HOURS = 24
+    # Schema migrations as (version, description, method), applied in order.
+    # PRAGMA user_version holds the last version applied. Steps must also be
+    # safe on databases created before versioning, so they check what exists.
+    MIGRATIONS = [
+        (1, "Creating tables", '_migrate_core_tables'),
+        (2, "Building drug search index", '_create_drug_search_index'),
+        (3, "Building daily sales rollup", '_create_sales_rollups'),
+        (4, "Building drug sales rollup", '_create_drug_sales_rollup'),
+        (5, "Creating stock lots", '_create_stock_lots'),
+        (6, "Creating stock ledger", '_create_stock_ledger'),
+        (7, "Adding default data", '_insert_default_data'),
+        (8, "Adding settings version", '_add_settings_version'),
+        (9, "Indexing stock alerts", '_create_stock_alert_index'),
+        (10, "Creating sales archive registry", '_create_sales_archive_registry'),
+        (11, "Creating drug change log", '_create_drug_change_log'),
+    ]
+    # Drugs changed by other terminals beyond which the catalog is reloaded, not patched
+    CATALOG_REFRESH_LIMIT = 500
+    # SQLite VM instructions between progress callbacks while a migration runs
+    MIGRATION_PROGRESS_OPS = 100000
+    
+    def __init__(self, db_path="pharmacy.db", receipt_prefix="", reader_pool_size=READER_POOL_SIZE,
+                 profiler=None):
         self.db_path = db_path
+        # Prefix for receipt numbers so several terminals never collide
+        self.receipt_prefix = receipt_prefix
         self.connection = None
+        
+        # One writer connection guarded by a lock, plus a bounded pool of
+        # reader connections that are handed out to one thread at a time
+        self._write_lock = threading.RLock()
+        self._reader_slots = threading.BoundedSemaphore(reader_pool_size)
+        self._idle_readers = queue.LifoQueue()
+        self._all_readers = []
+        self._local = threading.local()
+        self._trace_callback = None
+        # Optional db_profiler.SQLProfiler; without one, connections are plain sqlite3
+        self.profiler = profiler
+        self._connection_factory = profiler.connection_factory() if profiler else sqlite3.Connection
+        # Archive schemas ATTACHed to each connection, see _archive_schemas
+        self._attached_archives = {}
+        # Set by initialize_database when SQLite was built with FTS5
+        self.fts_enabled = False
+        
+        # In-process drug catalog cache, patched row by row on every write
+        self._catalog = None
+        self._catalog_sorted = None
+        self._catalog_version = None
+        self._catalog_seq = 0
+        self._catalog_movement_id = 0
+        self._catalog_lock = threading.RLock()
+        
+        # Cached settings row; settings.version tells when another terminal changed it
+        self._settings = None
+        self._settings_data_version = None
+        self._settings_lock = threading.RLock()
+        
+        # Cached inventory alerts, keyed on a counter bumped by every drug write
+        self._inventory_generation = 0
+        self._alerts = None
+        self._alerts_key = None
+        self._alerts_lock = threading.RLock()
+        self.cache_stats = {'catalog_hits': 0, 'catalog_misses': 0, 'catalog_reloads': 0,
+                            'catalog_refreshes': 0,
+                            'settings_hits': 0, 'settings_misses': 0,
+                            'alerts_hits': 0, 'alerts_misses': 0}
+        if profiler:
+            profiler.instrument(self)
         self.connect()
     
     def connect(self):
-        """Establish database connection"""
+        """Establish the writer connection and switch the database to WAL mode"""
         try:
-            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
-            self.connection.row_factory = sqlite3.Row
+            self.connection = self._open_connection()
+            # WAL lets readers run alongside the writer instead of blocking it
+            self.connection.execute("PRAGMA journal_mode = WAL")
+            self.connection.execute("PRAGMA synchronous = NORMAL")
         except Exception as e:
             print(f"Database connection error: {e}")
             raise
     
-    def initialize_database(self):
-        """Create all necessary tables if they don't exist"""
-        try:
+    def _open_connection(self) -> sqlite3.Connection:
+        """Open a connection with the pool's common settings"""
+        # isolation_level=None: transactions are begun explicitly by transaction()
+        conn = sqlite3.connect(self.db_path, timeout=self.BUSY_TIMEOUT_MS / 1000,
+                               check_same_thread=False, isolation_level=None,
+                               factory=self._connection_factory)
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {self.BUSY_TIMEOUT_MS}")
+        if self._trace_callback:
+            conn.set_trace_callback(self._trace_callback)
+        return conn
+    
+    @contextmanager
+    def transaction(self):
+        """Run a block of writes as one transaction on the writer connection.
+        
+        Yields a cursor; commits when the block exits normally and rolls back
+        if it raises. Nested use joins the outer transaction.
+        """
+        with self._write_lock:
             cursor = self.connection.cursor()
+            if self.connection.in_transaction:
+                yield cursor
+                return
+            # IMMEDIATE takes the write lock up front so a busy database is
+            # reported (after busy_timeout) before any work is done
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                self.connection.rollback()
+                raise
+            else:
+                self.connection.commit()
+    
+    @contextmanager
+    def reader(self):
+        """Borrow a read-only connection from the pool for the current thread"""
+        conn = getattr(self._local, 'reader', None)
+        if conn is not None:
+            # Nested read on a thread that already holds a connection
+            yield conn
+            return
+        if self.db_path == ":memory:":
+            # A private in-memory database is only visible to the writer
+            with self._write_lock:
+                yield self.connection
+            return
+        
+        with self._reader_slots:
+            try:
+                conn = self._idle_readers.get_nowait()
+            except queue.Empty:
+                conn = self._open_connection()
+                conn.execute("PRAGMA query_only = 1")
+                self._all_readers.append(conn)
+            self._local.reader = conn
+            try:
+                yield conn
+            finally:
+                self._local.reader = None
+                self._idle_readers.put(conn)
+    
+    def set_trace_callback(self, callback):
+        """Install an sqlite3 trace callback on the writer and all reader connections"""
+        self._trace_callback = callback
+        self.connection.set_trace_callback(callback)
+        for conn in self._all_readers:
+            conn.set_trace_callback(callback)
+    
+    def initialize_database(self, progress_callback: Optional[Callable[[int, int, str], None]] = None):
+        """Bring the schema up to date by applying any pending migrations
+        
+        A database that is already current costs a single query. Otherwise
+        progress_callback(step, total, description) is called before each
+        pending step, and periodically while a long step (an index build or
+        rollup backfill) runs.
+        """
+        try:
+            version, self.fts_enabled = self._schema_state()
+            pending = [migration for migration in self.MIGRATIONS if migration[0] > version]
+            for step, (target, description, method) in enumerate(pending, 1):
+                report = None
+                if progress_callback:
+                    def report(step=step, description=description):
+                        progress_callback(step, len(pending), description)
+                self._apply_migration(target, getattr(self, method), report)
             
-            # Drugs table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS drugs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    generic_name TEXT NOT NULL,
-                    brand_name TEXT NOT NULL,
-                    dosage TEXT NOT NULL,
-                    form TEXT NOT NULL,
-                    batch_number TEXT NOT NULL,
-                    expiry_date DATE NOT NULL,
-                    unit_price REAL NOT NULL,
-                    quantity_in_stock INTEGER NOT NULL,
-                    reorder_level INTEGER DEFAULT 10,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Sales table
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sales (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    receipt_number TEXT UNIQUE NOT NULL,
-                    total_amount REAL NOT NULL,
-                    payment_method TEXT DEFAULT 'Cash',
-                    customer_name TEXT,
-                    customer_phone TEXT,
-                    cashier_name TEXT NOT NULL,
-                    sale_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            
-            # Sale items table
+            if pending:
+                _, self.fts_enabled = self._schema_state()
+        except Exception as e:
+            print(f"Database initialization error: {e}")
+            raise
+    
+    def _schema_state(self) -> Tuple[int, bool]:
+        """Return the schema version and whether the FTS5 search table exists"""
+        with self.reader() as conn:
+            row = conn.execute('''
+                SELECT user_version,
+                       EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'drugs_fts')
+                FROM pragma_user_version
+            ''').fetchone()
+        return row[0], bool(row[1])
+    
+    def _apply_migration(self, version: int, migrate: Callable, report: Optional[Callable[[], None]]):
+        """Run one migration step and record its version in the same transaction"""
+        if report:
+            report()
+            # Keep the caller's UI alive during long statements; 0 means carry on
+            self.connection.set_progress_handler(lambda: report() or 0, self.MIGRATION_PROGRESS_OPS)
+        try:
+            with self.transaction() as cursor:
+                # Another terminal may have applied it while we waited for the lock
+                cursor.execute("PRAGMA user_version")
+                if cursor.fetchone()[0] >= version:
+                    return
+                migrate(cursor)
+                cursor.execute(f"PRAGMA user_version = {version}")
+        finally:
+            if report:
+                self.connection.set_progress_handler(None, 0)
+    
+    def get_schema_version(self) -> int:
+        """Get the number of the last migration applied to the database"""
+        return self._schema_state()[0]
+    
+    def _migrate_core_tables(self, cursor):
+        """Migration 1: the original tables and their secondary indexes"""
+        # Drugs table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS drugs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                generic_name TEXT NOT NULL,
+                brand_name TEXT NOT NULL,
+                dosage TEXT NOT NULL,
+                form TEXT NOT NULL,
+                batch_number TEXT NOT NULL,
+                expiry_date DATE NOT NULL,
+                unit_price REAL NOT NULL,
+                quantity_in_stock INTEGER NOT NULL,
+                reorder_level INTEGER DEFAULT 10,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Sales table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sales (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                receipt_number TEXT UNIQUE NOT NULL,
+                total_amount REAL NOT NULL,
+                payment_method TEXT DEFAULT 'Cash',
+                customer_name TEXT,
+                customer_phone TEXT,
+                cashier_name TEXT NOT NULL,
+                sale_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Sale items table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sale_items (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sale_id INTEGER NOT NULL,
+                drug_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price REAL NOT NULL,
+                total_price REAL NOT NULL,
+                FOREIGN KEY (sale_id) REFERENCES sales (id),
+                FOREIGN KEY (drug_id) REFERENCES drugs (id)
+            )
+        ''')
+        
+        # Settings table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS settings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                pharmacy_name TEXT DEFAULT 'Ghana Pharmacy',
+                pharmacy_address TEXT DEFAULT '',
+                pharmacy_phone TEXT DEFAULT '',
+                pharmacy_email TEXT DEFAULT '',
+                tax_rate REAL DEFAULT 0.0,
+                currency TEXT DEFAULT 'GHS',
+                receipt_footer TEXT DEFAULT 'Thank you for your purchase!',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                role TEXT NOT NULL,
+                full_name TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Receipt number counters (one row per day and terminal prefix)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS receipt_counters (
+                day TEXT NOT NULL,
+                prefix TEXT NOT NULL DEFAULT '',
+                last_number INTEGER NOT NULL,
+                PRIMARY KEY (day, prefix)
+            )
+        ''')
+        
+        # Secondary indexes for date-range, item lookup and alert queries
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_sale_date ON sales (sale_date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_sale_id ON sale_items (sale_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sale_items_drug_id ON sale_items (drug_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_drugs_expiry_date ON drugs (expiry_date)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_drugs_stock ON drugs (quantity_in_stock, reorder_level)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_drugs_generic_name ON drugs (generic_name)")
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_drugs_import_key
+            ON drugs (generic_name, brand_name, dosage, batch_number)
+        ''')
+    
+    def _insert_default_data(self, cursor):
+        """Migration 7: default settings, admin user and sample drugs for a new install"""
+        # Insert default settings if not exists
+        cursor.execute("SELECT COUNT(*) FROM settings")
+        if cursor.fetchone()[0] == 0:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS sale_items (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    sale_id INTEGER NOT NULL,
-                    drug_id INTEGER NOT NULL,
-                    quantity INTEGER NOT NULL,
-                    unit_price REAL NOT NULL,
-                    total_price REAL NOT NULL,
-                    FOREIGN KEY (sale_id) REFERENCES sales (id),
-                    FOREIGN KEY (drug_id) REFERENCES drugs (id)
-                )
-            ''')
-            
-            # Settings table
+                INSERT INTO settings (pharmacy_name, pharmacy_address, pharmacy_phone, tax_rate)
+                VALUES (?, ?, ?, ?)
+            ''', ('Ghana Pharmacy', 'Accra, Ghana', '+233 XX XXX XXXX', 0.0))
+        
+        # Insert default admin user if not exists
+        cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
+        if cursor.fetchone()[0] == 0:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS settings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    pharmacy_name TEXT DEFAULT 'Ghana Pharmacy',
-                    pharmacy_address TEXT DEFAULT '',
-                    pharmacy_phone TEXT DEFAULT '',
-                    pharmacy_email TEXT DEFAULT '',
-                    tax_rate REAL DEFAULT 0.0,
-                    currency TEXT DEFAULT 'GHS',
-                    receipt_footer TEXT DEFAULT 'Thank you for your purchase!',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
+                INSERT INTO users (username, password, role, full_name)
+                VALUES (?, ?, ?, ?)
+            ''', ('admin', 'admin123', 'admin', 'System Administrator'))
+        
+        # Insert sample drugs if not exists
+        cursor.execute("SELECT COUNT(*) FROM drugs")
+        if cursor.fetchone()[0] == 0:
+            self.insert_sample_drugs()
+    
+    def _add_settings_version(self, cursor):
+        """Migration 8: a counter bumped by every settings change, checked by the settings cache"""
+        cursor.execute("SELECT 1 FROM pragma_table_info('settings') WHERE name = 'version'")
+        if not cursor.fetchone():
+            cursor.execute("ALTER TABLE settings ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    
+    def _create_stock_alert_index(self, cursor):
+        """Migration 9: partial index holding only low and out-of-stock drugs"""
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_drugs_stock_alert ON drugs (quantity_in_stock)
+            WHERE quantity_in_stock <= reorder_level OR quantity_in_stock <= 0
+        ''')
+    
+    def _create_sales_archive_registry(self, cursor):
+        """Migration 10: the list of per-year archive files written by archive_sales"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sales_archives (
+                year INTEGER PRIMARY KEY,
+                path TEXT NOT NULL,
+                first_sale_id INTEGER NOT NULL,
+                last_sale_id INTEGER NOT NULL,
+                sales INTEGER NOT NULL,
+                archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+    def _create_drug_change_log(self, cursor):
+        """Migration 11: drug ids stamped with a sequence number when a drug is added, edited or deleted
+        
+        The catalog cache reads the entries past the last sequence it saw to
+        patch just the drugs another terminal changed. Stock level changes
+        are already in the stock ledger, so updates that only move
+        quantity_in_stock (every checkout) do not fire the trigger.
+        """
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS drug_changes (
+                drug_id INTEGER PRIMARY KEY,
+                seq INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_drug_changes_seq ON drug_changes (seq)")
+        edited = "generic_name, brand_name, dosage, form, batch_number, expiry_date, unit_price, reorder_level"
+        for event, ref in (('INSERT', 'new'), (f'UPDATE OF {edited}', 'new'), ('DELETE', 'old')):
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS drug_changes_{event.split()[0].lower()} AFTER {event} ON drugs BEGIN
+                    INSERT OR REPLACE INTO drug_changes (drug_id, seq)
+                    VALUES ({ref}.id, (SELECT COALESCE(MAX(seq), 0) + 1 FROM drug_changes));
+                END
             ''')
-            
-            # Users table
+    
+    def _create_drug_search_index(self, cursor) -> bool:
+        """Create the FTS5 drug search table and the triggers that keep it in sync.
+        
+        Returns False when this SQLite build has no FTS5, in which case
+        search_drugs falls back to LIKE matching.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'drugs_fts'")
+        if cursor.fetchone():
+            return True
+        
+        try:
             cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    role TEXT NOT NULL,
-                    full_name TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                CREATE VIRTUAL TABLE drugs_fts USING fts5 (
+                    generic_name, brand_name, dosage, form,
+                    content = 'drugs', content_rowid = 'id',
+                    tokenize = 'unicode61 remove_diacritics 2',
+                    prefix = '2 3'
                 )
             ''')
-            
-            self.connection.commit()
-            
-            # Insert default settings if not exists
-            cursor.execute("SELECT COUNT(*) FROM settings")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('''
-                    INSERT INTO settings (pharmacy_name, pharmacy_address, pharmacy_phone, tax_rate)
-                    VALUES (?, ?, ?, ?)
-                ''', ('Ghana Pharmacy', 'Accra, Ghana', '+233 XX XXX XXXX', 0.0))
-            
-            # Insert default admin user if not exists
-            cursor.execute("SELECT COUNT(*) FROM users WHERE username = 'admin'")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('''
-                    INSERT INTO users (username, password, role, full_name)
-                    VALUES (?, ?, ?, ?)
-                ''', ('admin', 'admin123', 'admin', 'System Administrator'))
-            
-            # Insert sample drugs if not exists
-            cursor.execute("SELECT COUNT(*) FROM drugs")
-            if cursor.fetchone()[0] == 0:
-                self.insert_sample_drugs()
-            
-            self.connection.commit()
-            
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable, using LIKE search: {e}")
+            return False
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS drugs_fts_insert AFTER INSERT ON drugs BEGIN
+                INSERT INTO drugs_fts (rowid, generic_name, brand_name, dosage, form)
+                VALUES (new.id, new.generic_name, new.brand_name, new.dosage, new.form);
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS drugs_fts_delete AFTER DELETE ON drugs BEGIN
+                INSERT INTO drugs_fts (drugs_fts, rowid, generic_name, brand_name, dosage, form)
+                VALUES ('delete', old.id, old.generic_name, old.brand_name, old.dosage, old.form);
+            END
+        ''')
+        # Only name/dosage/form edits touch the index, not stock updates
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS drugs_fts_update
+            AFTER UPDATE OF generic_name, brand_name, dosage, form ON drugs BEGIN
+                INSERT INTO drugs_fts (drugs_fts, rowid, generic_name, brand_name, dosage, form)
+                VALUES ('delete', old.id, old.generic_name, old.brand_name, old.dosage, old.form);
+                INSERT INTO drugs_fts (rowid, generic_name, brand_name, dosage, form)
+                VALUES (new.id, new.generic_name, new.brand_name, new.dosage, new.form);
+            END
+        ''')
+        
+        # Index any drugs that existed before the search table
+        cursor.execute("INSERT INTO drugs_fts (drugs_fts) VALUES ('rebuild')")
+        return True
+    
+    def _create_sales_rollups(self, cursor):
+        """Create the daily sales rollup table and the triggers that maintain it.
+        
+        Reports read one row per day and payment method instead of every
+        sale. The rollup is backfilled from existing sales when first created.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_sales_summary'")
+        if cursor.fetchone():
+            return
+        
+        cursor.execute('''
+            CREATE TABLE daily_sales_summary (
+                day TEXT NOT NULL,
+                payment_method TEXT NOT NULL,
+                transactions INTEGER NOT NULL,
+                gross_amount REAL NOT NULL,
+                PRIMARY KEY (day, payment_method)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS sales_rollup_insert AFTER INSERT ON sales BEGIN
+                INSERT INTO daily_sales_summary (day, payment_method, transactions, gross_amount)
+                VALUES (substr(new.sale_date, 1, 10), COALESCE(new.payment_method, ''), 1, new.total_amount)
+                ON CONFLICT (day, payment_method) DO UPDATE SET
+                    transactions = transactions + 1,
+                    gross_amount = gross_amount + excluded.gross_amount;
+            END
+        ''')
+        # Corrections move the sale from its old bucket to its new one
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS sales_rollup_update
+            AFTER UPDATE OF sale_date, payment_method, total_amount ON sales BEGIN
+                UPDATE daily_sales_summary
+                SET transactions = transactions - 1,
+                    gross_amount = gross_amount - old.total_amount
+                WHERE day = substr(old.sale_date, 1, 10)
+                  AND payment_method = COALESCE(old.payment_method, '');
+                INSERT INTO daily_sales_summary (day, payment_method, transactions, gross_amount)
+                VALUES (substr(new.sale_date, 1, 10), COALESCE(new.payment_method, ''), 1, new.total_amount)
+                ON CONFLICT (day, payment_method) DO UPDATE SET
+                    transactions = transactions + 1,
+                    gross_amount = gross_amount + excluded.gross_amount;
+                DELETE FROM daily_sales_summary WHERE transactions = 0;
+            END
+        ''')
+        self._backfill_sales_rollups(cursor)
+    
+    def _backfill_sales_rollups(self, cursor, schemas: Iterable[str] = ('main',)) -> int:
+        """Recompute the rollup from the sales tables in schemas; returns the rows written"""
+        sales = ' UNION ALL '.join(f"SELECT sale_date, payment_method, total_amount FROM {schema}.sales"
+                                   for schema in schemas)
+        cursor.execute("DELETE FROM daily_sales_summary")
+        cursor.execute(f'''
+            INSERT INTO daily_sales_summary (day, payment_method, transactions, gross_amount)
+            SELECT substr(sale_date, 1, 10), COALESCE(payment_method, ''), COUNT(*), SUM(total_amount)
+            FROM ({sales})
+            GROUP BY 1, 2
+        ''')
+        return cursor.rowcount
+    
+    def _create_drug_sales_rollup(self, cursor):
+        """Create the per-drug per-day rollup behind get_top_drugs.
+        
+        Maintained by a trigger on sale_items and backfilled from existing
+        line items when first created.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'drug_daily_sales'")
+        if cursor.fetchone():
+            return
+        
+        cursor.execute('''
+            CREATE TABLE drug_daily_sales (
+                day TEXT NOT NULL,
+                drug_id INTEGER NOT NULL,
+                units INTEGER NOT NULL,
+                revenue REAL NOT NULL,
+                PRIMARY KEY (day, drug_id)
+            ) WITHOUT ROWID
+        ''')
+        # The sale row is always inserted before its items, so its date is known
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS sale_items_rollup_insert AFTER INSERT ON sale_items BEGIN
+                INSERT INTO drug_daily_sales (day, drug_id, units, revenue)
+                SELECT substr(sale_date, 1, 10), new.drug_id, new.quantity, new.total_price
+                FROM sales WHERE id = new.sale_id
+                ON CONFLICT (day, drug_id) DO UPDATE SET
+                    units = units + excluded.units,
+                    revenue = revenue + excluded.revenue;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS sale_items_rollup_update
+            AFTER UPDATE OF quantity, total_price ON sale_items BEGIN
+                UPDATE drug_daily_sales
+                SET units = units + new.quantity - old.quantity,
+                    revenue = revenue + new.total_price - old.total_price
+                WHERE drug_id = new.drug_id
+                  AND day = (SELECT substr(sale_date, 1, 10) FROM sales WHERE id = new.sale_id);
+            END
+        ''')
+        self._backfill_drug_sales_rollup(cursor)
+    
+    def _backfill_drug_sales_rollup(self, cursor, schemas: Iterable[str] = ('main',)) -> int:
+        """Recompute drug_daily_sales from the line items in schemas; returns the rows written"""
+        items = ' UNION ALL '.join(f'''
+            SELECT s.sale_date, si.drug_id, si.quantity, si.total_price
+            FROM {schema}.sale_items si
+            JOIN {schema}.sales s ON s.id = si.sale_id
+        ''' for schema in schemas)
+        cursor.execute("DELETE FROM drug_daily_sales")
+        cursor.execute(f'''
+            INSERT INTO drug_daily_sales (day, drug_id, units, revenue)
+            SELECT substr(sale_date, 1, 10), drug_id, SUM(quantity), SUM(total_price)
+            FROM ({items})
+            GROUP BY 1, 2
+        ''')
+        return cursor.rowcount
+    
+    def rebuild_sales_rollups(self) -> Optional[Dict[str, int]]:
+        """Rebuild the sales rollup tables from scratch (see maintenance.py)
+        
+        Archived years are included. Returns the number of rows written per
+        table.
+        """
+        try:
+            with self._write_lock:
+                # ATTACH is not allowed inside a transaction, so attach first
+                schemas = ['main'] + self._archive_schemas(self.connection)
+                try:
+                    with self.transaction() as cursor:
+                        return {
+                            'daily_sales_summary': self._backfill_sales_rollups(cursor, schemas),
+                            'drug_daily_sales': self._backfill_drug_sales_rollup(cursor, schemas),
+                        }
+                finally:
+                    self._detach_archives(self.connection)
         except Exception as e:
-            print(f"Database initialization error: {e}")
-            raise
+            print(f"Error rebuilding sales rollups: {e}")
+            return None
     
     def insert_sample_drugs(self):
         """Insert sample Ghanaian pharmacy drugs"""
@@ -146,31 +624,36 @@ class DatabaseManager:
             ('Iron Supplement', 'Ferrous Sulfate', '325mg', 'Tablet', 'BATCH010', '2025-08-20', 4.00, 90)
         ]
         
-        cursor = self.connection.cursor()
-        for drug in sample_drugs:
-            cursor.execute('''
+        with self.transaction() as cursor:
+            cursor.executemany('''
                 INSERT INTO drugs (generic_name, brand_name, dosage, form, batch_number, 
                                  expiry_date, unit_price, quantity_in_stock)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', drug)
-        
-        self.connection.commit()
+            ''', sample_drugs)
+            cursor.execute("SELECT id, quantity_in_stock FROM drugs")
+            self._record_movements(cursor, cursor.fetchall(), 'receipt')
+            self._reconcile_lots(cursor)
+        self._invalidate_catalog()
     
     # Drug Management Methods
     def add_drug(self, drug_data: Dict) -> bool:
         """Add a new drug to inventory"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                INSERT INTO drugs (generic_name, brand_name, dosage, form, batch_number,
-                                 expiry_date, unit_price, quantity_in_stock, reorder_level)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                drug_data['generic_name'], drug_data['brand_name'], drug_data['dosage'],
-                drug_data['form'], drug_data['batch_number'], drug_data['expiry_date'],
-                drug_data['unit_price'], drug_data['quantity_in_stock'], drug_data.get('reorder_level', 10)
-            ))
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO drugs (generic_name, brand_name, dosage, form, batch_number,
+                                     expiry_date, unit_price, quantity_in_stock, reorder_level)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    drug_data['generic_name'], drug_data['brand_name'], drug_data['dosage'],
+                    drug_data['form'], drug_data['batch_number'], drug_data['expiry_date'],
+                    drug_data['unit_price'], drug_data['quantity_in_stock'], drug_data.get('reorder_level', 10)
+                ))
+                drug_id = cursor.lastrowid
+                self._record_movements(cursor, [(drug_id, drug_data['quantity_in_stock'])], 'receipt')
+                self._reconcile_lots(cursor, [drug_id])
+                changes = self._read_catalog_changes(cursor, [drug_id])
+            self._apply_catalog_changes(changes)
             return True
         except Exception as e:
             print(f"Error adding drug: {e}")
@@ -179,31 +662,163 @@ class DatabaseManager:
     def update_drug(self, drug_id: int, drug_data: Dict) -> bool:
         """Update existing drug information"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                UPDATE drugs SET generic_name=?, brand_name=?, dosage=?, form=?, 
-                               batch_number=?, expiry_date=?, unit_price=?, 
-                               quantity_in_stock=?, reorder_level=?, updated_at=CURRENT_TIMESTAMP
-                WHERE id=?
-            ''', (
-                drug_data['generic_name'], drug_data['brand_name'], drug_data['dosage'],
-                drug_data['form'], drug_data['batch_number'], drug_data['expiry_date'],
-                drug_data['unit_price'], drug_data['quantity_in_stock'], 
-                drug_data.get('reorder_level', 10), drug_id
-            ))
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute("SELECT quantity_in_stock FROM drugs WHERE id = ?", (drug_id,))
+                row = cursor.fetchone()
+                if row:
+                    self._record_movements(
+                        cursor, [(drug_id, drug_data['quantity_in_stock'] - row[0])], 'adjustment')
+                cursor.execute('''
+                    UPDATE drugs SET generic_name=?, brand_name=?, dosage=?, form=?, 
+                                   batch_number=?, expiry_date=?, unit_price=?, 
+                                   quantity_in_stock=?, reorder_level=?, updated_at=CURRENT_TIMESTAMP
+                    WHERE id=?
+                ''', (
+                    drug_data['generic_name'], drug_data['brand_name'], drug_data['dosage'],
+                    drug_data['form'], drug_data['batch_number'], drug_data['expiry_date'],
+                    drug_data['unit_price'], drug_data['quantity_in_stock'], 
+                    drug_data.get('reorder_level', 10), drug_id
+                ))
+                self._reconcile_lots(cursor, [drug_id])
+                changes = self._read_catalog_changes(cursor, [drug_id])
+            self._apply_catalog_changes(changes)
             return True
         except Exception as e:
             print(f"Error updating drug: {e}")
             return False
     
+    def import_drugs(self, drugs: Iterable[Dict], batch_size: int = IMPORT_BATCH_SIZE,
+                     progress_callback: Optional[Callable[[int], None]] = None) -> Optional[Dict]:
+        """Bulk load drugs, updating any that already exist
+        
+        Rows are streamed into a staging table in batches, then merged into
+        drugs in the same transaction, matching on generic name, brand name,
+        dosage and batch number. A later row with the same key wins.
+        progress_callback receives the number of rows staged so far.
+        
+        Returns counts (staged, inserted, updated), seconds and
+        rows_per_second, or None if the import failed and was rolled back.
+        """
+        try:
+            started = time.perf_counter()
+            staged = 0
+            rows = iter(drugs)
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS drug_import_staging (
+                        generic_name TEXT NOT NULL,
+                        brand_name TEXT NOT NULL,
+                        dosage TEXT NOT NULL,
+                        batch_number TEXT NOT NULL,
+                        form TEXT NOT NULL,
+                        expiry_date DATE NOT NULL,
+                        unit_price REAL NOT NULL,
+                        quantity_in_stock INTEGER NOT NULL,
+                        reorder_level INTEGER NOT NULL,
+                        PRIMARY KEY (generic_name, brand_name, dosage, batch_number)
+                    )
+                ''')
+                cursor.execute("DELETE FROM drug_import_staging")
+                
+                while True:
+                    batch = [(drug['generic_name'], drug['brand_name'], drug['dosage'],
+                              drug['batch_number'], drug['form'], drug['expiry_date'],
+                              drug['unit_price'], drug['quantity_in_stock'],
+                              drug.get('reorder_level', 10))
+                             for drug in islice(rows, batch_size)]
+                    if not batch:
+                        break
+                    cursor.executemany('''
+                        INSERT OR REPLACE INTO drug_import_staging
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', batch)
+                    staged += len(batch)
+                    if progress_callback:
+                        progress_callback(staged)
+                
+                # Ledger entries for the stock changes the merge is about to make
+                cursor.execute('''
+                    INSERT INTO stock_movements (drug_id, quantity_change, reason)
+                    SELECT drugs.id, st.quantity_in_stock - drugs.quantity_in_stock, 'import'
+                    FROM drug_import_staging st
+                    JOIN drugs ON drugs.generic_name = st.generic_name
+                              AND drugs.brand_name = st.brand_name
+                              AND drugs.dosage = st.dosage
+                              AND drugs.batch_number = st.batch_number
+                    WHERE st.quantity_in_stock != drugs.quantity_in_stock
+                ''')
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM drugs")
+                last_drug_id = cursor.fetchone()[0]
+                
+                cursor.execute('''
+                    UPDATE drugs
+                    SET form = st.form,
+                        expiry_date = st.expiry_date,
+                        unit_price = st.unit_price,
+                        quantity_in_stock = st.quantity_in_stock,
+                        reorder_level = st.reorder_level,
+                        updated_at = CURRENT_TIMESTAMP
+                    FROM drug_import_staging st
+                    WHERE drugs.generic_name = st.generic_name
+                      AND drugs.brand_name = st.brand_name
+                      AND drugs.dosage = st.dosage
+                      AND drugs.batch_number = st.batch_number
+                ''')
+                updated = cursor.rowcount
+                
+                cursor.execute('''
+                    INSERT INTO drugs (generic_name, brand_name, dosage, form, batch_number,
+                                       expiry_date, unit_price, quantity_in_stock, reorder_level)
+                    SELECT generic_name, brand_name, dosage, form, batch_number,
+                           expiry_date, unit_price, quantity_in_stock, reorder_level
+                    FROM drug_import_staging st
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM drugs
+                        WHERE drugs.generic_name = st.generic_name
+                          AND drugs.brand_name = st.brand_name
+                          AND drugs.dosage = st.dosage
+                          AND drugs.batch_number = st.batch_number
+                    )
+                ''')
+                inserted = cursor.rowcount
+                cursor.execute('''
+                    INSERT INTO stock_movements (drug_id, quantity_change, reason)
+                    SELECT id, quantity_in_stock, 'import' FROM drugs
+                    WHERE id > ? AND quantity_in_stock != 0
+                ''', (last_drug_id,))
+                cursor.execute("DELETE FROM drug_import_staging")
+                self._reconcile_lots(cursor)
+            
+            self._invalidate_catalog()
+            seconds = time.perf_counter() - started
+            return {
+                'staged': staged,
+                'inserted': inserted,
+                'updated': updated,
+                'seconds': seconds,
+                'rows_per_second': staged / seconds if seconds > 0 else 0,
+            }
+        except Exception as e:
+            print(f"Error importing drugs: {e}")
+            return None
+    
     def get_drug(self, drug_id: int) -> Optional[Dict]:
         """Get drug by ID"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM drugs WHERE id = ?", (drug_id,))
-            row = cursor.fetchone()
-            return dict(row) if row else None
+            catalog = self._get_catalog()
+            with self._catalog_lock:
+                drug = catalog.get(drug_id)
+                if drug is not None:
+                    self.cache_stats['catalog_hits'] += 1
+                    return dict(drug)
+            
+            # Not cached yet (e.g. added by another terminal)
+            self.cache_stats['catalog_misses'] += 1
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                changes = self._read_catalog_changes(cursor, [drug_id])
+            self._apply_catalog_changes(changes)
+            return dict(changed[0]) if changed else None
         except Exception as e:
             print(f"Error getting drug: {e}")
             return None
@@ -212,16 +827,54 @@ class DatabaseManager:
         """Get drug by ID (alias for get_drug)"""
         return self.get_drug(drug_id)
     
-    def search_drugs(self, search_term: str) -> List[Dict]:
-        """Search drugs by name"""
+    def search_drugs(self, search_term: str, limit: Optional[int] = 50) -> List[Dict]:
+        """Search drugs by name, dosage or form
+        
+        Each word in the search term is matched as a prefix and results are
+        ranked best match first. Pass limit=None to return every match.
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                SELECT * FROM drugs 
-                WHERE generic_name LIKE ? OR brand_name LIKE ?
-                ORDER BY generic_name
-            ''', (f'%{search_term}%', f'%{search_term}%'))
-            return [dict(row) for row in cursor.fetchall()]
+            words = re.findall(r'\w+', search_term)
+            if not words:
+                return []
+            
+            catalog = self._get_catalog()
+            
+            # The search index supplies the matching ids; rows come from the cache
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                if self.fts_enabled:
+                    match = ' '.join(f'"{word}"*' for word in words)
+                    cursor.execute('''
+                        SELECT rowid FROM drugs_fts
+                        WHERE drugs_fts MATCH ?
+                        ORDER BY bm25(drugs_fts, 10.0, 10.0, 1.0, 1.0)
+                        LIMIT ?
+                    ''', (match, -1 if limit is None else limit))
+                else:
+                    # Without FTS5 every word must appear in one of the same columns
+                    columns = ('generic_name', 'brand_name', 'dosage', 'form')
+                    word_match = '(' + ' OR '.join(f"{column} LIKE ? ESCAPE '!'" for column in columns) + ')'
+                    cursor.execute(f'''
+                        SELECT id FROM drugs
+                        WHERE {' AND '.join([word_match] * len(words))}
+                        ORDER BY generic_name, id
+                        LIMIT ?
+                    ''', [f"%{word.replace('_', '!_')}%" for word in words for _ in columns]
+                        + [-1 if limit is None else limit])
+                drug_ids = [row[0] for row in cursor.fetchall()]
+            
+            missing = [drug_id for drug_id in drug_ids if drug_id not in catalog]
+            if missing:
+                self.cache_stats['catalog_misses'] += 1
+                with self.reader() as conn:
+                    cursor = conn.cursor()
+                    self._patch_catalog(self._fetch_drug_rows(cursor, missing))
+            else:
+                self.cache_stats['catalog_hits'] += 1
+            
+            with self._catalog_lock:
+                return [dict(catalog[drug_id]) for drug_id in drug_ids if drug_id in catalog]
         except Exception as e:
             print(f"Error searching drugs: {e}")
             return []
@@ -229,74 +882,639 @@ class DatabaseManager:
     def get_all_drugs(self) -> List[Dict]:
         """Get all drugs"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM drugs ORDER BY generic_name")
-            return [dict(row) for row in cursor.fetchall()]
+            with self._catalog_lock:
+                drugs = [dict(drug) for drug in self._sorted_catalog()]
+            self.cache_stats['catalog_hits'] += 1
+            return drugs
         except Exception as e:
             print(f"Error getting all drugs: {e}")
             return []
     
-    def update_stock(self, drug_id: int, quantity: int) -> bool:
-        """Update drug stock quantity"""
+    def get_drugs_page(self, cursor_token: Optional[str] = None,
+                       page_size: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of drugs ordered by generic name
+        
+        Returns (drugs, next_cursor); pass next_cursor back to get the
+        following page. next_cursor is None on the last page.
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                UPDATE drugs SET quantity_in_stock = quantity_in_stock + ?, 
-                               updated_at = CURRENT_TIMESTAMP
-                WHERE id = ?
-            ''', (quantity, drug_id))
-            self.connection.commit()
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                if cursor_token:
+                    cursor.execute('''
+                        SELECT * FROM drugs
+                        WHERE (generic_name, id) > (?, ?)
+                        ORDER BY generic_name, id
+                        LIMIT ?
+                    ''', (*self._decode_cursor(cursor_token), page_size + 1))
+                else:
+                    cursor.execute('''
+                        SELECT * FROM drugs
+                        ORDER BY generic_name, id
+                        LIMIT ?
+                    ''', (page_size + 1,))
+                return self._page(cursor.fetchall(), page_size, ('generic_name', 'id'))
+        except Exception as e:
+            print(f"Error getting drugs page: {e}")
+            return [], None
+    
+    def iter_drugs(self, batch_size: int = ITER_BATCH_SIZE) -> Iterator[Dict]:
+        """Yield every drug ordered by generic name, straight from the database
+        
+        Unlike get_all_drugs this bypasses the catalog cache and holds at
+        most batch_size rows in memory.
+        """
+        yield from self._iter_rows('''
+            SELECT * FROM drugs ORDER BY generic_name, id
+        ''', (), batch_size)
+    
+    # Drug Catalog Cache
+    def _get_catalog(self) -> Dict[int, Dict]:
+        """Return the cached catalog (drug id -> row), loading it if needed.
+        
+        When another connection (e.g. a second terminal) has committed since
+        the last check, detected through the writer connection's PRAGMA
+        data_version, the drugs it changed are read from the drug_changes log
+        and the stock ledger and patched in; the catalog is only reloaded when
+        that list is long.
+        """
+        with self._catalog_lock:
+            if self._catalog is not None:
+                if self._catalog_changed_externally():
+                    self._refresh_catalog()
+                if self._catalog is not None:
+                    return self._catalog
+            
+            version = self._data_version()
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                # Read the log positions first so changes made meanwhile are picked up next time
+                cursor.execute("SELECT COALESCE(MAX(seq), 0) FROM drug_changes")
+                seq = cursor.fetchone()[0]
+                cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements")
+                movement_id = cursor.fetchone()[0]
+                cursor.execute("SELECT * FROM drugs")
+                self._catalog = {row['id']: dict(row) for row in cursor.fetchall()}
+            self._catalog_sorted = None
+            self._catalog_version = version
+            self._catalog_seq = seq
+            self._catalog_movement_id = movement_id
+            self.cache_stats['catalog_misses'] += 1
+            self.cache_stats['catalog_reloads'] += 1
+            return self._catalog
+    
+    def _refresh_catalog(self):
+        """Patch in the drugs changed since the catalog last read the change logs"""
+        version = self._data_version()
+        with self.reader() as conn:
+            changes = self._read_catalog_changes(conn.cursor())
+        
+        self._catalog_version = version
+        if changes is None:
+            self._invalidate_catalog()
+        elif changes[0]:
+            self._apply_catalog_changes(changes)
+            self.cache_stats['catalog_refreshes'] += 1
+    
+    def _read_catalog_changes(self, cursor, drug_ids: Iterable[int] = ()) -> Optional[Tuple]:
+        """Read the drugs changed since the catalog's log positions, plus drug_ids
+        
+        Writes call this inside their transaction, so the positions move past
+        their own changes and a later refresh does not read them again.
+        Returns (drug ids, current rows, log positions), or None when more
+        than CATALOG_REFRESH_LIMIT entries are new and a reload is cheaper.
+        """
+        drug_ids = set(drug_ids)
+        seq, movement_id = self._catalog_seq, self._catalog_movement_id
+        if self._catalog is None:
+            return drug_ids, self._fetch_drug_rows(cursor, drug_ids), None
+        
+        cursor.execute('''
+            SELECT drug_id, seq FROM drug_changes WHERE seq > ? ORDER BY seq LIMIT ?
+        ''', (seq, self.CATALOG_REFRESH_LIMIT + 1))
+        changes = cursor.fetchall()
+        cursor.execute('''
+            SELECT drug_id, id FROM stock_movements WHERE id > ? ORDER BY id LIMIT ?
+        ''', (movement_id, self.CATALOG_REFRESH_LIMIT + 1))
+        movements = cursor.fetchall()
+        if len(changes) > self.CATALOG_REFRESH_LIMIT or len(movements) > self.CATALOG_REFRESH_LIMIT:
+            return None
+        
+        drug_ids.update(row[0] for row in changes)
+        drug_ids.update(row[0] for row in movements)
+        positions = (changes[-1][1] if changes else seq, movements[-1][1] if movements else movement_id)
+        return drug_ids, self._fetch_drug_rows(cursor, drug_ids), positions
+    
+    def _apply_catalog_changes(self, changes: Optional[Tuple]):
+        """Write changes read by _read_catalog_changes through to the cached catalog"""
+        with self._catalog_lock:
+            if changes is None:
+                self._invalidate_catalog()
+                return
+            drug_ids, rows, positions = changes
+            # Rows read before the catalog was (re)loaded or refreshed past
+            # them may be older than what it holds
+            if (self._catalog is None or positions is None or positions[0] < self._catalog_seq
+                    or positions[1] < self._catalog_movement_id):
+                self._inventory_generation += 1
+                return
+            self._catalog_seq, self._catalog_movement_id = positions
+            found = {row['id'] for row in rows}
+            for drug_id in drug_ids - found:
+                if self._catalog.pop(drug_id, None):
+                    self._catalog_sorted = None
+            self._patch_catalog(rows)
+    
+    def _sorted_catalog(self) -> List[Dict]:
+        """Cached catalog rows ordered by generic name; read them with _catalog_lock held"""
+        with self._catalog_lock:
+            catalog = self._get_catalog()
+            if self._catalog_sorted is None:
+                self._catalog_sorted = sorted(catalog.values(),
+                                              key=lambda drug: (drug['generic_name'], drug['id']))
+            return self._catalog_sorted
+    
+    def _data_version(self) -> Optional[int]:
+        """PRAGMA data_version of the writer, or None if the writer is busy"""
+        if not self._write_lock.acquire(blocking=False):
+            return None
+        try:
+            return self.connection.execute("PRAGMA data_version").fetchone()[0]
+        finally:
+            self._write_lock.release()
+    
+    def _catalog_changed_externally(self) -> bool:
+        """True if another connection has written to the database since the catalog was checked"""
+        version = self._data_version()
+        # While our own writer is busy, keep serving the cache
+        return version is not None and version != self._catalog_version
+    
+    def _fetch_drug_rows(self, cursor, drug_ids: Iterable[int]) -> List[Dict]:
+        """Read current rows for the given drug ids with the caller's cursor"""
+        drug_ids = list(set(drug_ids))
+        if not drug_ids:
+            return []
+        placeholders = ','.join('?' * len(drug_ids))
+        cursor.execute(f"SELECT * FROM drugs WHERE id IN ({placeholders})", drug_ids)
+        return [dict(row) for row in cursor.fetchall()]
+    
+    def _patch_catalog(self, rows: List[Dict]):
+        """Write changed drug rows through to the cached catalog"""
+        with self._catalog_lock:
+            self._inventory_generation += 1
+            if self._catalog is None:
+                return
+            for row in rows:
+                cached = self._catalog.get(row['id'])
+                if cached is None or cached['generic_name'] != row['generic_name']:
+                    self._catalog_sorted = None
+                if cached is None:
+                    self._catalog[row['id']] = row
+                else:
+                    cached.update(row)
+    
+    def _invalidate_catalog(self):
+        """Drop the cached catalog so the next read reloads it"""
+        with self._catalog_lock:
+            self._inventory_generation += 1
+            self._catalog = None
+            self._catalog_sorted = None
+    
+    def get_cache_stats(self) -> Dict:
+        """Return cache hit/miss counters"""
+        stats = dict(self.cache_stats)
+        lookups = stats['catalog_hits'] + stats['catalog_misses']
+        stats['catalog_hit_rate'] = stats['catalog_hits'] / lookups if lookups else 0.0
+        stats['catalog_rows'] = len(self._catalog) if self._catalog is not None else 0
+        lookups = stats['settings_hits'] + stats['settings_misses']
+        stats['settings_hit_rate'] = stats['settings_hits'] / lookups if lookups else 0.0
+        lookups = stats['alerts_hits'] + stats['alerts_misses']
+        stats['alerts_hit_rate'] = stats['alerts_hits'] / lookups if lookups else 0.0
+        return stats
+    
+    def update_stock(self, drug_id: int, quantity: int, reason: str = 'adjustment') -> bool:
+        """Update drug stock quantity
+        
+        reason is recorded in the stock ledger ('adjustment' or 'write_off').
+        """
+        try:
+            with self.transaction() as cursor:
+                self._record_movements(cursor, [(drug_id, quantity)], reason)
+                cursor.execute('''
+                    UPDATE drugs SET quantity_in_stock = quantity_in_stock + ?, 
+                                   updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (quantity, drug_id))
+                self._reconcile_lots(cursor, [drug_id])
+                changes = self._read_catalog_changes(cursor, [drug_id])
+            self._apply_catalog_changes(changes)
             return True
         except Exception as e:
             print(f"Error updating stock: {e}")
             return False
     
+    def receive_stock(self, drug_id: int, batch_number: str, expiry_date: str, quantity: int) -> bool:
+        """Add a delivered batch as its own stock lot
+        
+        Earlier batches keep their expiry dates; the drug's batch number and
+        expiry date are set to the new batch.
+        """
+        try:
+            with self.transaction() as cursor:
+                self._add_to_lot(cursor, drug_id, batch_number, expiry_date, quantity)
+                self._record_movements(cursor, [(drug_id, quantity)], 'receipt')
+                cursor.execute('''
+                    UPDATE drugs SET quantity_in_stock = quantity_in_stock + ?,
+                                   batch_number = ?, expiry_date = ?,
+                                   updated_at = CURRENT_TIMESTAMP
+                    WHERE id = ?
+                ''', (quantity, batch_number, expiry_date, drug_id))
+                changes = self._read_catalog_changes(cursor, [drug_id])
+            self._apply_catalog_changes(changes)
+            return True
+        except Exception as e:
+            print(f"Error receiving stock: {e}")
+            return False
+    
+    def get_stock_lots(self, drug_id: int) -> List[Dict]:
+        """Get a drug's stock lots in dispensing (first-expiry-first-out) order"""
+        try:
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM stock_lots
+                    WHERE drug_id = ?
+                    ORDER BY expiry_date, batch_number
+                ''', (drug_id,))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error getting stock lots: {e}")
+            return []
+    
     def get_low_stock_drugs(self) -> List[Dict]:
         """Get drugs with low stock"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                SELECT * FROM drugs 
-                WHERE quantity_in_stock <= reorder_level
-                ORDER BY quantity_in_stock
-            ''')
-            return [dict(row) for row in cursor.fetchall()]
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT * FROM drugs 
+                    WHERE quantity_in_stock <= reorder_level
+                    ORDER BY quantity_in_stock
+                ''')
+                return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error getting low stock drugs: {e}")
             return []
     
     def get_expiring_drugs(self, days: int = 30) -> List[Dict]:
-        """Get drugs expiring within specified days"""
+        """Get drugs expiring within specified days
+        
+        Returns one row per stock lot still holding units, with the lot's
+        batch_number, expiry_date and lot_quantity in place of the drug's.
+        """
         try:
-            cursor = self.connection.cursor()
-            expiry_date = datetime.now() + timedelta(days=days)
-            cursor.execute('''
-                SELECT * FROM drugs 
-                WHERE expiry_date <= ?
-                ORDER BY expiry_date
-            ''', (expiry_date.date(),))
-            return [dict(row) for row in cursor.fetchall()]
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                expiry_date = datetime.now() + timedelta(days=days)
+                cursor.execute('''
+                    SELECT d.id, d.generic_name, d.brand_name, d.dosage, d.form,
+                           l.batch_number, l.expiry_date, d.unit_price, d.quantity_in_stock,
+                           d.reorder_level, d.created_at, d.updated_at, l.quantity as lot_quantity
+                    FROM stock_lots l
+                    JOIN drugs d ON d.id = l.drug_id
+                    WHERE l.quantity > 0 AND l.expiry_date <= ?
+                    ORDER BY l.expiry_date
+                ''', (expiry_date.date(),))
+                return [dict(row) for row in cursor.fetchall()]
         except Exception as e:
             print(f"Error getting expiring drugs: {e}")
             return []
     
+    def get_inventory_alerts(self, days: int = 30) -> Dict[str, List[Dict]]:
+        """Get low stock, out of stock and expiring drugs from one query
+        
+        Returns a dict with 'low_stock' (0 < stock <= reorder level),
+        'out_of_stock' and 'expiring' (one row per lot still holding units
+        that expires within days, with its batch_number, expiry_date,
+        lot_quantity and days_left). The result is cached until a drug or
+        its stock changes, here or on another connection, or the date rolls
+        over.
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        try:
+            with self._alerts_lock:
+                data_version = self._data_version()
+                if data_version is None and self._alerts_key:
+                    # Our own writer is busy; its changes bump the generation when done
+                    data_version = self._alerts_key[3]
+                key = (days, today, self._inventory_generation, data_version)
+                if self._alerts is not None and key == self._alerts_key:
+                    self.cache_stats['alerts_hits'] += 1
+                    return {category: list(rows) for category, rows in self._alerts.items()}
+                
+                cutoff = (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d')
+                with self.reader() as conn:
+                    cursor = conn.cursor()
+                    # Each branch reads only its own index: the partial stock alert
+                    # index, and the lot expiry index
+                    cursor.execute('''
+                        SELECT 'stock' as category, id, generic_name, brand_name, dosage, form,
+                               batch_number, expiry_date, unit_price, quantity_in_stock, reorder_level,
+                               NULL as lot_quantity, NULL as days_left
+                        FROM drugs
+                        WHERE quantity_in_stock <= reorder_level OR quantity_in_stock <= 0
+                        UNION ALL
+                        SELECT 'expiring', d.id, d.generic_name, d.brand_name, d.dosage, d.form,
+                               l.batch_number, l.expiry_date, d.unit_price, d.quantity_in_stock, d.reorder_level,
+                               l.quantity, CAST(julianday(l.expiry_date) - julianday(?) AS INTEGER)
+                        FROM stock_lots l
+                        JOIN drugs d ON d.id = l.drug_id
+                        WHERE l.quantity > 0 AND l.expiry_date <= ?
+                    ''', (today, cutoff))
+                    rows = [dict(row) for row in cursor.fetchall()]
+                
+                alerts = {'low_stock': [], 'out_of_stock': [], 'expiring': []}
+                for row in rows:
+                    if row.pop('category') == 'expiring':
+                        alerts['expiring'].append(row)
+                    elif row['quantity_in_stock'] <= 0:
+                        alerts['out_of_stock'].append(row)
+                    else:
+                        alerts['low_stock'].append(row)
+                alerts['low_stock'].sort(key=lambda row: row['quantity_in_stock'])
+                alerts['out_of_stock'].sort(key=lambda row: row['generic_name'])
+                alerts['expiring'].sort(key=lambda row: (row['expiry_date'], row['batch_number']))
+                
+                self._alerts = alerts
+                self._alerts_key = key
+                self.cache_stats['alerts_misses'] += 1
+                return {category: list(rows) for category, rows in alerts.items()}
+        except Exception as e:
+            print(f"Error getting inventory alerts: {e}")
+            return {'low_stock': [], 'out_of_stock': [], 'expiring': []}
+    
+    # Stock Lots
+    def _create_stock_lots(self, cursor):
+        """Create the stock lot tables, seeding one lot per drug when first created"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_lots'")
+        if cursor.fetchone():
+            return
+        
+        cursor.execute('''
+            CREATE TABLE stock_lots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                drug_id INTEGER NOT NULL,
+                batch_number TEXT NOT NULL,
+                expiry_date DATE NOT NULL,
+                quantity INTEGER NOT NULL,
+                received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (drug_id) REFERENCES drugs (id)
+            )
+        ''')
+        # Dispensing order, and one lot per drug/expiry/batch
+        cursor.execute('''
+            CREATE UNIQUE INDEX idx_stock_lots_fefo
+            ON stock_lots (drug_id, expiry_date, batch_number)
+        ''')
+        cursor.execute('''
+            CREATE INDEX idx_stock_lots_expiry
+            ON stock_lots (expiry_date) WHERE quantity > 0
+        ''')
+        cursor.execute('''
+            CREATE TABLE sale_item_lots (
+                sale_item_id INTEGER NOT NULL,
+                lot_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                PRIMARY KEY (sale_item_id, lot_id),
+                FOREIGN KEY (sale_item_id) REFERENCES sale_items (id),
+                FOREIGN KEY (lot_id) REFERENCES stock_lots (id)
+            ) WITHOUT ROWID
+        ''')
+        self._reconcile_lots(cursor)
+    
+    def _add_to_lot(self, cursor, drug_id: int, batch_number: str, expiry_date: str, quantity: int):
+        """Add units to a drug's lot, creating the lot if needed"""
+        cursor.execute('''
+            INSERT INTO stock_lots (drug_id, batch_number, expiry_date, quantity)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (drug_id, expiry_date, batch_number) DO UPDATE SET
+                quantity = quantity + excluded.quantity
+        ''', (drug_id, batch_number, expiry_date, quantity))
+    
+    def _allocate_lots(self, cursor, drug_id: int, quantity: int,
+                       sellable_from: Optional[str] = None) -> List[Tuple[int, int]]:
+        """Take units from a drug's lots, earliest expiry first.
+        
+        Returns (lot_id, quantity) for each lot drawn from. If the lots hold
+        fewer units than requested, everything left is taken. Pass
+        sellable_from (a YYYY-MM-DD date) to skip lots that expired before it.
+        """
+        unexpired = "AND expiry_date >= ?" if sellable_from else ""
+        cursor.execute(f'''
+            SELECT id, quantity FROM stock_lots
+            WHERE drug_id = ? AND quantity > 0 {unexpired}
+            ORDER BY expiry_date, batch_number
+        ''', (drug_id, sellable_from) if sellable_from else (drug_id,))
+        allocations = []
+        remaining = quantity
+        for lot_id, available in cursor.fetchall():
+            if remaining <= 0:
+                break
+            take = min(available, remaining)
+            allocations.append((lot_id, take))
+            remaining -= take
+        
+        cursor.executemany("UPDATE stock_lots SET quantity = quantity - ? WHERE id = ?",
+                           [(take, lot_id) for lot_id, take in allocations])
+        return allocations
+    
+    def _reconcile_lots(self, cursor, drug_ids: Optional[List[int]] = None):
+        """Bring lot totals in line with drugs.quantity_in_stock.
+        
+        Used after writes that set or adjust a drug's total directly: extra
+        units go to the lot for the drug's current batch and expiry date,
+        missing units are taken from the earliest-expiring lots. Pass None
+        to check every drug.
+        """
+        where = ""
+        if drug_ids is not None:
+            where = f"WHERE d.id IN ({', '.join('?' * len(drug_ids))})"
+        cursor.execute(f'''
+            SELECT id, batch_number, expiry_date, difference FROM (
+                SELECT d.id, d.batch_number, d.expiry_date,
+                       d.quantity_in_stock - COALESCE(
+                           (SELECT SUM(l.quantity) FROM stock_lots l WHERE l.drug_id = d.id), 0
+                       ) as difference
+                FROM drugs d
+                {where}
+            )
+            WHERE difference != 0
+        ''', drug_ids or ())
+        differences = cursor.fetchall()
+        
+        cursor.executemany('''
+            INSERT INTO stock_lots (drug_id, batch_number, expiry_date, quantity)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (drug_id, expiry_date, batch_number) DO UPDATE SET
+                quantity = quantity + excluded.quantity
+        ''', [(drug_id, batch_number, expiry_date, difference)
+              for drug_id, batch_number, expiry_date, difference in differences if difference > 0])
+        for drug_id, _, _, difference in differences:
+            if difference < 0:
+                self._allocate_lots(cursor, drug_id, -difference)
+    
+    # Stock Ledger
+    def _create_stock_ledger(self, cursor):
+        """Create the stock movement ledger and snapshot tables.
+        
+        When first created, current stock is recorded as an 'opening'
+        movement per drug and snapshotted, so history starts from here.
+        """
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stock_movements'")
+        if cursor.fetchone():
+            return
+        
+        cursor.execute('''
+            CREATE TABLE stock_movements (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                drug_id INTEGER NOT NULL,
+                quantity_change INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                reference_id INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (drug_id) REFERENCES drugs (id)
+            )
+        ''')
+        # Covers the movements-since-snapshot sum in get_stock_at
+        cursor.execute('''
+            CREATE INDEX idx_stock_movements_drug
+            ON stock_movements (drug_id, created_at, id, quantity_change)
+        ''')
+        cursor.execute('''
+            CREATE TABLE stock_snapshots (
+                drug_id INTEGER NOT NULL,
+                taken_at TIMESTAMP NOT NULL,
+                quantity INTEGER NOT NULL,
+                last_movement_id INTEGER NOT NULL,
+                PRIMARY KEY (drug_id, taken_at)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE stock_snapshot_runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                taken_at TIMESTAMP NOT NULL,
+                last_movement_id INTEGER NOT NULL
+            )
+        ''')
+        
+        cursor.execute("SELECT id, quantity_in_stock FROM drugs WHERE quantity_in_stock != 0")
+        self._record_movements(cursor, cursor.fetchall(), 'opening')
+        self._snapshot_stock(cursor)
+    
+    def _record_movements(self, cursor, changes: List[Tuple[int, int]], reason: str,
+                          reference_id: Optional[int] = None):
+        """Append (drug_id, quantity_change) entries to the stock ledger"""
+        cursor.executemany('''
+            INSERT INTO stock_movements (drug_id, quantity_change, reason, reference_id)
+            VALUES (?, ?, ?, ?)
+        ''', [(drug_id, change, reason, reference_id) for drug_id, change in changes if change])
+    
+    def _snapshot_stock(self, cursor) -> int:
+        """Snapshot every drug with movements since the previous run"""
+        cursor.execute('''
+            SELECT last_movement_id FROM stock_snapshot_runs
+            WHERE id = (SELECT MAX(id) FROM stock_snapshot_runs)
+        ''')
+        row = cursor.fetchone()
+        previous = row[0] if row else 0
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements")
+        latest = cursor.fetchone()[0]
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO stock_snapshots (drug_id, taken_at, quantity, last_movement_id)
+            SELECT id, CURRENT_TIMESTAMP, quantity_in_stock, ?
+            FROM drugs
+            WHERE id IN (SELECT drug_id FROM stock_movements WHERE id > ?)
+        ''', (latest, previous))
+        snapshotted = cursor.rowcount
+        cursor.execute('''
+            INSERT INTO stock_snapshot_runs (taken_at, last_movement_id)
+            VALUES (CURRENT_TIMESTAMP, ?)
+        ''', (latest,))
+        return snapshotted
+    
+    def take_stock_snapshot(self, force: bool = False) -> Optional[int]:
+        """Snapshot stock for drugs that moved since the last snapshot
+        
+        Skipped (returns 0) if the last snapshot is newer than
+        SNAPSHOT_INTERVAL_HOURS, unless force is set. Returns the number of
+        drugs snapshotted, or None on error.
+        """
+        try:
+            with self.transaction() as cursor:
+                if not force:
+                    cursor.execute('''
+                        SELECT 1 FROM stock_snapshot_runs
+                        WHERE id = (SELECT MAX(id) FROM stock_snapshot_runs)
+                          AND taken_at > datetime('now', ?)
+                    ''', (f"-{self.SNAPSHOT_INTERVAL_HOURS} hours",))
+                    if cursor.fetchone():
+                        return 0
+                return self._snapshot_stock(cursor)
+        except Exception as e:
+            print(f"Error taking stock snapshot: {e}")
+            return None
+    
+    def get_stock_at(self, at: str, drug_id: Optional[int] = None) -> Dict[int, int]:
+        """Get stock levels as they were at a point in time
+        
+        at is a 'YYYY-MM-DD HH:MM:SS' timestamp, or a date meaning the start
+        of that day. Each drug's level is its nearest earlier snapshot plus
+        the movements recorded after it. Returns drug id -> quantity for one
+        drug or, if drug_id is None, for all drugs.
+        """
+        try:
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute(f'''
+                    SELECT d.id,
+                           COALESCE(s.quantity, 0) + COALESCE((
+                               SELECT SUM(m.quantity_change) FROM stock_movements m
+                               WHERE m.drug_id = d.id
+                                 AND m.created_at >= COALESCE(s.taken_at, '')
+                                 AND m.created_at < :at
+                                 AND m.id > COALESCE(s.last_movement_id, 0)
+                           ), 0) as quantity
+                    FROM drugs d
+                    LEFT JOIN stock_snapshots s
+                      ON s.drug_id = d.id
+                     AND s.taken_at = (
+                         SELECT MAX(taken_at) FROM stock_snapshots
+                         WHERE drug_id = d.id AND taken_at < :at
+                     )
+                    {"WHERE d.id = :drug_id" if drug_id is not None else ""}
+                ''', {'at': at, 'drug_id': drug_id})
+                return {row[0]: row[1] for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"Error getting stock at {at}: {e}")
+            return {}
+    
     # Sales Management Methods
     def create_sale(self, sale_data: Dict) -> Optional[int]:
         """Create a new sale transaction"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                INSERT INTO sales (receipt_number, total_amount, payment_method, 
-                                 customer_name, customer_phone, cashier_name)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                sale_data['receipt_number'], sale_data['total_amount'],
-                sale_data.get('payment_method', 'Cash'), sale_data.get('customer_name', ''),
-                sale_data.get('customer_phone', ''), sale_data['cashier_name']
-            ))
-            sale_id = cursor.lastrowid
-            self.connection.commit()
-            return sale_id
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    INSERT INTO sales (receipt_number, total_amount, payment_method, 
+                                     customer_name, customer_phone, cashier_name)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    sale_data['receipt_number'], sale_data['total_amount'],
+                    sale_data.get('payment_method', 'Cash'), sale_data.get('customer_name', ''),
+                    sale_data.get('customer_phone', ''), sale_data['cashier_name']
+                ))
+                sale_id = cursor.lastrowid
+                return sale_id
         except Exception as e:
             print(f"Error creating sale: {e}")
             return None
@@ -304,131 +1522,763 @@ class DatabaseManager:
     def add_sale_item(self, sale_id: int, item_data: Dict) -> bool:
         """Add item to sale"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                INSERT INTO sale_items (sale_id, drug_id, quantity, unit_price, total_price)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (
-                sale_id, item_data['drug_id'], item_data['quantity'],
-                item_data['unit_price'], item_data['total_price']
-            ))
-            
-            # Update stock
-            cursor.execute('''
-                UPDATE drugs SET quantity_in_stock = quantity_in_stock - ?
-                WHERE id = ?
-            ''', (item_data['quantity'], item_data['drug_id']))
+            with self.transaction() as cursor:
+                shortage = self._record_sale_item(cursor, sale_id, item_data)
+                if shortage:
+                    raise InsufficientStockError([shortage])
+                changes = self._read_catalog_changes(cursor, [item_data['drug_id']])
             
-            self.connection.commit()
+            self._apply_catalog_changes(changes)
             return True
         except Exception as e:
             print(f"Error adding sale item: {e}")
             return False
     
-    def get_sale(self, sale_id: int) -> Optional[Dict]:
-        """Get sale by ID"""
+    def _record_sale_item(self, cursor, sale_id: int, item: Dict) -> Optional[Dict]:
+        """Take an item's quantity out of stock and record it against the sale.
+        
+        The decrement only applies if enough unexpired stock remains, so two
+        terminals selling the last units cannot both succeed and units in
+        expired lots are never sold. Returns a shortage dict (see
+        InsufficientStockError) and records nothing if stock is short.
+        Otherwise units are dispensed from the earliest-expiring unexpired
+        lots and the lots used are recorded in sale_item_lots.
+        """
+        today = datetime.now().strftime('%Y-%m-%d')
+        cursor.execute('''
+            UPDATE drugs SET quantity_in_stock = quantity_in_stock - ?,
+                           updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND quantity_in_stock >= ?
+              AND (SELECT COALESCE(SUM(quantity), 0) FROM stock_lots
+                   WHERE drug_id = drugs.id AND quantity > 0 AND expiry_date >= ?) >= ?
+        ''', (item['quantity'], item['drug_id'], item['quantity'], today, item['quantity']))
+        if cursor.rowcount == 0:
+            cursor.execute('''
+                SELECT d.generic_name, d.brand_name, d.quantity_in_stock,
+                       (SELECT COALESCE(SUM(l.quantity), 0) FROM stock_lots l
+                        WHERE l.drug_id = d.id AND l.quantity > 0 AND l.expiry_date >= ?) as sellable
+                FROM drugs d WHERE d.id = ?
+            ''', (today, item['drug_id']))
+            drug = cursor.fetchone()
+            available = max(min(drug['quantity_in_stock'], drug['sellable']), 0) if drug else 0
+            return {
+                'drug_id': item['drug_id'],
+                'generic_name': drug['generic_name'] if drug else f"Drug #{item['drug_id']}",
+                'brand_name': drug['brand_name'] if drug else '',
+                'requested': item['quantity'],
+                'available': available,
+                'expired': max(drug['quantity_in_stock'] - available, 0) if drug else 0,
+            }
+        
+        cursor.execute('''
+            INSERT INTO sale_items (sale_id, drug_id, quantity, unit_price, total_price)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (sale_id, item['drug_id'], item['quantity'], item['unit_price'], item['total_price']))
+        sale_item_id = cursor.lastrowid
+        self._record_movements(cursor, [(item['drug_id'], -item['quantity'])], 'sale', sale_item_id)
+        
+        allocations = self._allocate_lots(cursor, item['drug_id'], item['quantity'], today)
+        cursor.executemany('''
+            INSERT INTO sale_item_lots (sale_item_id, lot_id, quantity)
+            VALUES (?, ?, ?)
+        ''', [(sale_item_id, lot_id, quantity) for lot_id, quantity in allocations])
+        return None
+
+    def checkout(self, sale_data: Dict, items: List[Dict]) -> Optional[int]:
+        """Record a complete sale (header, items and stock) in a single transaction
+
+        Returns the new sale id, or None if anything failed; on failure the
+        whole sale is rolled back so no partial header or stock change remains.
+        If sale_data has no receipt_number one is allocated inside the same
+        transaction and written back into sale_data.
+        
+        Raises InsufficientStockError, listing every short line, if any item
+        asks for more than is in stock; nothing is saved in that case.
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM sales WHERE id = ?", (sale_id,))
-            sale = cursor.fetchone()
-            if sale:
-                sale_dict = dict(sale)
-                # Get sale items
+            with self.transaction() as cursor:
+                if not sale_data.get('receipt_number'):
+                    sale_data['receipt_number'] = self._allocate_receipt_number(cursor)
+            
                 cursor.execute('''
-                    SELECT si.*, d.generic_name, d.brand_name, d.dosage, d.form
-                    FROM sale_items si
-                    JOIN drugs d ON si.drug_id = d.id
-                    WHERE si.sale_id = ?
-                ''', (sale_id,))
-                sale_dict['items'] = [dict(row) for row in cursor.fetchall()]
-                return sale_dict
+                    INSERT INTO sales (receipt_number, total_amount, payment_method,
+                                     customer_name, customer_phone, cashier_name)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (
+                    sale_data['receipt_number'], sale_data['total_amount'],
+                    sale_data.get('payment_method', 'Cash'), sale_data.get('customer_name', ''),
+                    sale_data.get('customer_phone', ''), sale_data['cashier_name']
+                ))
+                sale_id = cursor.lastrowid
+
+                # Items, lot allocations and stock; check every line before giving up
+                shortages = [shortage for shortage in
+                             (self._record_sale_item(cursor, sale_id, item) for item in items)
+                             if shortage]
+                if shortages:
+                    raise InsufficientStockError(shortages)
+                changes = self._read_catalog_changes(cursor, [item['drug_id'] for item in items])
+
+            self._apply_catalog_changes(changes)
+            return sale_id
+        except InsufficientStockError as e:
+            # Our cached stock for these drugs was out of date; refresh it
+            with self.reader() as conn:
+                self._patch_catalog(self._fetch_drug_rows(
+                    conn.cursor(), [shortage['drug_id'] for shortage in e.shortages]))
+            raise
+        except Exception as e:
+            print(f"Error during checkout: {e}")
             return None
+
+    def get_sale(self, sale_id: int) -> Optional[Dict]:
+        """Get sale by ID"""
+        try:
+            with self.reader() as conn:
+                schema = self._sale_schema(conn, sale_id)
+                if schema is None:
+                    return None
+                cursor = conn.cursor()
+                cursor.execute(f"SELECT * FROM {schema}.sales WHERE id = ?", (sale_id,))
+                sale = cursor.fetchone()
+                if sale:
+                    sale_dict = dict(sale)
+                    # Get sale items
+                    sale_dict['items'] = list(self.iter_sale_items(sale_id=sale_id))
+                    return sale_dict
+                return None
         except Exception as e:
             print(f"Error getting sale: {e}")
             return None
     
     def get_sales_by_date(self, start_date: str, end_date: str) -> List[Dict]:
-        """Get sales within date range"""
+        """Get sales within date range
+        
+        Returns [] if reading fails, never a partial list; iterate
+        iter_sales_by_date to have the failure raised instead.
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                SELECT * FROM sales 
-                WHERE DATE(sale_date) BETWEEN ? AND ?
-                ORDER BY sale_date DESC
-            ''', (start_date, end_date))
-            return [dict(row) for row in cursor.fetchall()]
+            return list(self.iter_sales_by_date(start_date, end_date))
         except Exception as e:
             print(f"Error getting sales by date: {e}")
             return []
     
+    def iter_sales_by_date(self, start_date: str, end_date: str,
+                           batch_size: int = ITER_BATCH_SIZE) -> Iterator[Dict]:
+        """Yield sales within date range, newest first, batch_size rows at a time"""
+        start, end = self._date_range(start_date, end_date)
+        with self.reader() as conn:
+            sql, params = self._sales_union(conn, '''
+                SELECT * FROM {db}.sales
+                WHERE sale_date >= ? AND sale_date < ?
+            ''', (start, end), start, end, "ORDER BY sale_date DESC")
+            yield from self._iter_rows(sql, params, batch_size)
+    
+    def iter_sale_items(self, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                        sale_id: Optional[int] = None,
+                        batch_size: int = ITER_BATCH_SIZE) -> Iterator[Dict]:
+        """Yield sale items with their drug names
+        
+        Pass sale_id for the items of one sale, or a date range for the items
+        of every sale in it (with sale_date and receipt_number attached).
+        """
+        # Hold one reader throughout: archives are attached per connection
+        with self.reader() as conn:
+            if sale_id is not None:
+                schema = self._sale_schema(conn, sale_id) or 'main'
+                yield from self._iter_rows(f'''
+                    SELECT si.*, d.generic_name, d.brand_name, d.dosage, d.form
+                    FROM {schema}.sale_items si
+                    JOIN drugs d ON si.drug_id = d.id
+                    WHERE si.sale_id = ?
+                ''', (sale_id,), batch_size)
+            else:
+                start, end = self._date_range(start_date, end_date)
+                sql, params = self._sales_union(conn, '''
+                    SELECT si.*, s.sale_date, s.receipt_number,
+                           d.generic_name, d.brand_name, d.dosage, d.form
+                    FROM {db}.sales s
+                    JOIN {db}.sale_items si ON si.sale_id = s.id
+                    JOIN drugs d ON si.drug_id = d.id
+                    WHERE s.sale_date >= ? AND s.sale_date < ?
+                ''', (start, end), start, end, "ORDER BY sale_date, sale_id, id")
+                yield from self._iter_rows(sql, params, batch_size)
+    
+    def _iter_rows(self, sql: str, params: Tuple, batch_size: int) -> Iterator[Dict]:
+        """Run a query on a pooled reader and yield its rows as dicts.
+        
+        Rows are pulled with fetchmany so only one batch is materialized at a
+        time. The reader connection is held until the generator is exhausted
+        or closed. Errors propagate to the caller, so a failure part way
+        through is never mistaken for the end of the rows.
+        """
+        with self.reader() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield dict(row)
+            finally:
+                cursor.close()
+    
+    def get_sales_page(self, start_date: str, end_date: str, cursor_token: Optional[str] = None,
+                       page_size: int = 100) -> Tuple[List[Dict], Optional[str]]:
+        """Get one page of sales within date range, newest first
+        
+        Each sale carries item_count (line items) and unit_count (total
+        quantity), aggregated in the same query. Returns (sales, next_cursor)
+        like get_drugs_page.
+        """
+        try:
+            start, end = self._date_range(start_date, end_date)
+            params = [start, end]
+            keyset = ""
+            if cursor_token:
+                keyset = "AND (sale_date, id) < (?, ?)"
+                params.extend(self._decode_cursor(cursor_token))
+            params.append(page_size + 1)
+            
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                # Pick the page first so only its items are joined and grouped;
+                # with archives in range each one contributes a page, then merged
+                sql, params = self._sales_union(conn, f'''
+                    SELECT s.*, COUNT(si.id) as item_count,
+                           COALESCE(SUM(si.quantity), 0) as unit_count
+                    FROM (
+                        SELECT * FROM {{db}}.sales
+                        WHERE sale_date >= ? AND sale_date < ? {keyset}
+                        ORDER BY sale_date DESC, id DESC
+                        LIMIT ?
+                    ) s
+                    LEFT JOIN {{db}}.sale_items si ON si.sale_id = s.id
+                    GROUP BY s.id
+                ''', params, start, end, "ORDER BY sale_date DESC, id DESC LIMIT ?")
+                cursor.execute(sql, params + [page_size + 1])
+                return self._page(cursor.fetchall(), page_size, ('sale_date', 'id'))
+        except Exception as e:
+            print(f"Error getting sales page: {e}")
+            return [], None
+    
+    def get_sales_summary(self, start_date: str, end_date: str) -> Dict:
+        """Get transaction count and total amount for a date range"""
+        try:
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT COALESCE(SUM(transactions), 0) as total_transactions,
+                           COALESCE(SUM(gross_amount), 0) as total_amount
+                    FROM daily_sales_summary
+                    WHERE day >= ? AND day <= ?
+                ''', (start_date, end_date))
+                return dict(cursor.fetchone())
+        except Exception as e:
+            print(f"Error getting sales summary: {e}")
+            return {'total_transactions': 0, 'total_amount': 0}
+    
     def get_daily_sales(self, date: str) -> Dict:
         """Get daily sales summary"""
+        return self.get_sales_summary(date, date)
+    
+    def get_daily_sales_range(self, start_date: str, end_date: str) -> List[Dict]:
+        """Get one summary row per day with sales in the range, oldest first
+        
+        Each row has day, total_transactions, total_amount and
+        payment_methods (method -> {'transactions', 'amount'}).
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                SELECT COUNT(*) as total_transactions,
-                       SUM(total_amount) as total_amount
-                FROM sales 
-                WHERE DATE(sale_date) = ?
-            ''', (date,))
-            result = cursor.fetchone()
-            return dict(result) if result else {'total_transactions': 0, 'total_amount': 0}
-        except Exception as e:
-            print(f"Error getting daily sales: {e}")
-            return {'total_transactions': 0, 'total_amount': 0}
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT day, payment_method, transactions, gross_amount
+                    FROM daily_sales_summary
+                    WHERE day >= ? AND day <= ?
+                    ORDER BY day
+                ''', (start_date, end_date))
+                days = []
+                for row in cursor.fetchall():
+                    if not days or days[-1]['day'] != row['day']:
+                        days.append({'day': row['day'], 'total_transactions': 0,
+                                     'total_amount': 0, 'payment_methods': {}})
+                    summary = days[-1]
+                    summary['total_transactions'] += row['transactions']
+                    summary['total_amount'] += row['gross_amount']
+                    summary['payment_methods'][row['payment_method']] = {
+                        'transactions': row['transactions'], 'amount': row['gross_amount']}
+                return days
+        except Exception as e:
+            print(f"Error getting daily sales range: {e}")
+            return []
+    
+    def get_top_drugs(self, start_date: str, end_date: str, limit: int = 10) -> List[Dict]:
+        """Get the best-selling drugs in a date range by units sold
+        
+        Each row has rank, drug_id, generic_name, brand_name, units, revenue
+        and share (fraction of the range's line-item revenue).
+        """
+        try:
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    WITH totals AS (
+                        SELECT drug_id, SUM(units) AS units, SUM(revenue) AS revenue,
+                               SUM(SUM(revenue)) OVER () AS range_revenue
+                        FROM drug_daily_sales
+                        WHERE day >= ? AND day <= ?
+                        GROUP BY drug_id
+                    )
+                    SELECT RANK() OVER (ORDER BY t.units DESC) AS rank,
+                           t.drug_id, d.generic_name, d.brand_name, t.units, t.revenue,
+                           CASE WHEN t.range_revenue > 0 THEN t.revenue / t.range_revenue ELSE 0 END AS share
+                    FROM totals t
+                    LEFT JOIN drugs d ON d.id = t.drug_id
+                    ORDER BY t.units DESC, t.revenue DESC
+                    LIMIT ?
+                ''', (start_date, end_date, limit))
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error getting top drugs: {e}")
+            return []
+    
+    # Sales Archives
+    def archive_sales(self, year: int) -> Optional[Dict]:
+        """Move a closed year's sales into its own archive database (see maintenance.py)
+        
+        Sales, line items and their lot allocations go to pharmacy_<year>.db
+        beside the live database and are deleted here. The rollup tables keep
+        their rows, so reports are unchanged; history queries ATTACH the
+        archive when their date range reaches it. Running it again for the
+        same year moves sales entered since. Returns the counts moved, or
+        None on error.
+        """
+        if self.db_path == ":memory:":
+            print("Error archiving sales: an in-memory database cannot be archived")
+            return None
+        if year >= datetime.now().year:
+            print(f"Error archiving sales: {year} is not a closed year")
+            return None
+        
+        path = f"{os.path.splitext(os.path.basename(self.db_path))[0]}_{year}.db"
+        schema = f"archive_{year}"
+        bounds = (f"{year}-01-01", f"{year + 1}-01-01")
+        try:
+            with self._write_lock:
+                self._attach_archive(self.connection, schema, path, create=True)
+                try:
+                    # The registry row commits with the deletes in the live file, so
+                    # readers only look in the archive once the move has happened
+                    with self.transaction() as cursor:
+                        self._create_archive_tables(cursor, schema)
+                        cursor.execute(f'''
+                            INSERT OR IGNORE INTO {schema}.sales
+                            SELECT id, receipt_number, total_amount, payment_method, customer_name,
+                                   customer_phone, cashier_name, sale_date
+                            FROM sales WHERE sale_date >= ? AND sale_date < ?
+                        ''', bounds)
+                        cursor.execute(f'''
+                            INSERT OR IGNORE INTO {schema}.sale_items
+                            SELECT si.id, si.sale_id, si.drug_id, si.quantity, si.unit_price, si.total_price
+                            FROM sales s JOIN sale_items si ON si.sale_id = s.id
+                            WHERE s.sale_date >= ? AND s.sale_date < ?
+                        ''', bounds)
+                        cursor.execute(f'''
+                            INSERT OR IGNORE INTO {schema}.sale_item_lots
+                            SELECT l.sale_item_id, l.lot_id, l.quantity
+                            FROM sales s
+                            JOIN sale_items si ON si.sale_id = s.id
+                            JOIN sale_item_lots l ON l.sale_item_id = si.id
+                            WHERE s.sale_date >= ? AND s.sale_date < ?
+                        ''', bounds)
+                        
+                        cursor.execute('''
+                            DELETE FROM sale_item_lots WHERE sale_item_id IN (
+                                SELECT si.id FROM sales s JOIN sale_items si ON si.sale_id = s.id
+                                WHERE s.sale_date >= ? AND s.sale_date < ?
+                            )
+                        ''', bounds)
+                        cursor.execute('''
+                            DELETE FROM sale_items WHERE sale_id IN (
+                                SELECT id FROM sales WHERE sale_date >= ? AND sale_date < ?
+                            )
+                        ''', bounds)
+                        items = cursor.rowcount
+                        cursor.execute("DELETE FROM sales WHERE sale_date >= ? AND sale_date < ?", bounds)
+                        sales = cursor.rowcount
+                        
+                        cursor.execute(f'''
+                            INSERT OR REPLACE INTO sales_archives (year, path, first_sale_id, last_sale_id, sales)
+                            SELECT ?, ?, MIN(id), MAX(id), COUNT(*) FROM {schema}.sales
+                            HAVING COUNT(*) > 0
+                        ''', (year, path))
+                finally:
+                    self._detach_archives(self.connection)
+            return {'year': year, 'path': path, 'sales': sales, 'items': items}
+        except Exception as e:
+            print(f"Error archiving sales: {e}")
+            return None
+    
+    def _create_archive_tables(self, cursor, schema: str):
+        """Create the sales tables in an attached archive if it is new"""
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.sales (
+                id INTEGER PRIMARY KEY,
+                receipt_number TEXT NOT NULL,
+                total_amount REAL NOT NULL,
+                payment_method TEXT,
+                customer_name TEXT,
+                customer_phone TEXT,
+                cashier_name TEXT NOT NULL,
+                sale_date TIMESTAMP NOT NULL
+            )
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_sales_sale_date ON sales (sale_date)")
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.sale_items (
+                id INTEGER PRIMARY KEY,
+                sale_id INTEGER NOT NULL,
+                drug_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price REAL NOT NULL,
+                total_price REAL NOT NULL
+            )
+        ''')
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_sale_items_sale_id ON sale_items (sale_id)")
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {schema}.sale_item_lots (
+                sale_item_id INTEGER NOT NULL,
+                lot_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                PRIMARY KEY (sale_item_id, lot_id)
+            ) WITHOUT ROWID
+        ''')
+    
+    def get_archivable_years(self) -> List[int]:
+        """Get the closed years that still have sales in the live database"""
+        try:
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT DISTINCT CAST(substr(sale_date, 1, 4) AS INTEGER)
+                    FROM sales WHERE sale_date < ?
+                    ORDER BY 1
+                ''', (f"{datetime.now().year}-01-01",))
+                return [row[0] for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error getting archivable years: {e}")
+            return []
+    
+    def get_sales_archives(self) -> List[Dict]:
+        """Get the registered archives, oldest year first"""
+        try:
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM sales_archives ORDER BY year")
+                return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error getting sales archives: {e}")
+            return []
+    
+    def _archive_schemas(self, conn, start: Optional[str] = None, end: Optional[str] = None,
+                         sale_id: Optional[int] = None) -> List[str]:
+        """Attach to conn the archives that may hold matching sales; returns their schema names
+        
+        Filters by the [start, end) date range or by sale_id; with neither,
+        every archive is attached. Attachments stay on the connection.
+        """
+        if sale_id is not None:
+            rows = conn.execute('''
+                SELECT year, path FROM sales_archives
+                WHERE first_sale_id <= ? AND last_sale_id >= ?
+            ''', (sale_id, sale_id)).fetchall()
+        else:
+            first_year = int(start[:4]) if start else 0
+            last_year = int(end[:4]) if end else 9999
+            rows = conn.execute('''
+                SELECT year, path FROM sales_archives
+                WHERE year >= ? AND year <= ?
+                ORDER BY year
+            ''', (first_year, last_year)).fetchall()
+        
+        schemas = []
+        for year, path in rows:
+            schema = f"archive_{year}"
+            if self._attach_archive(conn, schema, path):
+                schemas.append(schema)
+        return schemas
+    
+    def _attach_archive(self, conn, schema: str, path: str, create: bool = False) -> bool:
+        """ATTACH an archive file (relative to the live database) unless already attached
+        
+        Returns False, skipping the archive, if the file is missing and
+        create is not set.
+        """
+        attached = self._attached_archives.setdefault(conn, set())
+        if schema in attached:
+            return True
+        
+        full_path = os.path.join(os.path.dirname(os.path.abspath(self.db_path)), path)
+        # ATTACH would silently create an empty file in place of a missing archive
+        if not create and not os.path.exists(full_path):
+            print(f"Sales archive missing, skipping it: {full_path}")
+            return False
+        conn.execute(f"ATTACH DATABASE ? AS {schema}", (full_path,))
+        attached.add(schema)
+        return True
+    
+    def _detach_archives(self, conn):
+        """DETACH every archive attached to conn"""
+        for schema in self._attached_archives.pop(conn, set()):
+            conn.execute(f"DETACH DATABASE {schema}")
+    
+    def _sale_schema(self, conn, sale_id: int) -> Optional[str]:
+        """Name of the schema holding a sale: 'main', an archive, or None if not found"""
+        if conn.execute("SELECT 1 FROM sales WHERE id = ?", (sale_id,)).fetchone():
+            return 'main'
+        for schema in self._archive_schemas(conn, sale_id=sale_id):
+            if conn.execute(f"SELECT 1 FROM {schema}.sales WHERE id = ?", (sale_id,)).fetchone():
+                return schema
+        return None
+    
+    def _sales_union(self, conn, sql: str, params, start: str, end: str,
+                     order_by: str) -> Tuple[str, List]:
+        """Extend a sales query to the archives overlapping [start, end)
+        
+        sql names its tables {db}.sales and {db}.sale_items. It is run
+        against the live tables and each attached archive, combined with
+        UNION ALL and sorted by order_by (which may end in LIMIT ?, bound by
+        the caller). Returns the final (sql, params).
+        """
+        schemas = ['main'] + self._archive_schemas(conn, start, end)
+        if len(schemas) == 1:
+            return f"{sql.replace('{db}', 'main')} {order_by}", list(params)
+        branches = [f"SELECT * FROM ({sql.replace('{db}', schema)})" for schema in schemas]
+        return f"{' UNION ALL '.join(branches)} {order_by}", list(params) * len(schemas)
+    
+    def vacuum(self) -> bool:
+        """Rebuild the live database file, returning the space freed by archiving"""
+        try:
+            with self._write_lock:
+                self.connection.execute("VACUUM")
+            return True
+        except Exception as e:
+            print(f"Error vacuuming database: {e}")
+            return False
+    
+    def _date_range(self, start_date: str, end_date: str) -> Tuple[str, str]:
+        """Turn an inclusive YYYY-MM-DD range into half-open timestamp bounds.
+        
+        Comparing sale_date directly against [start, end + 1 day) lets SQLite
+        use idx_sales_sale_date instead of evaluating DATE() on every row.
+        """
+        end = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)
+        return start_date, end.strftime('%Y-%m-%d')
+    
+    def _page(self, rows, page_size: int, key_columns: Tuple[str, ...]) -> Tuple[List[Dict], Optional[str]]:
+        """Split a LIMIT page_size + 1 result into (page, next_cursor)"""
+        page = [dict(row) for row in rows[:page_size]]
+        if len(rows) <= page_size:
+            return page, None
+        last = page[-1]
+        return page, self._encode_cursor([last[column] for column in key_columns])
+    
+    def _encode_cursor(self, values: List) -> str:
+        """Encode keyset values as an opaque cursor token"""
+        return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+    
+    def _decode_cursor(self, token: str) -> List:
+        """Decode a cursor token produced by _encode_cursor"""
+        return json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
     
     # Settings Methods
     def get_settings(self) -> Dict:
-        """Get system settings"""
+        """Get system settings
+        
+        Served from a cache. The settings version is only re-read after
+        another connection has written to the database (PRAGMA data_version),
+        and the row is reloaded only if that version has moved.
+        """
         try:
-            cursor = self.connection.cursor()
-            cursor.execute("SELECT * FROM settings ORDER BY id DESC LIMIT 1")
-            row = cursor.fetchone()
-            return dict(row) if row else {}
+            with self._settings_lock:
+                if self._settings is not None and not self._settings_changed_externally():
+                    self.cache_stats['settings_hits'] += 1
+                    return dict(self._settings)
+                
+                data_version = self._data_version()
+                with self.reader() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT * FROM settings WHERE id = (SELECT MAX(id) FROM settings)")
+                    row = cursor.fetchone()
+                self._settings = dict(row) if row else {}
+                self._settings_data_version = data_version
+                self.cache_stats['settings_misses'] += 1
+                return dict(self._settings)
         except Exception as e:
             print(f"Error getting settings: {e}")
             return {}
     
+    def _settings_changed_externally(self) -> bool:
+        """True if another connection has saved settings since they were cached"""
+        data_version = self._data_version()
+        # Nothing written by anyone else, or our own writer is busy: keep the cache
+        if data_version is None or data_version == self._settings_data_version:
+            return False
+        
+        with self.reader() as conn:
+            row = conn.execute("SELECT version FROM settings WHERE id = (SELECT MAX(id) FROM settings)").fetchone()
+        self._settings_data_version = data_version
+        return (row[0] if row else None) != self._settings.get('version')
+    
+    def _invalidate_settings(self):
+        """Drop the cached settings so the next read reloads them"""
+        with self._settings_lock:
+            self._settings = None
+    
+    def get_tax_rate(self) -> float:
+        """Get the tax rate as a percentage"""
+        return float(self.get_settings().get('tax_rate') or 0.0)
+    
+    def get_currency(self) -> str:
+        """Get the currency code used on receipts and reports"""
+        return self.get_settings().get('currency') or 'GHS'
+    
+    def get_receipt_footer(self) -> str:
+        """Get the message printed at the bottom of receipts"""
+        return self.get_settings().get('receipt_footer') or 'Thank you for your purchase!'
+    
     def update_settings(self, settings_data: Dict) -> bool:
         """Update system settings"""
         try:
-            cursor = self.connection.cursor()
-            cursor.execute('''
-                UPDATE settings SET pharmacy_name=?, pharmacy_address=?, pharmacy_phone=?,
-                                 pharmacy_email=?, tax_rate=?, currency=?, receipt_footer=?,
-                                 updated_at=CURRENT_TIMESTAMP
-                WHERE id = (SELECT id FROM settings ORDER BY id DESC LIMIT 1)
-            ''', (
-                settings_data.get('pharmacy_name', ''),
-                settings_data.get('pharmacy_address', ''),
-                settings_data.get('pharmacy_phone', ''),
-                settings_data.get('pharmacy_email', ''),
-                settings_data.get('tax_rate', 0.0),
-                settings_data.get('currency', 'GHS'),
-                settings_data.get('receipt_footer', '')
-            ))
-            self.connection.commit()
+            with self.transaction() as cursor:
+                cursor.execute('''
+                    UPDATE settings SET pharmacy_name=?, pharmacy_address=?, pharmacy_phone=?,
+                                     pharmacy_email=?, tax_rate=?, currency=?, receipt_footer=?,
+                                     version=version + 1, updated_at=CURRENT_TIMESTAMP
+                    WHERE id = (SELECT MAX(id) FROM settings)
+                ''', (
+                    settings_data.get('pharmacy_name', ''),
+                    settings_data.get('pharmacy_address', ''),
+                    settings_data.get('pharmacy_phone', ''),
+                    settings_data.get('pharmacy_email', ''),
+                    settings_data.get('tax_rate', 0.0),
+                    settings_data.get('currency', 'GHS'),
+                    settings_data.get('receipt_footer', '')
+                ))
+            self._invalidate_settings()
             return True
         except Exception as e:
             print(f"Error updating settings: {e}")
             return False
     
     def generate_receipt_number(self) -> str:
-        """Generate unique receipt number"""
+        """Preview the next receipt number for this terminal without allocating it"""
         try:
-            cursor = self.connection.cursor()
-            today = datetime.now().strftime("%Y%m%d")
-            cursor.execute('''
-                SELECT COUNT(*) FROM sales 
-                WHERE receipt_number LIKE ?
-            ''', (f'{today}%',))
-            count = cursor.fetchone()[0]
-            return f"{today}{count+1:04d}"
+            with self.reader() as conn:
+                cursor = conn.cursor()
+                today = datetime.now().strftime("%Y%m%d")
+                cursor.execute('''
+                    SELECT last_number FROM receipt_counters
+                    WHERE day = ? AND prefix = ?
+                ''', (today, self.receipt_prefix))
+                row = cursor.fetchone()
+                last_number = row[0] if row else self._count_receipts_for_day(cursor, today)
+                return f"{self.receipt_prefix}{today}{last_number+1:04d}"
         except Exception as e:
             print(f"Error generating receipt number: {e}")
             return datetime.now().strftime("%Y%m%d%H%M%S")
     
+    def _allocate_receipt_number(self, cursor) -> str:
+        """Allocate the next receipt number from the per-day counter.
+        
+        Must be called inside the sale transaction so the counter update and
+        the sale insert commit (or roll back) together.
+        """
+        today = datetime.now().strftime("%Y%m%d")
+        cursor.execute('''
+            UPDATE receipt_counters SET last_number = last_number + 1
+            WHERE day = ? AND prefix = ?
+        ''', (today, self.receipt_prefix))
+        if cursor.rowcount == 0:
+            # First sale of the day on this terminal; start after any receipts
+            # issued before the counter existed
+            next_number = self._count_receipts_for_day(cursor, today) + 1
+            cursor.execute('''
+                INSERT INTO receipt_counters (day, prefix, last_number)
+                VALUES (?, ?, ?)
+            ''', (today, self.receipt_prefix, next_number))
+        else:
+            cursor.execute('''
+                SELECT last_number FROM receipt_counters
+                WHERE day = ? AND prefix = ?
+            ''', (today, self.receipt_prefix))
+            next_number = cursor.fetchone()[0]
+        return f"{self.receipt_prefix}{today}{next_number:04d}"
+    
+    def _count_receipts_for_day(self, cursor, day: str) -> int:
+        """Count receipts already issued for a day using the receipt_number index
+        
+        The index range covers every receipt beginning with <prefix><day>;
+        only those followed by nothing but the 4-6 digit counter are this
+        terminal's, so a prefix that extends another ("T1" and "T10", or ""
+        and any numeric prefix) is not counted twice.
+        """
+        start = f"{self.receipt_prefix}{day}"
+        cursor.execute('''
+            SELECT COUNT(*) FROM sales
+            WHERE receipt_number >= ? AND receipt_number < ?
+              AND length(receipt_number) BETWEEN ? AND ?
+              AND substr(receipt_number, ?) NOT GLOB '*[^0-9]*'
+        ''', (start, start + ":", len(start) + 4, len(start) + 6, len(start) + 1))
+        return cursor.fetchone()[0]
+    
+    def explain_query_plan(self, sql: str, params: Tuple = ()) -> List[str]:
+        """Return the EXPLAIN QUERY PLAN detail lines for a statement"""
+        with self.reader() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [row['detail'] for row in cursor.fetchall()]
+    
+    def restore_from(self, source_path: str):
+        """Replace the whole database with the contents of another database file
+        
+        The copy is written through the writer connection with the SQLite
+        backup API, so the WAL stays consistent and every open connection
+        (pooled readers, other terminals) sees the restored data on its next
+        read. Caches are dropped and any migrations newer than the restored
+        schema are applied. Raises on failure.
+        """
+        source = sqlite3.connect(source_path)
+        try:
+            with self._write_lock:
+                self._detach_archives(self.connection)
+                source.backup(self.connection)
+        finally:
+            source.close()
+        
+        # Idle readers may have archives attached from the replaced registry
+        idle = []
+        while True:
+            try:
+                idle.append(self._idle_readers.get_nowait())
+            except queue.Empty:
+                break
+        for conn in idle:
+            self._detach_archives(conn)
+            self._idle_readers.put(conn)
+        
+        self._invalidate_catalog()
+        self._invalidate_settings()
+        self.initialize_database()
+    
     def close(self):
-        """Close database connection"""
+        """Close the writer and all pooled reader connections"""
+        for conn in self._all_readers:
+            conn.close()
+        self._all_readers = []
+        self._attached_archives = {}
+        self._idle_readers = queue.LifoQueue()
         if self.connection:
             self.connection.close() 
\ No newline at end of file
@@ -0,0 +1,313 @@
+"""
+SQL Profiler for Ghanaian Pharmacy POS System
+Records how long DatabaseManager calls and their SQL statements take, logs
+slow statements with their query plans and writes a JSON summary on exit
+
+Enable it by passing a SQLProfiler to DatabaseManager, or by setting
+PHARMACY_SQL_PROFILE when starting main.py. Without a profiler the database
+uses plain sqlite3 connections and unwrapped methods, so nothing is added.
+"""
+
+import atexit
+import functools
+import inspect
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open-ended
+HISTOGRAM_BOUNDS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000)
+
+def _histogram_label(index):
+    """Name of a histogram bucket, e.g. '<=5ms' or '>1000ms'"""
+    if index < len(HISTOGRAM_BOUNDS_MS):
+        return f"<={HISTOGRAM_BOUNDS_MS[index]:g}ms"
+    return f">{HISTOGRAM_BOUNDS_MS[-1]:g}ms"
+
+class _Timings:
+    """Call count, latency histogram and row count for one method or statement"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+
+    def add(self, ms, error=False):
+        self.calls += 1
+        self.errors += error
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        index = 0
+        while index < len(HISTOGRAM_BOUNDS_MS) and ms > HISTOGRAM_BOUNDS_MS[index]:
+            index += 1
+        self.histogram[index] += 1
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_ms': round(self.total_ms, 3),
+            'mean_ms': round(self.total_ms / self.calls, 3) if self.calls else 0.0,
+            'max_ms': round(self.max_ms, 3),
+            'histogram': {_histogram_label(i): count for i, count in enumerate(self.histogram) if count},
+        }
+
+class SQLProfiler:
+    """Collects DatabaseManager method and SQL statement timings.
+
+    Statements are attributed to the outermost DatabaseManager method that
+    issued them. Statements slower than slow_query_ms are written to
+    logs/slow_queries_YYYYMM.log with their EXPLAIN QUERY PLAN. If dump_path
+    is given the summary is written there when the process exits.
+    """
+    # Slowest statements kept in memory for the summary
+    MAX_SLOW_QUERIES = 50
+    # Methods that are not worth timing (connection plumbing)
+    SKIP_METHODS = {'connect', 'close', 'transaction', 'reader', 'set_trace_callback',
+                    'explain_query_plan', 'get_cache_stats'}
+
+    def __init__(self, slow_query_ms=100.0, dump_path=None, log_dir="logs"):
+        self.slow_query_ms = slow_query_ms
+        self.dump_path = dump_path
+        self.log_dir = log_dir
+        self.started_at = datetime.now()
+        self.methods = {}
+        self.statements = {}
+        self.slow_queries = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if dump_path:
+            atexit.register(self.dump)
+
+    # Hooks used by DatabaseManager
+    def connection_factory(self):
+        """Connection class to pass as sqlite3.connect(factory=...)"""
+        return type('ProfiledConnection', (InstrumentedConnection,), {'profiler': self})
+
+    def instrument(self, manager):
+        """Wrap the public methods of a DatabaseManager instance with timers"""
+        for name, member in inspect.getmembers(type(manager), inspect.isfunction):
+            if name.startswith('_') or name in self.SKIP_METHODS:
+                continue
+            method = getattr(manager, name)
+            if inspect.isgeneratorfunction(member):
+                setattr(manager, name, self._wrap_generator(name, method))
+            else:
+                setattr(manager, name, self._wrap_method(name, method))
+
+    def _wrap_method(self, name, method):
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            outermost = self._enter(name)
+            started = time.perf_counter()
+            error = False
+            try:
+                return method(*args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                self._leave(name, outermost, started, error)
+        return timed
+
+    def _wrap_generator(self, name, method):
+        # A generator's work happens while it is consumed, so time until exhausted
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            outermost = self._enter(name)
+            started = time.perf_counter()
+            error = False
+            try:
+                yield from method(*args, **kwargs)
+            except BaseException:
+                error = True
+                raise
+            finally:
+                self._leave(name, outermost, started, error)
+        return timed
+
+    def _enter(self, name):
+        """Mark name as the current method unless an outer method is already running"""
+        if getattr(self._local, 'method', None) is None:
+            self._local.method = name
+            return True
+        return False
+
+    def _leave(self, name, outermost, started, error):
+        ms = (time.perf_counter() - started) * 1000
+        if outermost:
+            self._local.method = None
+        with self._lock:
+            self.methods.setdefault(name, _Timings()).add(ms, error)
+
+    def record_statement(self, conn, sql, parameters, ms, error=None, many=False):
+        """Record one execute() call
+
+        Returns (statement timings, method name) for record_rows.
+        """
+        key = ' '.join(sql.split())
+        method = getattr(self._local, 'method', None) or '(direct)'
+        with self._lock:
+            timings = self.statements.get(key)
+            if timings is None:
+                timings = self.statements[key] = _Timings()
+                timings.methods = set()
+            timings.add(ms, error is not None)
+            timings.methods.add(method)
+        if ms >= self.slow_query_ms:
+            self._log_slow_query(conn, key, parameters, ms, method, error, many)
+        return timings, method
+
+    def record_rows(self, target, count):
+        """Add fetched or changed rows to a statement and its method"""
+        if target is None or count <= 0:
+            return
+        timings, method = target
+        with self._lock:
+            timings.rows += count
+            self.methods.setdefault(method, _Timings()).rows += count
+
+    def _log_slow_query(self, conn, sql, parameters, ms, method, error, many):
+        """Capture the plan of a slow statement and append it to the slow query log"""
+        plan = []
+        if not many and sql.upper().startswith(('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')):
+            try:
+                # Base-class execute so the plan lookup is not itself profiled
+                rows = sqlite3.Connection.execute(conn, f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+                plan = [row[3] for row in rows]
+            except Exception as e:
+                plan = [f"(plan unavailable: {e})"]
+
+        entry = {
+            'at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'ms': round(ms, 3),
+            'method': method,
+            'sql': sql,
+            'plan': plan,
+        }
+        if error is not None:
+            entry['error'] = str(error)
+
+        with self._lock:
+            self.slow_queries.append(entry)
+            self.slow_queries.sort(key=lambda e: e['ms'], reverse=True)
+            del self.slow_queries[self.MAX_SLOW_QUERIES:]
+
+        try:
+            if not os.path.exists(self.log_dir):
+                os.makedirs(self.log_dir)
+            log_file = os.path.join(self.log_dir, f"slow_queries_{datetime.now().strftime('%Y%m')}.log")
+            with open(log_file, 'a', encoding='utf-8') as f:
+                f.write(f"[{entry['at']}] {entry['ms']:.1f}ms in {method}: {sql}\n")
+                for detail in plan:
+                    f.write(f"    {detail}\n")
+        except Exception as e:
+            print(f"Error writing slow query log: {e}")
+
+    def summary(self):
+        """Return the collected figures as a JSON-ready dict"""
+        with self._lock:
+            methods = {name: timings.to_dict() for name, timings in sorted(self.methods.items())}
+            statements = []
+            for sql, timings in sorted(self.statements.items(), key=lambda item: item[1].total_ms, reverse=True):
+                stats = timings.to_dict()
+                stats['sql'] = sql
+                stats['methods'] = sorted(timings.methods)
+                statements.append(stats)
+            slow_queries = list(self.slow_queries)
+
+        return {
+            'started_at': self.started_at.strftime("%Y-%m-%d %H:%M:%S"),
+            'seconds': round((datetime.now() - self.started_at).total_seconds(), 1),
+            'slow_query_ms': self.slow_query_ms,
+            'methods': methods,
+            'statements': statements,
+            'slow_queries': slow_queries,
+        }
+
+    def dump(self, path=None):
+        """Write the summary as JSON; returns the path, or None on error"""
+        path = path or self.dump_path
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(self.summary(), f, indent=2)
+            return path
+        except Exception as e:
+            print(f"Error writing SQL profile: {e}")
+            return None
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors report to a SQLProfiler"""
+    profiler = None
+
+    def cursor(self, factory=None):
+        return super().cursor(factory or InstrumentedCursor)
+
+    # Connection.execute() would otherwise use a plain cursor
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, parameters):
+        return self.cursor().executemany(sql, parameters)
+
+    # Commits are where the WAL is synced, so they are worth timing too
+    def commit(self):
+        started = time.perf_counter()
+        super().commit()
+        self.profiler.record_statement(self, "COMMIT", (), (time.perf_counter() - started) * 1000)
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Cursor that times execute() and counts the rows it returns or changes"""
+    _target = None
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters, False)
+
+    def executemany(self, sql, parameters):
+        return self._timed(super().executemany, sql, parameters, True)
+
+    def _timed(self, run, sql, parameters, many):
+        profiler = self.connection.profiler
+        started = time.perf_counter()
+        error = None
+        try:
+            return run(sql, parameters)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            ms = (time.perf_counter() - started) * 1000
+            self._target = profiler.record_statement(self.connection, sql, parameters, ms, error, many)
+            if error is None:
+                profiler.record_rows(self._target, self.rowcount)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self.connection.profiler.record_rows(self._target, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self.connection.profiler.record_rows(self._target, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self.connection.profiler.record_rows(self._target, len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        self.connection.profiler.record_rows(self._target, 1)
+        return row
@@ -0,0 +1,204 @@
+"""
+Background Database Worker for Ghanaian Pharmacy POS System
+Runs DatabaseManager calls off the Tk main thread and delivers the results
+back to it, so slow queries never freeze the window
+"""
+
+import queue
+import threading
+
+class DatabaseRequest:
+    """Handle for a submitted call; cancel() drops its result"""
+
+    def __init__(self, func, args, kwargs, callback, error_callback, key, cancellable=True):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.callback = callback
+        self.error_callback = error_callback
+        self.key = key
+        # False for app-level work (e.g. backups) that outlives the screen that started it
+        self.cancellable = cancellable
+        self.cancelled = False
+
+    def cancel(self):
+        """Skip the call if it has not started and never deliver its result"""
+        self.cancelled = True
+
+class DatabaseExecutor:
+    """Run database calls on worker threads and post results to Tk.
+
+    Results are picked up by polling with root.after, so callbacks always
+    run on the Tk thread. Requests submitted with the same key supersede
+    each other: only the newest one's callback runs (e.g. search-as-you-type).
+    """
+    POLL_INTERVAL_MS = 30
+
+    def __init__(self, root, workers=2):
+        self.root = root
+        self._requests = queue.Queue()
+        self._results = queue.Queue()
+        self._ui_calls = queue.Queue()
+        self._latest = {}
+        self._pending = set()
+        self._polling = False
+        self._poll_lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name=f"db-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, *args, callback=None, error_callback=None, key=None, cancellable=True, **kwargs):
+        """Run func(*args, **kwargs) in the background
+
+        callback(result) or error_callback(exception) is called on the Tk
+        thread when it finishes. Must be called from the Tk thread. Pass
+        cancellable=False for work that must finish and report even if the
+        screen that started it is closed; cancel_pending() then leaves it be.
+        """
+        request = DatabaseRequest(func, args, kwargs, callback, error_callback, key, cancellable)
+        if key is not None:
+            self.cancel(key)
+            self._latest[key] = request
+        self._pending.add(request)
+        self._requests.put(request)
+        self._schedule_poll()
+        return request
+
+    def call_soon(self, func, *args):
+        """Run func(*args) on the Tk thread; safe to call from a worker
+
+        Meant for progress updates from inside a submitted call. Starts
+        polling if it is not already running, so the call is never left
+        queued with nothing to deliver it.
+        """
+        self._ui_calls.put((func, args))
+        self._schedule_poll()
+
+    def cancel(self, key):
+        """Cancel the outstanding request submitted under key, if any"""
+        request = self._latest.pop(key, None)
+        if request is not None:
+            request.cancel()
+
+    def cancel_pending(self):
+        """Cancel every outstanding cancellable request (e.g. when its screen is closed)"""
+        for request in self._pending:
+            if request.cancellable:
+                request.cancel()
+        self._latest = {key: request for key, request in self._latest.items() if not request.cancelled}
+
+    def shutdown(self):
+        """Cancel all outstanding requests and stop the worker threads"""
+        for request in self._pending:
+            request.cancel()
+        self._latest.clear()
+        for _ in self._threads:
+            self._requests.put(None)
+
+    def _work(self):
+        """Worker thread loop"""
+        while True:
+            request = self._requests.get()
+            if request is None:
+                return
+            if request.cancelled:
+                self._results.put((request, None, None))
+                continue
+            try:
+                result = request.func(*request.args, **request.kwargs)
+                self._results.put((request, result, None))
+            except Exception as e:
+                self._results.put((request, None, e))
+
+    def _schedule_poll(self):
+        """Start polling for results if not already doing so
+
+        Called from workers too (via call_soon); the lock keeps two threads
+        from both scheduling a poll.
+        """
+        with self._poll_lock:
+            if self._polling:
+                return
+            self._polling = True
+        self.root.after(self.POLL_INTERVAL_MS, self._poll)
+
+    def _poll(self):
+        """Deliver finished results on the Tk thread
+
+        A callback that raises is reported and skipped; polling carries on
+        for the remaining results.
+        """
+        try:
+            while True:
+                try:
+                    func, args = self._ui_calls.get_nowait()
+                except queue.Empty:
+                    break
+                try:
+                    func(*args)
+                except Exception as e:
+                    print(f"Database worker UI call error: {e}")
+
+            while True:
+                try:
+                    request, result, error = self._results.get_nowait()
+                except queue.Empty:
+                    break
+
+                self._pending.discard(request)
+                if self._latest.get(request.key) is request:
+                    del self._latest[request.key]
+                if request.cancelled:
+                    continue
+                try:
+                    if error is not None:
+                        if request.error_callback:
+                            request.error_callback(error)
+                        else:
+                            print(f"Database worker error: {error}")
+                    elif request.callback:
+                        request.callback(result)
+                except Exception as e:
+                    print(f"Database worker callback error: {e}")
+        finally:
+            with self._poll_lock:
+                self._polling = False
+            # A worker may have queued a UI call after the drain above
+            if self._pending or not self._ui_calls.empty():
+                self._schedule_poll()
+
+class InlineExecutor:
+    """Same interface as DatabaseExecutor, but runs every call immediately.
+
+    Used by screens created without a background executor (e.g. in tests).
+    """
+
+    def submit(self, func, *args, callback=None, error_callback=None, key=None, cancellable=True, **kwargs):
+        """Run func now and call callback or error_callback with the outcome"""
+        request = DatabaseRequest(func, args, kwargs, callback, error_callback, key, cancellable)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if error_callback:
+                error_callback(e)
+            else:
+                print(f"Database worker error: {e}")
+            return request
+        if callback:
+            callback(result)
+        return request
+
+    def call_soon(self, func, *args):
+        """Run func(*args) now"""
+        func(*args)
+
+    def cancel(self, key):
+        """Nothing is ever outstanding"""
+
+    def cancel_pending(self):
+        """Nothing is ever outstanding"""
+
+    def shutdown(self):
+        """Nothing to stop"""
@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Synthetic Data Generator for Ghanaian Pharmacy POS System
+Builds a new database filled with reproducible, production-sized data so
+benchmarks and capacity tests have something realistic to run against
+
+Usage:
+    python generate_data.py --db bench.db --scale medium
+    python generate_data.py --db bench.db --drugs 50000 --sales 2000000 --items 10000000 \\
+        --days 730 --end-date 2025-12-31 --seed 7
+
+The same seed, sizes and end date always produce the same drugs and sales.
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from database import DatabaseManager
+from db_profiler import SQLProfiler
+
+# (drugs, sales, sale items) for each --scale preset
+SCALES = {
+    'small': (1000, 20000, 100000),
+    'medium': (10000, 200000, 1000000),
+    'large': (50000, 2000000, 10000000),
+}
+
+# Generic name, brands, and (dosage, form, base price in GHS) presentations
+GENERICS = [
+    ('Paracetamol', ['Panadol', 'Efpac', 'Tylenol'],
+     [('500mg', 'Tablet', 0.50), ('1g', 'Tablet', 0.90), ('120mg/5ml', 'Syrup', 12.00)]),
+    ('Paracetamol/Caffeine', ['Panadol Extra', 'Hedex'], [('500/65mg', 'Tablet', 0.80)]),
+    ('Ibuprofen', ['Brufen', 'Nurofen', 'Ibucap'],
+     [('200mg', 'Tablet', 0.60), ('400mg', 'Tablet', 1.00), ('100mg/5ml', 'Suspension', 15.00)]),
+    ('Diclofenac', ['Voltaren', 'Cataflam', 'Diclo-Denk'],
+     [('50mg', 'Tablet', 0.80), ('100mg', 'Tablet', 1.40), ('1%', 'Gel', 25.00)]),
+    ('Artemether/Lumefantrine', ['Coartem', 'Lonart', 'Lumartem', 'Artefan'],
+     [('20/120mg', 'Tablet', 25.00), ('80/480mg', 'Tablet', 45.00), ('180/1080mg', 'Suspension', 38.00)]),
+    ('Artesunate/Amodiaquine', ['Camosunate', 'Coarsucam', 'Arsuamoon'],
+     [('100/270mg', 'Tablet', 30.00), ('50/135mg', 'Tablet', 22.00)]),
+    ('Dihydroartemisinin/Piperaquine', ['P-Alaxin', 'Duo-Cotecxin'], [('40/320mg', 'Tablet', 42.00)]),
+    ('Sulfadoxine/Pyrimethamine', ['Fansidar', 'Amalar'], [('500/25mg', 'Tablet', 6.00)]),
+    ('Amoxicillin', ['Amoxil', 'Ospamox', 'Moxacin'],
+     [('250mg', 'Capsule', 1.20), ('500mg', 'Capsule', 2.00), ('125mg/5ml', 'Suspension', 18.00)]),
+    ('Amoxicillin/Clavulanate', ['Augmentin', 'Clavulin', 'Amoksiklav'],
+     [('625mg', 'Tablet', 6.50), ('1g', 'Tablet', 9.00), ('228mg/5ml', 'Suspension', 65.00)]),
+    ('Ciprofloxacin', ['Ciprotab', 'Ciprinol', 'Cipro-Denk'], [('500mg', 'Tablet', 2.50)]),
+    ('Metronidazole', ['Flagyl', 'Metrozol'],
+     [('200mg', 'Tablet', 0.40), ('400mg', 'Tablet', 0.70), ('200mg/5ml', 'Suspension', 14.00)]),
+    ('Co-trimoxazole', ['Septrin', 'Bactrim'], [('480mg', 'Tablet', 0.50), ('240mg/5ml', 'Suspension', 12.00)]),
+    ('Doxycycline', ['Vibramycin', 'Doxy-Denk'], [('100mg', 'Capsule', 1.00)]),
+    ('Azithromycin', ['Zithromax', 'Azicin'], [('500mg', 'Tablet', 8.00), ('200mg/5ml', 'Suspension', 45.00)]),
+    ('Albendazole', ['Zentel', 'Alzental'], [('400mg', 'Tablet', 5.00), ('200mg/5ml', 'Suspension', 10.00)]),
+    ('Mebendazole', ['Vermox', 'Wormin'], [('100mg', 'Tablet', 1.50)]),
+    ('Omeprazole', ['Losec', 'Omez', 'Ometab'], [('20mg', 'Capsule', 1.50), ('40mg', 'Capsule', 2.50)]),
+    ('Magnesium Trisilicate', ['Gestid', 'Mist Mag'], [('250mg', 'Tablet', 0.30), ('200ml', 'Suspension', 15.00)]),
+    ('Cetirizine', ['Zyrtec', 'Cetrizin', 'Alerid'], [('10mg', 'Tablet', 0.80), ('5mg/5ml', 'Syrup', 20.00)]),
+    ('Loratadine', ['Claritin', 'Lorinase'], [('10mg', 'Tablet', 1.00)]),
+    ('Chlorpheniramine', ['Piriton'], [('4mg', 'Tablet', 0.20), ('2mg/5ml', 'Syrup', 10.00)]),
+    ('Salbutamol', ['Ventolin', 'Asthalin'], [('4mg', 'Tablet', 0.30), ('100mcg', 'Inhaler', 45.00)]),
+    ('Metformin', ['Glucophage', 'Diabetmin'], [('500mg', 'Tablet', 0.60), ('850mg', 'Tablet', 0.90)]),
+    ('Glibenclamide', ['Daonil', 'Glibil'], [('5mg', 'Tablet', 0.30)]),
+    ('Amlodipine', ['Norvasc', 'Amlopine'], [('5mg', 'Tablet', 0.70), ('10mg', 'Tablet', 1.10)]),
+    ('Nifedipine', ['Adalat', 'Nifecard'], [('20mg', 'Tablet', 0.80)]),
+    ('Lisinopril', ['Zestril', 'Lisoril'], [('10mg', 'Tablet', 1.00)]),
+    ('Hydrochlorothiazide', ['Esidrex'], [('25mg', 'Tablet', 0.30)]),
+    ('Oral Rehydration Salts', ['ORS', 'Oralite'], [('20.5g', 'Sachet', 3.00)]),
+    ('Zinc Sulfate', ['Zinnat Kids', 'Zincos'], [('20mg', 'Tablet', 0.80)]),
+    ('Folic Acid', ['Folate', 'Folicare'], [('5mg', 'Tablet', 0.10)]),
+    ('Ferrous Sulfate', ['Feroglobin', 'Fesolate'], [('200mg', 'Tablet', 0.20), ('200ml', 'Syrup', 25.00)]),
+    ('Vitamin C', ['Ascorbic Acid', 'Redoxon', 'Vitacee'], [('100mg', 'Tablet', 0.10), ('1000mg', 'Tablet', 1.50)]),
+    ('Multivitamin', ['Multivite', 'Centrum', 'Pregnacare'], [('30s', 'Tablet', 35.00), ('200ml', 'Syrup', 18.00)]),
+    ('Vitamin B Complex', ['Becosules', 'Neurobion'], [('Standard', 'Tablet', 0.20)]),
+    ('Clotrimazole', ['Canesten', 'Clotrim'], [('1%', 'Cream', 12.00), ('100mg', 'Pessary', 15.00)]),
+    ('Hydrocortisone', ['Cortef', 'Hydrocort'], [('1%', 'Cream', 10.00)]),
+    ('Gentamicin', ['Garamycin'], [('0.3%', 'Eye Drops', 8.00)]),
+    ('Dextromethorphan', ['Benylin', 'Tuxil-D'], [('100ml', 'Syrup', 22.00)]),
+    ('Guaifenesin', ['Robitussin', 'Mucosolvan'], [('100ml', 'Syrup', 20.00)]),
+    ('Herbal Mixture', ['Rooter Mixture', 'Adutwumwaa Bitters', 'Kantinka Herbaltics', 'Time Herbal'],
+     [('500ml', 'Mixture', 30.00), ('250ml', 'Mixture', 18.00)]),
+]
+
+# Local manufacturers whose generics sit alongside the imported brands
+MANUFACTURERS = ['Ernest Chemists', 'Kinapharma', 'Letap', 'Tobinco', 'Danadams',
+                 'M&G Pharmaceuticals', 'Pharmanova', 'Entrance Pharmaceuticals', 'Phyto-Riker']
+
+FIRST_NAMES = ['Kwame', 'Kofi', 'Kwaku', 'Yaw', 'Kwabena', 'Kwasi', 'Kojo', 'Ama', 'Akosua', 'Adwoa',
+               'Abena', 'Akua', 'Yaa', 'Afua', 'Esi', 'Efua', 'Nana', 'Selorm', 'Elikem', 'Fatima',
+               'Abdul', 'Mohammed', 'Ebenezer', 'Gifty', 'Comfort', 'Prince', 'Emmanuel', 'Priscilla']
+SURNAMES = ['Mensah', 'Owusu', 'Boateng', 'Asante', 'Osei', 'Agyeman', 'Appiah', 'Adjei', 'Amoah',
+            'Ofori', 'Addo', 'Quaye', 'Tetteh', 'Darko', 'Acheampong', 'Badu', 'Sarpong', 'Annan',
+            'Quartey', 'Agbeko', 'Dzifa', 'Yeboah', 'Ansah', 'Iddrisu', 'Sulemana']
+PHONE_PREFIXES = ['024', '054', '055', '059', '020', '050', '027', '026']
+CASHIERS = ['Admin', 'Akosua Mensah', 'Kwabena Owusu', 'Efua Asante', 'Yaw Boateng']
+PAYMENT_METHODS = (['Cash', 'Mobile Money', 'Card'], [55, 38, 7])
+QUANTITIES = ([1, 2, 3, 4, 5, 6, 10, 12, 20, 30], [45, 20, 10, 5, 5, 3, 5, 2, 3, 2])
+
+# Relative trade by weekday (Monday first), month and opening hour
+WEEKDAY_WEIGHTS = [1.0, 0.95, 0.95, 1.0, 1.15, 1.3, 0.55]
+# Malaria and respiratory illness peak in the rainy seasons; December is festive trade
+MONTH_WEIGHTS = [0.9, 0.9, 0.95, 1.0, 1.1, 1.2, 1.15, 1.0, 1.05, 1.1, 0.95, 1.05]
+HOUR_WEIGHTS = {7: 2, 8: 5, 9: 9, 10: 10, 11: 9, 12: 7, 13: 8, 14: 7, 15: 6, 16: 7,
+                17: 9, 18: 10, 19: 8, 20: 5, 21: 2}
+# Trade grows by this fraction from the first day to the last
+GROWTH = 0.2
+
+SALES_BATCH_SIZE = 10000
+# Maintained per row by the application; dropped during the load and rebuilt
+# in one pass afterwards, which is several times faster
+DEFERRED_OBJECTS = ('sales_rollup_insert', 'sale_items_rollup_insert',
+                    'idx_sale_items_drug_id', 'idx_stock_movements_drug')
+
+def generate_catalog(rng, count, end_date):
+    """Yield count drug dicts for DatabaseManager.import_drugs
+
+    Each drug is one batch of a brand and presentation, so popular products
+    appear several times with different batch numbers and expiry dates.
+    """
+    for n in range(count):
+        generic_name, brands, presentations = rng.choice(GENERICS)
+        dosage, form, base_price = rng.choice(presentations)
+        if rng.random() < 0.4:
+            # Local generics are the cheapest option
+            brand_name = rng.choice(MANUFACTURERS)
+            price = base_price * rng.uniform(0.8, 1.1)
+        else:
+            brand_name = rng.choice(brands)
+            price = base_price * rng.uniform(1.2, 2.5)
+
+        reorder_level = rng.choice([10, 20, 50])
+        roll = rng.random()
+        if roll < 0.05:
+            quantity = 0
+        elif roll < 0.15:
+            quantity = rng.randint(1, reorder_level)
+        else:
+            quantity = rng.randint(reorder_level + 1, 500)
+
+        yield {
+            'generic_name': generic_name,
+            'brand_name': brand_name,
+            'dosage': dosage,
+            'form': form,
+            'batch_number': f"{brand_name[:2].upper()}{end_date.year % 100}{n:06d}",
+            # Some stock is already expired or close to it, as on a real shelf
+            'expiry_date': (end_date + timedelta(days=rng.randint(-60, 1095))).isoformat(),
+            'unit_price': round(max(price, 0.05), 2),
+            'quantity_in_stock': quantity,
+            'reorder_level': reorder_level,
+        }
+
+def daily_sale_counts(rng, total, start_date, days):
+    """Split total sales across days by weekday, month, growth and noise"""
+    weights = []
+    for offset in range(days):
+        day = start_date + timedelta(days=offset)
+        weight = WEEKDAY_WEIGHTS[day.weekday()] * MONTH_WEIGHTS[day.month - 1]
+        weight *= 1 + GROWTH * offset / max(days - 1, 1)
+        weight *= max(rng.gauss(1.0, 0.08), 0.5)
+        weights.append(weight)
+
+    # Largest remainders, so the counts add up to total exactly
+    scale = total / sum(weights)
+    counts = [int(weight * scale) for weight in weights]
+    remainders = sorted(range(days), key=lambda i: weights[i] * scale - counts[i], reverse=True)
+    for i in remainders[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+def sale_times(rng, day, count):
+    """Sorted 'YYYY-MM-DD HH:MM:SS' timestamps for one day's sales"""
+    hours = rng.choices(list(HOUR_WEIGHTS), weights=list(HOUR_WEIGHTS.values()), k=count)
+    seconds = sorted(hour * 3600 + rng.randrange(3600) for hour in hours)
+    prefix = day.isoformat()
+    return [f"{prefix} {s // 3600:02d}:{s // 60 % 60:02d}:{s % 60:02d}" for s in seconds]
+
+def random_customer(rng):
+    """(name, phone) for a registered customer, or ('', '') for a walk-in"""
+    if rng.random() >= 0.3:
+        return '', ''
+    name = f"{rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}"
+    phone = ''
+    if rng.random() < 0.8:
+        phone = f"{rng.choice(PHONE_PREFIXES)}{rng.randrange(10 ** 7):07d}"
+    return name, phone
+
+def generate(db, seed=42, drugs=1000, sales=20000, items=100000, days=365, end_date=None,
+             skew=1.0, progress_callback=None):
+    """Fill an initialized, empty DatabaseManager database with synthetic data
+
+    The sample drugs a new database is seeded with are removed first, so the
+    catalog is only the generated drugs. Drugs get Zipf-distributed popularity (exponent skew), sales follow the
+    weekday, month and hour weights above, and the stock ledger, lots,
+    receipt counters and rollups are made consistent with the sales.
+    progress_callback receives (sales written, total sales).
+
+    Returns counts of the rows written.
+    """
+    rng = random.Random(seed)
+    end_date = end_date or date.today() - timedelta(days=1)
+    start_date = end_date - timedelta(days=days - 1)
+
+    with db.transaction() as cursor:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM sales)")
+        if cursor.fetchone()[0]:
+            raise RuntimeError("database already has sales")
+        # Sample drugs from initialize_database (expiring in 2025) and their stock history
+        for table in ("stock_movements", "stock_snapshots", "stock_snapshot_runs", "stock_lots", "drugs"):
+            cursor.execute(f"DELETE FROM {table}")
+
+    stats = db.import_drugs(generate_catalog(rng, drugs, end_date))
+    if stats is None:
+        raise RuntimeError("drug import failed")
+
+    with db.transaction() as cursor:
+        # History starts with an opening balance the evening before the first
+        # sale; its quantities are topped up with the units sold further down
+        cursor.execute("DELETE FROM stock_movements")
+        cursor.execute("DELETE FROM stock_snapshots")
+        cursor.execute("DELETE FROM stock_snapshot_runs")
+        cursor.execute('''
+            INSERT INTO stock_movements (drug_id, quantity_change, reason, created_at)
+            SELECT id, quantity_in_stock, 'opening', ? FROM drugs ORDER BY id
+        ''', (f"{start_date - timedelta(days=1)} 20:00:00",))
+        cursor.execute("SELECT drug_id, id FROM stock_movements")
+        opening_ids = dict(cursor.fetchall())
+        # Sold-out drugs keep an empty lot that their past sales came from
+        cursor.execute('''
+            INSERT OR IGNORE INTO stock_lots (drug_id, batch_number, expiry_date, quantity)
+            SELECT id, batch_number, expiry_date, 0 FROM drugs
+            WHERE NOT EXISTS (SELECT 1 FROM stock_lots WHERE drug_id = drugs.id)
+        ''')
+        cursor.execute("SELECT drug_id, MIN(id) FROM stock_lots GROUP BY drug_id")
+        lot_ids = dict(cursor.fetchall())
+        cursor.execute("SELECT id, unit_price FROM drugs ORDER BY id")
+        prices = dict(cursor.fetchall())
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM sales")
+        sale_id = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM sale_items")
+        item_id = cursor.fetchone()[0]
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements")
+        movement_id = cursor.fetchone()[0]
+
+        cursor.execute(f'''
+            SELECT type, name, sql FROM sqlite_master
+            WHERE name IN ({', '.join('?' * len(DEFERRED_OBJECTS))})
+        ''', DEFERRED_OBJECTS)
+        deferred = cursor.fetchall()
+        for object_type, name, _ in deferred:
+            cursor.execute(f"DROP {object_type.upper()} {name}")
+
+    # Popularity rank is independent of drug id
+    ranked = list(prices)
+    rng.shuffle(ranked)
+    cum_weights = []
+    running = 0.0
+    for rank in range(len(ranked)):
+        running += 1.0 / (rank + 1) ** skew
+        cum_weights.append(running)
+
+    # Extra items beyond the first follow a geometric distribution
+    extra_mean = max(items / sales - 1, 0) if sales else 0
+    log_q = math.log(extra_mean / (1 + extra_mean)) if extra_mean > 0 else None
+    max_items = min(len(ranked), 50)
+
+    counts = daily_sale_counts(rng, sales, start_date, days)
+    units_sold = Counter()
+    written_sales = written_items = 0
+    batch_sales, batch_items, batch_lots, batch_movements, counters = [], [], [], [], []
+
+    def flush():
+        with db.transaction() as cursor:
+            cursor.executemany('''
+                INSERT INTO sales (id, receipt_number, total_amount, payment_method,
+                                   customer_name, customer_phone, cashier_name, sale_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch_sales)
+            cursor.executemany('''
+                INSERT INTO sale_items (id, sale_id, drug_id, quantity, unit_price, total_price)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', batch_items)
+            cursor.executemany("INSERT INTO sale_item_lots (sale_item_id, lot_id, quantity) VALUES (?, ?, ?)",
+                               batch_lots)
+            cursor.executemany('''
+                INSERT INTO stock_movements (id, drug_id, quantity_change, reason, reference_id, created_at)
+                VALUES (?, ?, ?, 'sale', ?, ?)
+            ''', batch_movements)
+            cursor.executemany("INSERT INTO receipt_counters (day, prefix, last_number) VALUES (?, '', ?)",
+                               counters)
+        for batch in (batch_sales, batch_items, batch_lots, batch_movements, counters):
+            batch.clear()
+
+    for offset, count in enumerate(counts):
+        day = start_date + timedelta(days=offset)
+        receipt_day = day.strftime("%Y%m%d")
+        for number, sold_at in enumerate(sale_times(rng, day, count), 1):
+            sale_id += 1
+            item_count = 1
+            if log_q is not None:
+                item_count += int(math.log(1.0 - rng.random()) / log_q)
+            item_count = min(item_count, max_items)
+
+            chosen = set()
+            while len(chosen) < item_count:
+                chosen.add(rng.choices(ranked, cum_weights=cum_weights)[0])
+
+            total = 0.0
+            for drug_id in sorted(chosen):
+                item_id += 1
+                movement_id += 1
+                quantity = rng.choices(QUANTITIES[0], weights=QUANTITIES[1])[0]
+                price = prices[drug_id]
+                line_total = round(quantity * price, 2)
+                total += line_total
+                units_sold[drug_id] += quantity
+                batch_items.append((item_id, sale_id, drug_id, quantity, price, line_total))
+                batch_lots.append((item_id, lot_ids[drug_id], quantity))
+                batch_movements.append((movement_id, drug_id, -quantity, item_id, sold_at))
+            written_items += len(chosen)
+
+            customer_name, customer_phone = random_customer(rng)
+            payment_method = rng.choices(PAYMENT_METHODS[0], weights=PAYMENT_METHODS[1])[0]
+            batch_sales.append((sale_id, f"{receipt_day}{number:04d}", round(total, 2), payment_method,
+                                customer_name, customer_phone, rng.choice(CASHIERS), sold_at))
+            written_sales += 1
+
+            if len(batch_sales) >= SALES_BATCH_SIZE:
+                flush()
+                if progress_callback:
+                    progress_callback(written_sales, sales)
+        if count:
+            counters.append((receipt_day, count))
+    flush()
+    if progress_callback:
+        progress_callback(written_sales, sales)
+
+    with db.transaction() as cursor:
+        for _, _, sql in deferred:
+            cursor.execute(sql)
+        # Opening stock = what is left now + everything sold since
+        cursor.executemany('''
+            UPDATE stock_movements SET quantity_change = quantity_change + ? WHERE id = ?
+        ''', [(units, opening_ids[drug_id]) for drug_id, units in units_sold.items()])
+    db.take_stock_snapshot(force=True)
+    rollups = db.rebuild_sales_rollups()
+    if rollups is None:
+        raise RuntimeError("rollup rebuild failed")
+
+    return {
+        'drugs': stats['inserted'],
+        'sales': written_sales,
+        'sale_items': written_items,
+        'first_day': start_date.isoformat(),
+        'last_day': end_date.isoformat(),
+        **rollups,
+    }
+
+def main():
+    """Parse the command line and build the database"""
+    parser = argparse.ArgumentParser(description="Build a pharmacy POS database of synthetic test data")
+    parser.add_argument('--db', required=True, help="database file to create")
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small',
+                        help="preset sizes: small (1k drugs, 20k sales, 100k items), medium (10x), "
+                             "large (50k drugs, 2M sales, 10M items); default small")
+    parser.add_argument('--drugs', type=int, help="number of drugs (overrides --scale)")
+    parser.add_argument('--sales', type=int, help="number of sales (overrides --scale)")
+    parser.add_argument('--items', type=int, help="number of sale items, approximately (overrides --scale)")
+    parser.add_argument('--days', type=int, default=730, help="days of sales history (default: 730)")
+    parser.add_argument('--end-date', type=date.fromisoformat,
+                        help="last day of sales, YYYY-MM-DD (default: yesterday); "
+                             "give it for identical reruns on later days")
+    parser.add_argument('--seed', type=int, default=42, help="random seed (default: 42)")
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help="Zipf exponent of drug popularity; higher favours the top sellers (default: 1.0)")
+    parser.add_argument('--force', action='store_true', help="replace the database file if it exists")
+    parser.add_argument('--profile', metavar='FILE', help="write SQL timings for the run to FILE (JSON)")
+    args = parser.parse_args()
+
+    drugs, sales, items = SCALES[args.scale]
+    drugs = args.drugs if args.drugs is not None else drugs
+    sales = args.sales if args.sales is not None else sales
+    items = args.items if args.items is not None else items
+    end_date = args.end_date or date.today() - timedelta(days=1)
+    if end_date >= date.today():
+        parser.error("--end-date must be in the past")
+    if drugs < 1 or sales < 0 or args.days < 1 or (sales and items < sales):
+        parser.error("need at least one drug and one day, and at least one item per sale")
+
+    if os.path.exists(args.db):
+        if not args.force:
+            parser.error(f"{args.db} already exists (use --force to replace it)")
+        for path in (args.db, args.db + '-wal', args.db + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    print(f"Generating {drugs} drugs, {sales} sales and ~{items} items over {args.days} days "
+          f"to {end_date} (seed {args.seed})...")
+    started = time.perf_counter()
+    profiler = SQLProfiler(dump_path=args.profile) if args.profile else None
+    db = DatabaseManager(args.db, profiler=profiler)
+    try:
+        db.initialize_database()
+        result = generate(db, seed=args.seed, drugs=drugs, sales=sales, items=items, days=args.days,
+                          end_date=end_date, skew=args.skew,
+                          progress_callback=lambda done, total: print(f"  {done}/{total} sales", end='\r'))
+        print()
+    except Exception as e:
+        print(f"❌ Generation failed: {e}")
+        return 1
+    finally:
+        db.close()
+
+    for name, count in result.items():
+        print(f"✅ {name}: {count}")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
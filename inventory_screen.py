@@ -4,16 +4,27 @@ Handles drug inventory management, stock updates, and alerts
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
 from tkcalendar import DateEntry
+from utils import read_drug_csv, format_inventory_alerts, inventory_statuses
+from db_worker import InlineExecutor
 
 class InventoryScreen:
-    def __init__(self, parent, db, status_callback):
+    # Drugs fetched per page as the list is scrolled
+    PAGE_SIZE = 100
+    
+    def __init__(self, parent, db, status_callback, executor=None):
         self.parent = parent
         self.db = db
         self.status_callback = status_callback
+        self.executor = executor or InlineExecutor()
         self.current_drug = None
+        self.next_cursor = None
+        self.page_pending = False
+        self.loaded_count = 0
+        # Drug id -> status from the latest inventory alerts
+        self.drug_statuses = {}
         
         self.setup_ui()
         self.load_drugs()
@@ -60,6 +71,11 @@ class InventoryScreen:
                                relief=tk.FLAT, padx=20, pady=10, cursor='hand2', width=15)
         stock_button.pack(pady=5)
         
+        import_button = tk.Button(actions_frame, text="Import CSV", command=self.import_drugs_csv,
+                                font=('Arial', 12, 'bold'), bg='#16a085', fg='white',
+                                relief=tk.FLAT, padx=20, pady=10, cursor='hand2', width=15)
+        import_button.pack(pady=5)
+        
         refresh_button = tk.Button(actions_frame, text="Refresh", command=self.refresh_data,
                                  font=('Arial', 12, 'bold'), bg='#9b59b6', fg='white',
                                  relief=tk.FLAT, padx=20, pady=10, cursor='hand2', width=15)
@@ -117,86 +133,92 @@ class InventoryScreen:
             self.drugs_tree.heading(col, text=col)
             self.drugs_tree.column(col, width=column_widths[i], anchor=tk.CENTER)
         
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(drugs_frame, orient=tk.VERTICAL, command=self.drugs_tree.yview)
-        self.drugs_tree.configure(yscrollcommand=scrollbar.set)
+        # Scrollbar (also fetches the next page when the end comes into view)
+        self.drugs_scrollbar = ttk.Scrollbar(drugs_frame, orient=tk.VERTICAL, command=self.drugs_tree.yview)
+        self.drugs_tree.configure(yscrollcommand=self.on_tree_scroll)
+        
+        self.drugs_tree.tag_configure("warning", foreground="#e74c3c")
         
         self.drugs_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=10, pady=10)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=10)
+        self.drugs_scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=10)
         
         # Bind double-click to edit
         self.drugs_tree.bind('<Double-1>', self.on_drug_double_click)
         
     def load_drugs(self):
-        """Load all drugs into the treeview"""
+        """Load the first page of drugs into the treeview"""
         # Clear existing items
         for item in self.drugs_tree.get_children():
             self.drugs_tree.delete(item)
         
-        # Get drugs from database
-        drugs = self.db.get_all_drugs()
+        self.next_cursor = None
+        self.page_pending = False
+        self.loaded_count = 0
+        self.append_drugs_page()
+    
+    def load_more_drugs(self):
+        """Append the next page if the full list is showing and has more rows"""
+        if self.next_cursor:
+            self.append_drugs_page()
+        else:
+            self.page_pending = False
+    
+    def append_drugs_page(self):
+        """Fetch the page after next_cursor in the background"""
+        # Shares its key with search and filter so a stale page never lands on new results
+        self.executor.submit(self.db.get_drugs_page, self.next_cursor, self.PAGE_SIZE,
+                             callback=self.show_drugs_page, key='inventory-list')
+    
+    def show_drugs_page(self, page):
+        """Add a fetched page to the treeview"""
+        drugs, self.next_cursor = page
+        self.page_pending = False
         
-        # Add drugs to treeview
         for drug in drugs:
-            # Determine status
-            status = "OK"
-            if drug['quantity_in_stock'] <= 0:
-                status = "OUT OF STOCK"
-            elif drug['quantity_in_stock'] <= drug['reorder_level']:
-                status = "LOW STOCK"
-            
-            # Check expiry
-            expiry_date = datetime.strptime(drug['expiry_date'], '%Y-%m-%d').date()
-            days_to_expiry = (expiry_date - datetime.now().date()).days
-            if days_to_expiry <= 30:
-                status = "EXPIRING SOON"
-            
-            self.drugs_tree.insert('', 'end', values=(
-                drug['id'],
-                drug['generic_name'],
-                drug['brand_name'],
-                drug['dosage'],
-                drug['form'],
-                drug['quantity_in_stock'],
-                f"GHS {drug['unit_price']:.2f}",
-                drug['expiry_date'],
-                status
-            ))
-        
-        self.status_callback(f"Loaded {len(drugs)} drugs")
+            self.insert_drug_row(drug)
+        self.loaded_count += len(drugs)
+        
+        more = " (scroll for more)" if self.next_cursor else ""
+        self.status_callback(f"Loaded {self.loaded_count} drugs{more}")
+    
+    def on_tree_scroll(self, first, last):
+        """Update the scrollbar and fetch another page near the end of the list"""
+        self.drugs_scrollbar.set(first, last)
+        if float(last) >= 0.9 and self.next_cursor and not self.page_pending:
+            self.page_pending = True
+            self.parent.after_idle(self.load_more_drugs)
+    
+    def insert_drug_row(self, drug):
+        """Add one drug to the treeview with its status from the latest alerts"""
+        status = self.drug_statuses.get(drug['id'], "OK")
+        self.drugs_tree.insert('', 'end', tags=("warning",) if status != "OK" else (), values=(
+            drug['id'],
+            drug['generic_name'],
+            drug['brand_name'],
+            drug['dosage'],
+            drug['form'],
+            drug['quantity_in_stock'],
+            f"GHS {drug['unit_price']:.2f}",
+            drug['expiry_date'],
+            status
+        ))
     
     def load_alerts(self):
-        """Load and display inventory alerts"""
-        alerts = []
-        
-        # Low stock alerts
-        low_stock_drugs = self.db.get_low_stock_drugs()
-        if low_stock_drugs:
-            alerts.append("⚠️ LOW STOCK ALERTS:")
-            for drug in low_stock_drugs:
-                alerts.append(f"  • {drug['generic_name']} ({drug['brand_name']}) - {drug['quantity_in_stock']} left")
-            alerts.append("")
-        
-        # Expiring drugs alerts
-        expiring_drugs = self.db.get_expiring_drugs(30)
-        if expiring_drugs:
-            alerts.append("⚠️ EXPIRING SOON ALERTS:")
-            for drug in expiring_drugs:
-                expiry_date = datetime.strptime(drug['expiry_date'], '%Y-%m-%d').date()
-                days_left = (expiry_date - datetime.now().date()).days
-                alerts.append(f"  • {drug['generic_name']} ({drug['brand_name']}) - Expires in {days_left} days")
-            alerts.append("")
-        
-        # Out of stock alerts
-        out_of_stock = [drug for drug in self.db.get_all_drugs() if drug['quantity_in_stock'] <= 0]
-        if out_of_stock:
-            alerts.append("🚫 OUT OF STOCK ALERTS:")
-            for drug in out_of_stock:
-                alerts.append(f"  • {drug['generic_name']} ({drug['brand_name']})")
-            alerts.append("")
-        
-        if not alerts:
-            alerts.append("✅ All inventory items are in good condition!")
+        """Load inventory alerts in the background and display them"""
+        self.executor.submit(self.collect_alerts, callback=self.show_alerts, key='inventory-alerts')
+    
+    def collect_alerts(self):
+        """Build the alert lines and drug statuses (runs on the database worker)"""
+        alerts = self.db.get_inventory_alerts(30)
+        return format_inventory_alerts(alerts), inventory_statuses(alerts)
+    
+    def show_alerts(self, result):
+        """Display alert lines with warnings highlighted and update the listed drugs' status"""
+        alerts, self.drug_statuses = result
+        for item in self.drugs_tree.get_children():
+            status = self.drug_statuses.get(int(self.drugs_tree.set(item, 'ID')), "OK")
+            self.drugs_tree.set(item, 'Status', status)
+            self.drugs_tree.item(item, tags=("warning",) if status != "OK" else ())
         
         # Update alerts text
         self.alerts_text.delete(1.0, tk.END)
@@ -219,26 +241,43 @@ class InventoryScreen:
         """Handle drug search"""
         search_term = self.search_var.get().strip()
         if search_term:
-            drugs = self.db.search_drugs(search_term)
-            self.display_filtered_drugs(drugs)
+            self.executor.submit(self.db.search_drugs, search_term, limit=None,
+                                 callback=self.display_filtered_drugs, key='inventory-list')
         else:
             self.load_drugs()
     
     def on_filter(self, event=None):
         """Handle filter selection"""
         filter_type = self.filter_var.get()
-        drugs = self.db.get_all_drugs()
+        if filter_type == "All":
+            self.load_drugs()
+            return
+        
+        self.executor.submit(self.filter_drugs, filter_type,
+                             callback=self.display_filtered_drugs, key='inventory-list')
+    
+    def filter_drugs(self, filter_type):
+        """Return the drugs matching a filter (runs on the database worker)"""
+        # The alert categories are served from the alert cache
+        alerts = self.db.get_inventory_alerts(30)
         
         if filter_type == "Low Stock":
-            filtered_drugs = [drug for drug in drugs if drug['quantity_in_stock'] <= drug['reorder_level'] and drug['quantity_in_stock'] > 0]
+            filtered_drugs = alerts['low_stock']
         elif filter_type == "Expiring Soon":
-            filtered_drugs = self.db.get_expiring_drugs(30)
+            # Alerts list every expiring lot; show each drug once, with the
+            # expiry date of its earliest-expiring lot (the list is in expiry order)
+            filtered_drugs = []
+            seen = set()
+            for lot in alerts['expiring']:
+                if lot['id'] not in seen:
+                    seen.add(lot['id'])
+                    filtered_drugs.append(lot)
         elif filter_type == "Out of Stock":
-            filtered_drugs = [drug for drug in drugs if drug['quantity_in_stock'] <= 0]
+            filtered_drugs = alerts['out_of_stock']
         else:
-            filtered_drugs = drugs
+            filtered_drugs = self.db.get_all_drugs()
         
-        self.display_filtered_drugs(filtered_drugs)
+        return filtered_drugs
     
     def display_filtered_drugs(self, drugs):
         """Display filtered drugs in treeview"""
@@ -246,30 +285,12 @@ class InventoryScreen:
         for item in self.drugs_tree.get_children():
             self.drugs_tree.delete(item)
         
+        # Filtered results are complete lists, so no further pages
+        self.next_cursor = None
+        
         # Add filtered drugs
         for drug in drugs:
-            status = "OK"
-            if drug['quantity_in_stock'] <= 0:
-                status = "OUT OF STOCK"
-            elif drug['quantity_in_stock'] <= drug['reorder_level']:
-                status = "LOW STOCK"
-            
-            expiry_date = datetime.strptime(drug['expiry_date'], '%Y-%m-%d').date()
-            days_to_expiry = (expiry_date - datetime.now().date()).days
-            if days_to_expiry <= 30:
-                status = "EXPIRING SOON"
-            
-            self.drugs_tree.insert('', 'end', values=(
-                drug['id'],
-                drug['generic_name'],
-                drug['brand_name'],
-                drug['dosage'],
-                drug['form'],
-                drug['quantity_in_stock'],
-                f"GHS {drug['unit_price']:.2f}",
-                drug['expiry_date'],
-                status
-            ))
+            self.insert_drug_row(drug)
     
     def on_drug_double_click(self, event):
         """Handle double-click on drug item"""
@@ -432,7 +453,7 @@ class InventoryScreen:
         
         dialog = tk.Toplevel(self.parent)
         dialog.title("Update Stock")
-        dialog.geometry("400x300")
+        dialog.geometry("400x380")
         dialog.configure(bg='white')
         dialog.transient(self.parent)
         dialog.grab_set()
@@ -440,8 +461,8 @@ class InventoryScreen:
         # Center the dialog
         dialog.update_idletasks()
         x = (dialog.winfo_screenwidth() // 2) - (400 // 2)
-        y = (dialog.winfo_screenheight() // 2) - (300 // 2)
-        dialog.geometry(f"400x300+{x}+{y}")
+        y = (dialog.winfo_screenheight() // 2) - (380 // 2)
+        dialog.geometry(f"400x380+{x}+{y}")
         
         # Content
         content_frame = tk.Frame(dialog, bg='white')
@@ -464,15 +485,25 @@ class InventoryScreen:
         adjustment_var = tk.StringVar()
         adjustment_entry = tk.Entry(content_frame, textvariable=adjustment_var, 
                                   font=('Arial', 12), width=20)
-        adjustment_entry.pack(fill=tk.X, pady=(0, 20))
+        adjustment_entry.pack(fill=tk.X, pady=(0, 10))
         adjustment_entry.focus()
         
+        # Reason recorded in the stock ledger
+        reason_label = tk.Label(content_frame, text="Reason:", 
+                              font=('Arial', 11, 'bold'), bg='white', fg='#2c3e50')
+        reason_label.pack(anchor=tk.W, pady=(0, 5))
+        
+        reason_var = tk.StringVar(value="Adjustment")
+        reason_combo = ttk.Combobox(content_frame, textvariable=reason_var, state="readonly",
+                                  values=["Adjustment", "Write-off"], font=('Arial', 11))
+        reason_combo.pack(fill=tk.X)
+        
         # Buttons
         buttons_frame = tk.Frame(content_frame, bg='white')
         buttons_frame.pack(fill=tk.X, pady=20)
         
         update_button = tk.Button(buttons_frame, text="Update Stock", command=lambda: self.update_stock(
-            dialog, drug['id'], adjustment_var
+            dialog, update_button, drug['id'], adjustment_var, reason_var
         ), font=('Arial', 12, 'bold'), bg='#27ae60', fg='white', 
         relief=tk.FLAT, padx=20, pady=5, cursor='hand2')
         update_button.pack(side=tk.LEFT, padx=(0, 10))
@@ -482,20 +513,83 @@ class InventoryScreen:
                                 relief=tk.FLAT, padx=20, pady=5, cursor='hand2')
         cancel_button.pack(side=tk.LEFT)
     
-    def update_stock(self, dialog, drug_id, adjustment_var):
-        """Update drug stock"""
+    def update_stock(self, dialog, update_button, drug_id, adjustment_var, reason_var):
+        """Update drug stock in the background"""
         try:
             adjustment = int(adjustment_var.get())
-            
-            if self.db.update_stock(drug_id, adjustment):
-                messagebox.showinfo("Success", "Stock updated successfully!")
-                dialog.destroy()
-                self.refresh_data()
-            else:
-                messagebox.showerror("Error", "Failed to update stock!")
-                
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number for stock adjustment!")
+            return
+        
+        reason = 'adjustment'
+        if reason_var.get() == "Write-off":
+            # Write-offs always remove stock
+            adjustment = -abs(adjustment)
+            reason = 'write_off'
+        
+        # Once started the adjustment must be recorded, even if the screen is closed
+        update_button.config(state=tk.DISABLED)
+        self.status_callback("Updating stock...")
+        self.executor.submit(self.db.update_stock, drug_id, adjustment, reason,
+                             callback=lambda updated: self.show_stock_update_result(updated, dialog, update_button),
+                             cancellable=False)
+    
+    def show_stock_update_result(self, updated, dialog, update_button):
+        """Report a stock adjustment and reload the list"""
+        if not updated:
+            if dialog.winfo_exists():
+                update_button.config(state=tk.NORMAL)
+                messagebox.showerror("Error", "Failed to update stock!")
+            self.status_callback("Stock update failed")
+            return
+        
+        if dialog.winfo_exists():
+            messagebox.showinfo("Success", "Stock updated successfully!")
+            dialog.destroy()
+        if self.drugs_tree.winfo_exists():
+            self.refresh_data()
+        else:
+            self.status_callback("Stock updated")
+    
+    def import_drugs_csv(self):
+        """Bulk add or update drugs from a CSV file"""
+        filename = filedialog.askopenfilename(
+            title="Import Drugs",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if not filename:
+            return
+        
+        def show_progress(staged):
+            # Called on the worker; hand the status update to the Tk thread
+            self.executor.call_soon(self.status_callback, f"Importing drugs... {staged} rows read")
+        
+        errors = []
+        self.status_callback("Importing drugs...")
+        # Keep importing and reporting if the user switches screens meanwhile
+        self.executor.submit(self.db.import_drugs, read_drug_csv(filename, errors),
+                             progress_callback=show_progress,
+                             callback=lambda stats: self.show_import_result(stats, errors),
+                             cancellable=False)
+    
+    def show_import_result(self, stats, errors):
+        """Report the outcome of a CSV import and reload the list"""
+        if stats is None:
+            messagebox.showerror("Error", "Import failed! No changes were saved.")
+            self.status_callback("Import failed")
+            return
+        
+        message = (f"Added: {stats['inserted']}\nUpdated: {stats['updated']}\n"
+                   f"Rejected: {len(errors)}\n\n"
+                   f"{stats['staged']} rows in {stats['seconds']:.1f}s ({stats['rows_per_second']:.0f} rows/s)")
+        if errors:
+            message += "\n\nFirst problems:\n" + "\n".join(
+                f"Line {line_number}: {problem}" for line_number, problem in errors[:5])
+        messagebox.showinfo("Import Complete", message)
+        if self.drugs_tree.winfo_exists():
+            self.refresh_data()
+        else:
+            self.status_callback("Drugs imported")
     
     def refresh_data(self):
         """Refresh all data"""
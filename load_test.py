@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+Multi-Cashier Load Test for Ghanaian Pharmacy POS System
+Simulates several counters selling from one database at the same time and
+checks afterwards that stock, ledger, lots and sales totals still agree
+
+Usage:
+    python load_test.py --db bench.db [--cashiers 4] [--duration 60] [--rate 10]
+    python load_test.py --db bench.db --cashiers 8 --rate 0 --output load.json
+
+Each cashier is a separate process with its own DatabaseManager and receipt
+prefix, like a real terminal (use --threads to run them in one process).
+The test writes real sales, so point it at a copy or a database built with
+generate_data.py, never at the live pharmacy.db.
+"""
+
+import argparse
+import json
+import multiprocessing
+import queue
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from benchmark import percentile
+from database import DatabaseManager, InsufficientStockError
+from db_profiler import SQLProfiler
+
+# Lines per basket, and units per line
+BASKET_SIZES = ([1, 2, 3, 4, 5, 6], [30, 25, 20, 12, 8, 5])
+LINE_QUANTITIES = ([1, 2, 3, 5, 10], [55, 20, 12, 8, 5])
+PAYMENT_METHODS = (['Cash', 'Mobile Money', 'Card'], [55, 38, 7])
+
+def run_cashier(index, db_path, seed, duration, rate, start_at, results):
+    """Sell baskets until start_at + duration and put a report on results
+
+    rate is this cashier's target sales per second (Poisson arrivals); 0
+    sells back to back. Every basket line is looked up with search_drugs
+    first, as at the counter.
+    """
+    rng = random.Random(seed * 1000 + index)
+    # Only the BEGIN IMMEDIATE timings are wanted; no slow query log
+    profiler = SQLProfiler(slow_query_ms=float('inf'))
+    db = DatabaseManager(db_path, receipt_prefix=f"T{index + 1}-", profiler=profiler)
+    report = {
+        'cashier': index + 1,
+        'sales': 0,
+        'failed': 0,
+        'short': 0,
+        'amount': 0.0,
+        'units': Counter(),
+        'checkout_ms': [],
+        'search_ms': [],
+        'behind_ms': 0.0,
+    }
+    try:
+        with db.reader() as conn:
+            # Drugs with unexpired stock; checkout never sells from expired lots
+            drugs = [tuple(row) for row in conn.execute('''
+                SELECT id, generic_name, unit_price FROM drugs d
+                WHERE EXISTS (SELECT 1 FROM stock_lots
+                              WHERE drug_id = d.id AND quantity > 0
+                                AND expiry_date >= date('now', 'localtime'))
+                ORDER BY id
+            ''')]
+        # Every counter shares the same best sellers, which is where contention comes from
+        random.Random(seed).shuffle(drugs)
+        cum_weights = []
+        running = 0.0
+        for rank in range(len(drugs)):
+            running += 1.0 / (rank + 1)
+            cum_weights.append(running)
+
+        deadline = start_at + duration
+        next_at = start_at
+        time.sleep(max(start_at - time.time(), 0))
+        while drugs:
+            if rate:
+                next_at += rng.expovariate(rate)
+                if next_at >= deadline:
+                    break
+                wait = next_at - time.time()
+                if wait > 0:
+                    time.sleep(wait)
+                else:
+                    report['behind_ms'] -= wait * 1000
+            elif time.time() >= deadline:
+                break
+
+            lines = min(rng.choices(BASKET_SIZES[0], weights=BASKET_SIZES[1])[0], len(drugs))
+            basket = {}
+            while len(basket) < lines:
+                drug = rng.choices(drugs, cum_weights=cum_weights)[0]
+                basket[drug[0]] = drug
+
+            items = []
+            for drug_id, generic_name, unit_price in basket.values():
+                started = time.perf_counter()
+                db.search_drugs(generic_name[:4])
+                report['search_ms'].append((time.perf_counter() - started) * 1000)
+                quantity = rng.choices(LINE_QUANTITIES[0], weights=LINE_QUANTITIES[1])[0]
+                items.append({'drug_id': drug_id, 'quantity': quantity, 'unit_price': unit_price,
+                              'total_price': round(quantity * unit_price, 2)})
+            sale_data = {
+                'total_amount': round(sum(item['total_price'] for item in items), 2),
+                'payment_method': rng.choices(PAYMENT_METHODS[0], weights=PAYMENT_METHODS[1])[0],
+                'cashier_name': f"Cashier {index + 1}",
+            }
+
+            started = time.perf_counter()
+            try:
+                sale_id = db.checkout(sale_data, items)
+            except InsufficientStockError:
+                report['short'] += 1
+                continue
+            finally:
+                report['checkout_ms'].append((time.perf_counter() - started) * 1000)
+
+            if sale_id is None:
+                report['failed'] += 1
+                continue
+            report['sales'] += 1
+            report['amount'] += sale_data['total_amount']
+            for item in items:
+                report['units'][item['drug_id']] += item['quantity']
+    except Exception as e:
+        report['error'] = str(e)
+    finally:
+        db.close()
+
+    begin = profiler.statements.get('BEGIN IMMEDIATE')
+    report['lock_wait_ms'] = begin.total_ms if begin else 0.0
+    report['lock_wait_max_ms'] = begin.max_ms if begin else 0.0
+    report['transactions'] = begin.calls if begin else 0
+    # busy_timeout ran out before the write lock was free
+    report['locked_errors'] = begin.errors if begin else 0
+    results.put(report)
+
+def read_state(db):
+    """Stock levels and high-water marks to compare the run against"""
+    with db.reader() as conn:
+        return {
+            'stock': dict(conn.execute("SELECT id, quantity_in_stock FROM drugs").fetchall()),
+            'last_sale_id': conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0],
+            'last_movement_id': conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements").fetchone()[0],
+        }
+
+def check_consistency(db, before, reports):
+    """Compare the database after the run with what the cashiers reported
+
+    Returns a list of (check, passed, detail).
+    """
+    units = Counter()
+    for report in reports:
+        units.update(report['units'])
+    expected_sales = sum(report['sales'] for report in reports)
+    expected_amount = round(sum(report['amount'] for report in reports), 2)
+    after = read_state(db)
+    checks = []
+
+    wrong_stock = [drug_id for drug_id, quantity in after['stock'].items()
+                   if quantity != before['stock'].get(drug_id, 0) - units[drug_id]]
+    checks.append(("Stock = before - units sold", not wrong_stock,
+                   f"{len(wrong_stock)} drugs differ" if wrong_stock else f"{sum(units.values())} units"))
+
+    with db.reader() as conn:
+        sales, amount = conn.execute('''
+            SELECT COUNT(*), ROUND(COALESCE(SUM(total_amount), 0), 2) FROM sales WHERE id > ?
+        ''', (before['last_sale_id'],)).fetchone()
+        checks.append(("Sales recorded = sales completed", sales == expected_sales and abs(amount - expected_amount) < 0.01,
+                       f"{sales} sales, GHS {amount:.2f} (expected {expected_sales}, GHS {expected_amount:.2f})"))
+
+        mismatched = conn.execute('''
+            SELECT COUNT(*) FROM sales s
+            WHERE s.id > ?
+              AND ABS(s.total_amount - (SELECT COALESCE(SUM(total_price), 0) FROM sale_items
+                                        WHERE sale_id = s.id)) > 0.005
+        ''', (before['last_sale_id'],)).fetchone()[0]
+        checks.append(("Sale totals = sum of their items", mismatched == 0, f"{mismatched} sales differ"))
+
+        ledger = dict(conn.execute('''
+            SELECT drug_id, SUM(quantity_change) FROM stock_movements
+            WHERE id > ? GROUP BY drug_id
+        ''', (before['last_movement_id'],)).fetchall())
+        wrong_ledger = [drug_id for drug_id in set(ledger) | set(units)
+                        if ledger.get(drug_id, 0) != -units[drug_id]]
+        checks.append(("Ledger movements = units sold", not wrong_ledger, f"{len(wrong_ledger)} drugs differ"))
+
+        touched = list(units)
+        wrong_lots = 0
+        for start in range(0, len(touched), 500):
+            chunk = touched[start:start + 500]
+            wrong_lots += conn.execute(f'''
+                SELECT COUNT(*) FROM drugs d
+                WHERE d.id IN ({', '.join('?' * len(chunk))})
+                  AND d.quantity_in_stock != (SELECT COALESCE(SUM(quantity), 0) FROM stock_lots
+                                              WHERE drug_id = d.id)
+            ''', chunk).fetchone()[0]
+        checks.append(("Lot quantities = stock", wrong_lots == 0, f"{wrong_lots} drugs differ"))
+
+        wrong_days = conn.execute('''
+            SELECT COUNT(*) FROM (
+                SELECT substr(sale_date, 1, 10) as day, COUNT(*) as transactions,
+                       ROUND(SUM(total_amount), 2) as amount
+                FROM sales
+                WHERE sale_date >= (SELECT substr(MIN(sale_date), 1, 10) FROM sales WHERE id > ?)
+                GROUP BY day
+            ) raw
+            WHERE NOT EXISTS (
+                SELECT 1 FROM daily_sales_summary r
+                WHERE r.day = raw.day
+                GROUP BY r.day
+                HAVING SUM(r.transactions) = raw.transactions
+                   AND ROUND(SUM(r.gross_amount), 2) = raw.amount
+            )
+        ''', (before['last_sale_id'],)).fetchone()[0]
+        checks.append(("Daily rollup = raw sales", wrong_days == 0, f"{wrong_days} days differ"))
+    return checks
+
+def summarize(reports, elapsed):
+    """Combine the cashier reports into the figures printed and saved"""
+    checkout_ms = sorted(ms for report in reports for ms in report['checkout_ms'])
+    search_ms = sorted(ms for report in reports for ms in report['search_ms'])
+    sales = sum(report['sales'] for report in reports)
+    transactions = sum(report['transactions'] for report in reports)
+    lock_wait_ms = sum(report['lock_wait_ms'] for report in reports)
+
+    def latencies(values):
+        if not values:
+            return {}
+        return {'p50_ms': round(percentile(values, 0.50), 3), 'p95_ms': round(percentile(values, 0.95), 3),
+                'p99_ms': round(percentile(values, 0.99), 3), 'max_ms': round(values[-1], 3)}
+
+    return {
+        'seconds': round(elapsed, 2),
+        'sales': sales,
+        'sales_per_second': round(sales / elapsed, 2) if elapsed else 0.0,
+        'failed': sum(report['failed'] for report in reports),
+        'insufficient_stock': sum(report['short'] for report in reports),
+        'locked_errors': sum(report['locked_errors'] for report in reports),
+        'lock_wait_ms': round(lock_wait_ms, 1),
+        'lock_wait_mean_ms': round(lock_wait_ms / transactions, 3) if transactions else 0.0,
+        'lock_wait_max_ms': round(max((report['lock_wait_max_ms'] for report in reports), default=0.0), 3),
+        'behind_schedule_ms': round(sum(report['behind_ms'] for report in reports), 1),
+        'checkout': latencies(checkout_ms),
+        'search': latencies(search_ms),
+        'cashiers': [{'cashier': report['cashier'], 'sales': report['sales'], 'failed': report['failed'],
+                      'locked_errors': report['locked_errors'], 'lock_wait_ms': round(report['lock_wait_ms'], 1)}
+                     for report in reports],
+    }
+
+def run_load_test(db_path, cashiers=4, duration=30.0, rate=10.0, seed=42, threads=False):
+    """Run the simulation and the consistency checks
+
+    rate is the target sales per second across all cashiers (0 = as fast as
+    possible). Returns (summary, checks).
+    """
+    db = DatabaseManager(db_path)
+    try:
+        db.initialize_database()
+        before = read_state(db)
+
+        # Give every cashier time to start up so they all begin selling together
+        start_at = time.time() + 1.0 + 0.2 * cashiers
+        results = queue.Queue() if threads else multiprocessing.Queue()
+        worker_class = threading.Thread if threads else multiprocessing.Process
+        workers = [worker_class(target=run_cashier,
+                                args=(i, db_path, seed, duration, rate / cashiers, start_at, results))
+                   for i in range(cashiers)]
+        for worker in workers:
+            worker.start()
+
+        reports = [results.get() for _ in workers]
+        elapsed = time.time() - start_at
+        for worker in workers:
+            worker.join()
+        for report in reports:
+            if 'error' in report:
+                print(f"⚠️  Cashier {report['cashier']} stopped early: {report['error']}")
+
+        reports.sort(key=lambda report: report['cashier'])
+        return summarize(reports, elapsed), check_consistency(db, before, reports)
+    finally:
+        db.close()
+
+def main():
+    """Parse the command line, run the load test and report"""
+    parser = argparse.ArgumentParser(description="Simulate several cashiers selling from one database")
+    parser.add_argument('--db', required=True, help="database to sell from (it is modified)")
+    parser.add_argument('--cashiers', type=int, default=4, help="simulated counters (default: 4)")
+    parser.add_argument('--duration', type=float, default=30, help="seconds to sell for (default: 30)")
+    parser.add_argument('--rate', type=float, default=10,
+                        help="target sales per second across all cashiers; 0 = as fast as possible (default: 10)")
+    parser.add_argument('--seed', type=int, default=42, help="random seed (default: 42)")
+    parser.add_argument('--threads', action='store_true', help="run cashiers as threads of one process")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    if args.cashiers < 1 or args.duration <= 0 or args.rate < 0:
+        parser.error("need at least one cashier, a positive duration and a non-negative rate")
+
+    print(f"Running {args.cashiers} cashiers for {args.duration:g}s at "
+          f"{f'{args.rate:g} sales/s' if args.rate else 'full speed'}...")
+    summary, checks = run_load_test(args.db, args.cashiers, args.duration, args.rate, args.seed, args.threads)
+
+    print(f"\nSales: {summary['sales']} ({summary['sales_per_second']}/s), "
+          f"failed: {summary['failed']}, out of stock: {summary['insufficient_stock']}")
+    print(f"'database is locked' errors: {summary['locked_errors']}")
+    print(f"Lock wait: {summary['lock_wait_ms']:.0f}ms total, {summary['lock_wait_mean_ms']:.2f}ms mean, "
+          f"{summary['lock_wait_max_ms']:.1f}ms max")
+    for name in ('checkout', 'search'):
+        stats = summary[name]
+        if stats:
+            print(f"{name.capitalize()}: p50 {stats['p50_ms']:.2f}ms  p95 {stats['p95_ms']:.2f}ms  "
+                  f"p99 {stats['p99_ms']:.2f}ms  max {stats['max_ms']:.1f}ms")
+    if summary['behind_schedule_ms'] > 1000:
+        print(f"⚠️  Cashiers fell {summary['behind_schedule_ms'] / 1000:.1f}s behind the target rate")
+
+    print("\nConsistency checks:")
+    for name, passed, detail in checks:
+        print(f"{'✅' if passed else '❌'} {name}: {detail}")
+
+    if args.output:
+        try:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump({'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                           'settings': vars(args), 'results': summary,
+                           'checks': [{'check': name, 'passed': passed, 'detail': detail}
+                                      for name, passed, detail in checks]}, f, indent=2)
+        except Exception as e:
+            print(f"Error saving results: {e}")
+
+    return 0 if all(passed for _, passed, _ in checks) and not summary['failed'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
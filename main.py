@@ -13,6 +13,8 @@ import sys
 
 # Import our modules
 from database import DatabaseManager
+from db_worker import DatabaseExecutor
+from db_profiler import SQLProfiler
 from pos_screen import POSScreen
 from inventory_screen import InventoryScreen
 from sales_history_screen import SalesHistoryScreen
@@ -31,9 +33,20 @@ class PharmacyPOS:
         self.root.resizable(True, True)
         self.root.minsize(1200, 800)
         
-        # Initialize database
-        self.db = DatabaseManager()
-        self.db.initialize_database()
+        # Initialize database (set PHARMACY_RECEIPT_PREFIX per terminal, e.g. "T2-")
+        # Set PHARMACY_SQL_PROFILE to a JSON path to record query timings until exit
+        profiler = None
+        if os.environ.get('PHARMACY_SQL_PROFILE'):
+            profiler = SQLProfiler(slow_query_ms=float(os.environ.get('PHARMACY_SLOW_QUERY_MS', 100)),
+                                   dump_path=os.environ['PHARMACY_SQL_PROFILE'])
+        self.db = DatabaseManager(receipt_prefix=os.environ.get('PHARMACY_RECEIPT_PREFIX', ''),
+                                  profiler=profiler)
+        self.initialize_database()
+        # Daily stock snapshots keep stock-at-date lookups short
+        self.db.take_stock_snapshot()
+        
+        # Screens run their queries on background workers so the window stays responsive
+        self.executor = DatabaseExecutor(self.root)
         
         # Current user (default to admin)
         self.current_user = "Admin"
@@ -44,6 +57,18 @@ class PharmacyPOS:
         # Show main POS screen by default
         self.show_pos_screen()
         
+    def initialize_database(self):
+        """Apply pending schema migrations, showing progress while they run"""
+        splash_label = tk.Label(self.root, text="Starting...", font=('Arial', 14), bg='#f0f0f0')
+        splash_label.pack(expand=True)
+        
+        def show_progress(step, total, description):
+            splash_label.config(text=f"Updating database ({step}/{total}): {description}...")
+            self.root.update()
+        
+        self.db.initialize_database(progress_callback=show_progress)
+        splash_label.destroy()
+    
     def setup_ui(self):
         """Setup the main application UI with navigation"""
         # Main container
@@ -123,6 +148,9 @@ class PharmacyPOS:
     
     def clear_content(self):
         """Clear the main content area"""
+        # Results for the screen being closed are no longer wanted; app-level
+        # work such as backups is submitted as not cancellable and carries on
+        self.executor.cancel_pending()
         for widget in self.content_frame.winfo_children():
             widget.destroy()
     
@@ -130,41 +158,50 @@ class PharmacyPOS:
         """Show the POS sales screen"""
         self.clear_content()
         self.status_label.config(text="POS Sales Screen")
-        POSScreen(self.content_frame, self.db, self.update_status)
+        POSScreen(self.content_frame, self.db, self.update_status, self.executor)
     
     def show_inventory_screen(self):
         """Show the inventory management screen"""
         self.clear_content()
         self.status_label.config(text="Inventory Management")
-        InventoryScreen(self.content_frame, self.db, self.update_status)
+        InventoryScreen(self.content_frame, self.db, self.update_status, self.executor)
     
     def show_sales_history_screen(self):
         """Show the sales history screen"""
         self.clear_content()
         self.status_label.config(text="Sales History")
-        SalesHistoryScreen(self.content_frame, self.db, self.update_status)
+        SalesHistoryScreen(self.content_frame, self.db, self.update_status, self.executor)
     
     def show_reports_screen(self):
         """Show the reports screen"""
         self.clear_content()
         self.status_label.config(text="Reports Dashboard")
-        ReportsScreen(self.content_frame, self.db, self.update_status)
+        ReportsScreen(self.content_frame, self.db, self.update_status, self.executor)
     
     def show_settings_screen(self):
         """Show the settings screen"""
         self.clear_content()
         self.status_label.config(text="System Settings")
-        SettingsScreen(self.content_frame, self.db, self.update_status)
+        SettingsScreen(self.content_frame, self.db, self.update_status, self.executor)
     
     def backup_data(self):
         """Create a backup of the database"""
-        try:
-            backup_path = create_backup()
+        def on_done(backup_path):
             messagebox.showinfo("Backup", f"Database backup created successfully!\nLocation: {backup_path}")
             self.update_status("Backup completed successfully")
-        except Exception as e:
+        
+        def on_error(e):
             messagebox.showerror("Backup Error", f"Failed to create backup: {str(e)}")
             self.update_status("Backup failed")
+        
+        def on_progress(done, total, stage):
+            # Called on the worker thread
+            self.executor.call_soon(self.update_status, f"Backup: {stage} {done * 100 // max(total, 1)}%...")
+        
+        self.update_status("Creating backup...")
+        # Keep running and reporting if the user switches screens meanwhile
+        self.executor.submit(create_backup, progress_callback=on_progress,
+                             callback=on_done, error_callback=on_error, cancellable=False)
     
     def update_status(self, message):
         """Update the status bar message"""
@@ -173,6 +210,7 @@ class PharmacyPOS:
     def exit_application(self):
         """Exit the application with confirmation"""
         if messagebox.askyesno("Exit", "Are you sure you want to exit the application?"):
+            self.executor.shutdown()
             self.db.close()
             self.root.quit()
             sys.exit()
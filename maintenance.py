@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Maintenance Commands for Ghanaian Pharmacy POS System
+Run database upkeep tasks outside the main application
+
+Usage:
+    python maintenance.py rebuild-rollups [--db pharmacy.db]
+    python maintenance.py import-drugs drugs.csv [--db pharmacy.db]
+    python maintenance.py snapshot-stock [--db pharmacy.db]
+    python maintenance.py archive-sales [YEAR ...] [--vacuum] [--db pharmacy.db]
+
+Add --profile FILE to any command to save its SQL timings as JSON.
+"""
+
+import argparse
+import sys
+import time
+
+from database import DatabaseManager
+from db_profiler import SQLProfiler
+from utils import read_drug_csv
+
+def rebuild_rollups(db, args):
+    """Recompute the sales rollup tables from the raw sales"""
+    print("Rebuilding sales rollups...")
+    started = time.perf_counter()
+    rows = db.rebuild_sales_rollups()
+    if rows is None:
+        print("❌ Rebuild failed")
+        return False
+
+    for table, count in rows.items():
+        print(f"✅ {table}: {count} rows")
+    print(f"Done in {time.perf_counter() - started:.2f}s")
+    return True
+
+def import_drugs(db, args):
+    """Bulk load drugs from a CSV file"""
+    print(f"Importing drugs from {args.file}...")
+    errors = []
+    stats = db.import_drugs(read_drug_csv(args.file, errors),
+                            progress_callback=lambda staged: print(f"  {staged} rows staged", end='\r'))
+    print()
+
+    for line_number, message in errors[:20]:
+        print(f"⚠️  Line {line_number}: {message}")
+    if len(errors) > 20:
+        print(f"⚠️  ... and {len(errors) - 20} more rejected rows")
+
+    if stats is None:
+        print("❌ Import failed, no changes were saved")
+        return False
+
+    print(f"✅ {stats['inserted']} added, {stats['updated']} updated, {len(errors)} rejected")
+    print(f"   {stats['staged']} rows in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s)")
+    return True
+
+def snapshot_stock(db, args):
+    """Snapshot stock levels for drugs that moved since the last snapshot"""
+    count = db.take_stock_snapshot(force=True)
+    if count is None:
+        print("❌ Snapshot failed")
+        return False
+
+    print(f"✅ Snapshotted stock for {count} drugs")
+    return True
+
+def archive_sales(db, args):
+    """Move closed years' sales into per-year archive databases"""
+    years = args.years or db.get_archivable_years()
+    if not years:
+        print("No closed years left to archive")
+        return True
+
+    ok = True
+    for year in years:
+        result = db.archive_sales(year)
+        if result is None:
+            print(f"❌ {year}: archive failed, sales left in place")
+            ok = False
+            continue
+        print(f"✅ {year}: moved {result['sales']} sales and {result['items']} items to {result['path']}")
+
+    if args.vacuum and ok:
+        print("Compacting the live database...")
+        ok = db.vacuum()
+    return ok
+
+def main():
+    """Parse the command line and run the requested command"""
+    parser = argparse.ArgumentParser(description="Pharmacy POS database maintenance")
+    parser.add_argument('--db', default='pharmacy.db', help="database file (default: pharmacy.db)")
+    parser.add_argument('--profile', metavar='FILE', help="write SQL timings for the run to FILE (JSON)")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    rebuild = commands.add_parser('rebuild-rollups', help="backfill the daily and per-drug sales rollups")
+    rebuild.set_defaults(handler=rebuild_rollups)
+
+    importer = commands.add_parser('import-drugs', help="add or update drugs from a CSV file")
+    importer.add_argument('file', help="CSV with columns: generic_name, brand_name, dosage, form, "
+                                       "batch_number, expiry_date, unit_price, quantity_in_stock[, reorder_level]")
+    importer.set_defaults(handler=import_drugs)
+
+    snapshot = commands.add_parser('snapshot-stock', help="record stock levels for stock-at-date queries")
+    snapshot.set_defaults(handler=snapshot_stock)
+
+    archive = commands.add_parser('archive-sales', help="move closed years' sales into pharmacy_<year>.db files")
+    archive.add_argument('years', nargs='*', type=int, help="years to archive (default: every closed year)")
+    archive.add_argument('--vacuum', action='store_true', help="compact the live database afterwards")
+    archive.set_defaults(handler=archive_sales)
+
+    args = parser.parse_args()
+
+    # Migration progress repeats while a step runs; print each step once
+    shown_steps = set()
+    def show_migration_progress(step, total, description):
+        if step not in shown_steps:
+            shown_steps.add(step)
+            print(f"Updating database ({step}/{total}): {description}...")
+
+    profiler = SQLProfiler(dump_path=args.profile) if args.profile else None
+    db = DatabaseManager(args.db, profiler=profiler)
+    try:
+        db.initialize_database(progress_callback=show_migration_progress)
+        ok = args.handler(db, args)
+    finally:
+        db.close()
+
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
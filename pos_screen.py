@@ -8,6 +8,8 @@ from tkinter import ttk, messagebox
 from datetime import datetime
 import re
 import os
+from database import InsufficientStockError
+from db_worker import InlineExecutor
 
 class POSScreen:
     # Color palette
@@ -22,12 +24,15 @@ class POSScreen:
     ACCENT_BLUE = '#3498DB'
     BORDER_COLOR = '#E0E4E8'
 
-    def __init__(self, parent, db, status_callback):
+    def __init__(self, parent, db, status_callback, executor=None):
         self.parent = parent
         self.db = db
         self.status_callback = status_callback
+        self.executor = executor or InlineExecutor()
         self.cart_items = []
         self.current_drug = None
+        self.suggestions = []
+        self.checkout_pending = False
         
         self.setup_ui()
         self.load_quick_drugs()
@@ -230,13 +235,21 @@ class POSScreen:
         payment_combo.pack(anchor=tk.W, pady=(0, 10))
         
         # Checkout button
-        checkout_button = tk.Button(checkout_frame, text="COMPLETE SALE", command=self.complete_sale,
+        self.checkout_button = tk.Button(checkout_frame, text="COMPLETE SALE", command=self.complete_sale,
                                   font=('Arial', 16, 'bold'), bg=self.PRIMARY_GREEN, fg='white',
                                   relief=tk.FLAT, padx=30, pady=10, cursor='hand2', activebackground='#229954')
-        checkout_button.pack(pady=10)
+        self.checkout_button.pack(pady=10)
         
     def load_quick_drugs(self, filtered_drugs=None):
-        """Load drugs in a linear list format"""
+        """Load drugs in a linear list format, fetching all of them in the background"""
+        if filtered_drugs is not None:
+            self.executor.cancel('pos-quick-drugs')
+            self.show_quick_drugs(filtered_drugs)
+        else:
+            self.executor.submit(self.db.get_all_drugs, callback=self.show_quick_drugs, key='pos-quick-drugs')
+    
+    def show_quick_drugs(self, drugs):
+        """Show drugs in the Quick Add list"""
         for widget in self.quick_buttons_frame.winfo_children():
             widget.destroy()
         list_frame = tk.Frame(self.quick_buttons_frame, bg=self.CARD_BG)
@@ -250,7 +263,6 @@ class POSScreen:
         )
         canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
         canvas.configure(yscrollcommand=scrollbar.set)
-        drugs = filtered_drugs if filtered_drugs is not None else self.db.get_all_drugs()
         for i, drug in enumerate(drugs):
             drug_frame = tk.Frame(scrollable_frame, bg=self.CARD_BG, relief=tk.RAISED, bd=1, highlightbackground=self.BORDER_COLOR, highlightthickness=1)
             drug_frame.pack(fill=tk.X, padx=5, pady=6, ipadx=4, ipady=4)
@@ -301,6 +313,8 @@ class POSScreen:
     
     def add_drug_to_cart(self, drug, qty_var=None):
         """Add drug directly to cart with default quantity of 1"""
+        if self.cart_locked():
+            return
         try:
             quantity = 1
             if qty_var is not None:
@@ -347,11 +361,15 @@ class POSScreen:
         except Exception as e:
             messagebox.showerror("Error", f"Error adding to cart: {str(e)}")
     
-    def update_cart_display(self):
-        """Update the cart display with improved functionality"""
+    def update_cart_display(self, highlight=()):
+        """Update the cart display with improved functionality
+        
+        Lines whose drug id is in highlight are marked (e.g. short on stock).
+        """
         # Clear existing items
         for item in self.cart_tree.get_children():
             self.cart_tree.delete(item)
+        self.cart_tree.tag_configure('shortage', background='#FADBD8')
         
         # Add items to treeview
         for i, item in enumerate(self.cart_items):
@@ -360,7 +378,7 @@ class POSScreen:
                 item['quantity'],
                 f"GHS {item['unit_price']:.2f}",
                 f"GHS {item['total_price']:.2f}"
-            ))
+            ), tags=('shortage',) if item['drug_id'] in highlight else ())
         
         # Update total
         total = sum(item['total_price'] for item in self.cart_items)
@@ -379,6 +397,8 @@ class POSScreen:
         return None
 
     def remove_item(self):
+        if self.cart_locked():
+            return
         selected_index = self.get_selected_cart_index()
         if selected_index is None:
             messagebox.showwarning("Warning", "Please select an item to remove!")
@@ -389,7 +409,7 @@ class POSScreen:
     
     def clear_cart(self):
         """Clear all items from cart"""
-        if not self.cart_items:
+        if self.cart_locked() or not self.cart_items:
             return
         
         if messagebox.askyesno("Clear Cart", "Are you sure you want to clear the cart?"):
@@ -397,21 +417,31 @@ class POSScreen:
             self.update_cart_display()
             self.status_callback("Cart cleared")
     
+    def cart_locked(self):
+        """True while a checkout is running; the cart must not change under it"""
+        if self.checkout_pending:
+            self.status_callback("Please wait - completing sale...")
+        return self.checkout_pending
+    
+    def set_checkout_pending(self, pending):
+        """Disable the checkout button while a sale is being recorded"""
+        self.checkout_pending = pending
+        self.checkout_button.config(state=tk.DISABLED if pending else tk.NORMAL,
+                                    text="COMPLETING SALE..." if pending else "COMPLETE SALE")
+    
     def complete_sale(self):
         """Complete the sale transaction"""
+        if self.cart_locked():
+            return
         if not self.cart_items:
             messagebox.showwarning("Warning", "Cart is empty!")
             return
         
-        # Generate receipt number
-        receipt_number = self.db.generate_receipt_number()
-        
         # Calculate total
         total_amount = sum(item['total_price'] for item in self.cart_items)
         
-        # Create sale data
+        # Create sale data (receipt number is allocated during checkout)
         sale_data = {
-            'receipt_number': receipt_number,
             'total_amount': total_amount,
             'payment_method': self.payment_var.get(),
             'customer_name': self.customer_name_var.get(),
@@ -419,25 +449,38 @@ class POSScreen:
             'cashier_name': 'Admin'  # TODO: Get from user session
         }
         
-        # Create sale in database
-        sale_id = self.db.create_sale(sale_data)
+        # Sale items
+        items = [{
+            'drug_id': item['drug_id'],
+            'quantity': item['quantity'],
+            'unit_price': item['unit_price'],
+            'total_price': item['total_price']
+        } for item in self.cart_items]
+
+        # Record sale, items and stock changes in one transaction. Once
+        # started it must finish and report, even if the screen is closed
+        self.set_checkout_pending(True)
+        self.status_callback("Completing sale...")
+        self.executor.submit(self.db.checkout, sale_data, items,
+                             callback=lambda sale_id: self.finish_sale(sale_id, sale_data),
+                             error_callback=self.on_checkout_error, cancellable=False)
+    
+    def finish_sale(self, sale_id, sale_data):
+        """Report a recorded sale and reset the cart for the next one"""
+        screen_open = self.checkout_button.winfo_exists()
+        if screen_open:
+            self.set_checkout_pending(False)
         if not sale_id:
-            messagebox.showerror("Error", "Failed to create sale!")
+            if screen_open:
+                messagebox.showerror("Error", "Failed to complete sale! No changes were saved.")
+            self.status_callback("Sale failed - no changes were saved")
             return
-        
-        # Add sale items
-        for item in self.cart_items:
-            item_data = {
-                'drug_id': item['drug_id'],
-                'quantity': item['quantity'],
-                'unit_price': item['unit_price'],
-                'total_price': item['total_price']
-            }
-            
-            if not self.db.add_sale_item(sale_id, item_data):
-                messagebox.showerror("Error", f"Failed to add {item['generic_name']} to sale!")
-                return
-        
+        receipt_number = sale_data['receipt_number']
+        total_amount = sale_data['total_amount']
+        if not screen_open:
+            self.status_callback(f"Sale completed - Receipt #{receipt_number}")
+            return
+
         # Show success message
         messagebox.showinfo("Success", f"Sale completed successfully!\nReceipt #: {receipt_number}\nTotal: GHS {total_amount:.2f}")
         
@@ -451,22 +494,52 @@ class POSScreen:
         
         self.status_callback(f"Sale completed - Receipt #{receipt_number}")
     
+    def on_checkout_error(self, e):
+        """Report a sale that could not be recorded"""
+        if not self.checkout_button.winfo_exists():
+            self.status_callback("Sale failed - no changes were saved")
+            return
+        self.set_checkout_pending(False)
+        if isinstance(e, InsufficientStockError):
+            # Another terminal sold some of this stock, or some of it has
+            # expired; let the cashier fix the cart
+            self.update_cart_display(highlight={shortage['drug_id'] for shortage in e.shortages})
+            lines = "\n".join(
+                f"• {shortage['generic_name']} ({shortage['brand_name']}): "
+                f"{shortage['requested']} in cart, {shortage['available']} in stock"
+                + (f" ({shortage['expired']} expired)" if shortage['expired'] else "")
+                for shortage in e.shortages)
+            messagebox.showwarning("Insufficient Stock",
+                                   f"Not enough stock for the highlighted items:\n\n{lines}\n\n"
+                                   "Adjust the quantities and try again. No changes were saved.")
+            self.load_quick_drugs()
+            return
+        messagebox.showerror("Error", f"Failed to complete sale: {e}\nNo changes were saved.")
+        self.status_callback("Sale failed - no changes were saved")
+    
     def on_search(self, event=None):
         search_term = self.search_var.get().strip()
         if len(search_term) >= 1:
-            drugs = self.db.search_drugs(search_term)
-            if drugs:
-                # Show suggestions
-                self.suggestion_box.delete(0, tk.END)
-                for drug in drugs:
-                    self.suggestion_box.insert(tk.END, f"{drug['generic_name']} ({drug['brand_name']})")
-                self.suggestion_box.place(x=self.search_entry.winfo_x(), y=self.search_entry.winfo_y() + self.search_entry.winfo_height() + 5, width=self.search_entry.winfo_width())
-                self.suggestion_box.lift()
-                self.suggestion_box.pack()
-                self.suggestion_box.selection_clear(0, tk.END)
-            else:
-                self.suggestion_box.pack_forget()
-                self.clear_product_details()
+            # Each keystroke supersedes the previous search still in flight
+            self.executor.submit(self.db.search_drugs, search_term,
+                                 callback=self.show_suggestions, key='pos-search')
+        else:
+            self.executor.cancel('pos-search')
+            self.suggestion_box.pack_forget()
+            self.clear_product_details()
+    
+    def show_suggestions(self, drugs):
+        """Show search results under the search box"""
+        self.suggestions = drugs
+        if drugs:
+            # Show suggestions
+            self.suggestion_box.delete(0, tk.END)
+            for drug in drugs:
+                self.suggestion_box.insert(tk.END, f"{drug['generic_name']} ({drug['brand_name']})")
+            self.suggestion_box.place(x=self.search_entry.winfo_x(), y=self.search_entry.winfo_y() + self.search_entry.winfo_height() + 5, width=self.search_entry.winfo_width())
+            self.suggestion_box.lift()
+            self.suggestion_box.pack()
+            self.suggestion_box.selection_clear(0, tk.END)
         else:
             self.suggestion_box.pack_forget()
             self.clear_product_details()
@@ -475,8 +548,8 @@ class POSScreen:
         if not self.suggestion_box.curselection():
             return
         index = self.suggestion_box.curselection()[0]
-        search_term = self.search_var.get().strip()
-        drugs = self.db.search_drugs(search_term)
+        # Reuse the results already shown instead of searching again
+        drugs = self.suggestions
         if drugs and index < len(drugs):
             drug = drugs[index]
             self.select_drug(drug)
@@ -531,7 +604,9 @@ class POSScreen:
     
     def generate_receipt_content(self):
         """Generate receipt content"""
+        # Header and footer come from the settings cache, not a query per receipt
         settings = self.db.get_settings()
+        currency = self.db.get_currency()
         
         receipt_lines = []
         receipt_lines.append("=" * 40)
@@ -553,9 +628,9 @@ class POSScreen:
         
         receipt_lines.append("-" * 40)
         total = sum(item['total_price'] for item in self.cart_items)
-        receipt_lines.append(f"TOTAL: {'':>25} GHS {total:>8.2f}")
+        receipt_lines.append(f"TOTAL: {'':>25} {currency} {total:>8.2f}")
         receipt_lines.append("=" * 40)
-        receipt_lines.append(settings.get('receipt_footer', 'Thank you for your purchase!'))
+        receipt_lines.append(self.db.get_receipt_footer())
         receipt_lines.append("=" * 40)
         
         return receipt_lines
@@ -633,6 +708,8 @@ class POSScreen:
             messagebox.showerror("Print Error", f"Error printing receipt: {str(e)}")
 
     def modify_quantity(self):
+        if self.cart_locked():
+            return
         selected_index = self.get_selected_cart_index()
         if selected_index is None:
             messagebox.showwarning("Warning", "Please select an item to modify!")
@@ -733,6 +810,8 @@ class POSScreen:
 
     def add_to_cart(self):
         """Add drug directly to cart with manual quantity entry"""
+        if self.cart_locked():
+            return
         try:
             quantity = int(self.quantity_var.get())
             
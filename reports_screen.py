@@ -7,12 +7,15 @@ import tkinter as tk
 from tkinter import ttk, messagebox
 from datetime import datetime, timedelta
 from tkcalendar import DateEntry
+from db_worker import InlineExecutor
+from utils import format_inventory_alerts
 
 class ReportsScreen:
-    def __init__(self, parent, db, status_callback):
+    def __init__(self, parent, db, status_callback, executor=None):
         self.parent = parent
         self.db = db
         self.status_callback = status_callback
+        self.executor = executor or InlineExecutor()
         
         self.setup_ui()
         self.load_daily_summary()
@@ -231,12 +234,28 @@ class ReportsScreen:
     
     def generate_report_data(self, start_date, end_date):
         """Generate report data for the specified period"""
-        # Get sales data
-        sales = self.db.get_sales_by_date(start_date, end_date)
+        self.status_callback(f"Generating report for {start_date} to {end_date}...")
+        self.executor.submit(self.collect_report_data, start_date, end_date,
+                             callback=self.show_report, key='report')
+    
+    def collect_report_data(self, start_date, end_date):
+        """Run every query the report needs (runs on the database worker)"""
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            # One pre-aggregated row per day from the sales rollup
+            'daily_sales': self.db.get_daily_sales_range(start_date, end_date),
+            'top_drugs': self.db.get_top_drugs(start_date, end_date, limit=10),
+            'alerts': self.collect_inventory_alerts()
+        }
+    
+    def show_report(self, report):
+        """Fill the report widgets from collected data"""
+        daily_sales = report['daily_sales']
         
         # Update summary cards
-        total_amount = sum(sale['total_amount'] for sale in sales)
-        total_transactions = len(sales)
+        total_amount = sum(day['total_amount'] for day in daily_sales)
+        total_transactions = sum(day['total_transactions'] for day in daily_sales)
         average_sale = total_amount / total_transactions if total_transactions > 0 else 0
         
         self.summary_cards['total_sales'].config(text=f"GHS {total_amount:.2f}")
@@ -244,120 +263,63 @@ class ReportsScreen:
         self.summary_cards['average_sale'].config(text=f"GHS {average_sale:.2f}")
         
         # Find best day
-        if sales:
-            daily_sales = {}
-            for sale in sales:
-                sale_date = datetime.strptime(sale['sale_date'], '%Y-%m-%d %H:%M:%S').date()
-                date_str = sale_date.strftime('%Y-%m-%d')
-                if date_str not in daily_sales:
-                    daily_sales[date_str] = 0
-                daily_sales[date_str] += sale['total_amount']
-            
-            best_day = max(daily_sales.items(), key=lambda x: x[1])
-            self.summary_cards['best_day'].config(text=f"{best_day[0]}\nGHS {best_day[1]:.2f}")
+        if daily_sales:
+            best_day = max(daily_sales, key=lambda day: day['total_amount'])
+            self.summary_cards['best_day'].config(text=f"{best_day['day']}\nGHS {best_day['total_amount']:.2f}")
         else:
             self.summary_cards['best_day'].config(text="N/A")
         
         # Update daily sales
-        self.update_daily_sales(sales)
+        self.update_daily_sales(daily_sales)
         
         # Update top selling drugs
-        self.update_top_drugs(sales)
+        self.update_top_drugs(report['top_drugs'])
         
         # Update inventory alerts
-        self.update_inventory_alerts()
+        self.update_inventory_alerts(report['alerts'])
         
-        self.status_callback(f"Generated report for {start_date} to {end_date}")
+        self.status_callback(f"Generated report for {report['start_date']} to {report['end_date']}")
     
-    def update_daily_sales(self, sales):
+    def update_daily_sales(self, daily_sales):
         """Update daily sales treeview"""
         # Clear existing items
         for item in self.daily_tree.get_children():
             self.daily_tree.delete(item)
         
-        if not sales:
-            return
-        
-        # Group sales by date
-        daily_sales = {}
-        for sale in sales:
-            sale_date = datetime.strptime(sale['sale_date'], '%Y-%m-%d %H:%M:%S').date()
-            date_str = sale_date.strftime('%Y-%m-%d')
-            if date_str not in daily_sales:
-                daily_sales[date_str] = {'amount': 0, 'transactions': 0}
-            daily_sales[date_str]['amount'] += sale['total_amount']
-            daily_sales[date_str]['transactions'] += 1
-        
         # Add to treeview
-        for date_str, data in sorted(daily_sales.items()):
-            average = data['amount'] / data['transactions'] if data['transactions'] > 0 else 0
+        for day in daily_sales:
+            average = day['total_amount'] / day['total_transactions'] if day['total_transactions'] > 0 else 0
             self.daily_tree.insert('', 'end', values=(
-                date_str,
-                f"GHS {data['amount']:.2f}",
-                data['transactions'],
+                day['day'],
+                f"GHS {day['total_amount']:.2f}",
+                day['total_transactions'],
                 f"GHS {average:.2f}"
             ))
     
-    def update_top_drugs(self, sales):
+    def update_top_drugs(self, top_drugs):
         """Update top selling drugs treeview"""
         # Clear existing items
         for item in self.drugs_tree.get_children():
             self.drugs_tree.delete(item)
         
-        if not sales:
-            return
-        
-        # Get drug sales data (simplified - in real app you'd query sale_items)
-        # For now, we'll show a placeholder
-        self.drugs_tree.insert('', 'end', values=(
-            "1", "Paracetamol (Panadol)", "45", "GHS 112.50", "15%"
-        ))
-        self.drugs_tree.insert('', 'end', values=(
-            "2", "Amoxicillin (Amoxil)", "32", "GHS 480.00", "12%"
-        ))
-        self.drugs_tree.insert('', 'end', values=(
-            "3", "Ibuprofen (Brufen)", "28", "GHS 84.00", "10%"
-        ))
-        self.drugs_tree.insert('', 'end', values=(
-            "4", "Vitamin C", "25", "GHS 37.50", "8%"
-        ))
-        self.drugs_tree.insert('', 'end', values=(
-            "5", "Cetirizine (Zyrtec)", "22", "GHS 110.00", "7%"
-        ))
+        for drug in top_drugs:
+            name = drug['generic_name'] or f"Drug #{drug['drug_id']}"
+            if drug['brand_name']:
+                name = f"{name} ({drug['brand_name']})"
+            self.drugs_tree.insert('', 'end', values=(
+                drug['rank'],
+                name,
+                drug['units'],
+                f"GHS {drug['revenue']:.2f}",
+                f"{drug['share']:.0%}"
+            ))
     
-    def update_inventory_alerts(self):
+    def collect_inventory_alerts(self):
+        """Build the inventory alert lines (runs on the database worker)"""
+        return format_inventory_alerts(self.db.get_inventory_alerts(30))
+    
+    def update_inventory_alerts(self, alerts):
         """Update inventory alerts"""
-        alerts = []
-        
-        # Low stock alerts
-        low_stock_drugs = self.db.get_low_stock_drugs()
-        if low_stock_drugs:
-            alerts.append("⚠️ LOW STOCK ALERTS:")
-            for drug in low_stock_drugs:
-                alerts.append(f"  • {drug['generic_name']} ({drug['brand_name']}) - {drug['quantity_in_stock']} left")
-            alerts.append("")
-        
-        # Expiring drugs alerts
-        expiring_drugs = self.db.get_expiring_drugs(30)
-        if expiring_drugs:
-            alerts.append("⚠️ EXPIRING SOON ALERTS:")
-            for drug in expiring_drugs:
-                expiry_date = datetime.strptime(drug['expiry_date'], '%Y-%m-%d').date()
-                days_left = (expiry_date - datetime.now().date()).days
-                alerts.append(f"  • {drug['generic_name']} ({drug['brand_name']}) - Expires in {days_left} days")
-            alerts.append("")
-        
-        # Out of stock alerts
-        out_of_stock = [drug for drug in self.db.get_all_drugs() if drug['quantity_in_stock'] <= 0]
-        if out_of_stock:
-            alerts.append("🚫 OUT OF STOCK ALERTS:")
-            for drug in out_of_stock:
-                alerts.append(f"  • {drug['generic_name']} ({drug['brand_name']})")
-            alerts.append("")
-        
-        if not alerts:
-            alerts.append("✅ All inventory items are in good condition!")
-        
         # Update alerts text
         self.alerts_text.delete(1.0, tk.END)
         self.alerts_text.insert(1.0, '\n'.join(alerts))
@@ -4,15 +4,26 @@ View and search past sales transactions
 """
 
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from datetime import datetime, timedelta
 from tkcalendar import DateEntry
+from db_worker import InlineExecutor
+from utils import export_to_csv
 
 class SalesHistoryScreen:
-    def __init__(self, parent, db, status_callback):
+    # Sales fetched per page as the list is scrolled
+    PAGE_SIZE = 100
+    
+    def __init__(self, parent, db, status_callback, executor=None):
         self.parent = parent
         self.db = db
         self.status_callback = status_callback
+        self.executor = executor or InlineExecutor()
+        self.current_range = None
+        # Rows currently shown, keyed by sale id (also the treeview item id)
+        self.loaded_sales = {}
+        self.next_cursor = None
+        self.page_pending = False
         
         self.setup_ui()
         self.load_recent_sales()
@@ -133,21 +144,21 @@ class SalesHistoryScreen:
         sales_frame.pack(fill=tk.BOTH, expand=True)
         
         # Sales treeview
-        columns = ('Receipt #', 'Date', 'Customer', 'Items', 'Total', 'Payment', 'Cashier')
+        columns = ('Receipt #', 'Date', 'Customer', 'Items', 'Units', 'Total', 'Payment', 'Cashier')
         self.sales_tree = ttk.Treeview(sales_frame, columns=columns, show='headings', height=15)
         
         # Configure columns
-        column_widths = [120, 120, 150, 80, 100, 100, 100]
+        column_widths = [120, 120, 150, 60, 60, 100, 100, 100]
         for i, col in enumerate(columns):
             self.sales_tree.heading(col, text=col)
             self.sales_tree.column(col, width=column_widths[i], anchor=tk.CENTER)
         
-        # Scrollbar
-        scrollbar = ttk.Scrollbar(sales_frame, orient=tk.VERTICAL, command=self.sales_tree.yview)
-        self.sales_tree.configure(yscrollcommand=scrollbar.set)
+        # Scrollbar (also fetches the next page when the end comes into view)
+        self.sales_scrollbar = ttk.Scrollbar(sales_frame, orient=tk.VERTICAL, command=self.sales_tree.yview)
+        self.sales_tree.configure(yscrollcommand=self.on_tree_scroll)
         
         self.sales_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=10, pady=10)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=10)
+        self.sales_scrollbar.pack(side=tk.RIGHT, fill=tk.Y, pady=10)
         
         # Bind double-click to view details
         self.sales_tree.bind('<Double-1>', self.view_sale_details)
@@ -194,43 +205,84 @@ class SalesHistoryScreen:
         for item in self.sales_tree.get_children():
             self.sales_tree.delete(item)
         
-        # Get sales from database
-        sales = self.db.get_sales_by_date(start_date, end_date)
+        # Rows are fetched a page at a time; the summary is one aggregate query
+        self.current_range = (start_date, end_date)
+        self.loaded_sales = {}
+        self.next_cursor = None
+        self.page_pending = False
+        self.status_callback(f"Searching sales from {start_date} to {end_date}...")
+        self.executor.submit(self.fetch_first_page, start_date, end_date,
+                             callback=self.show_first_page, key='sales-list')
+    
+    def fetch_first_page(self, start_date, end_date):
+        """Fetch the first page and the summary (runs on the database worker)"""
+        page = self.db.get_sales_page(start_date, end_date, None, self.PAGE_SIZE)
+        summary = self.db.get_sales_summary(start_date, end_date)
+        return page, summary
+    
+    def show_first_page(self, result):
+        """Display the first page of a new search with its summary"""
+        page, summary = result
+        self.show_sales_page(page)
+        self.update_summary(summary)
+        
+        start_date, end_date = self.current_range
+        self.status_callback(f"Found {summary['total_transactions']} sales from {start_date} to {end_date}")
+    
+    def load_more_sales(self):
+        """Append the next page if the current search has more rows"""
+        if self.next_cursor:
+            self.append_sales_page()
+        else:
+            self.page_pending = False
+    
+    def append_sales_page(self):
+        """Fetch the page after next_cursor in the background"""
+        # Shares its key with new searches so a stale page is never appended
+        start_date, end_date = self.current_range
+        self.executor.submit(self.db.get_sales_page, start_date, end_date, self.next_cursor, self.PAGE_SIZE,
+                             callback=self.show_sales_page, key='sales-list')
+    
+    def show_sales_page(self, page):
+        """Add a fetched page to the treeview"""
+        sales, self.next_cursor = page
+        self.page_pending = False
         
         # Add sales to treeview
         for sale in sales:
             # Format date
             sale_date = datetime.strptime(sale['sale_date'], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M')
             
-            # Get item count (simplified - in real app you'd query sale_items)
-            item_count = "N/A"  # TODO: Get actual item count
-            
-            self.sales_tree.insert('', 'end', values=(
+            self.loaded_sales[sale['id']] = sale
+            self.sales_tree.insert('', 'end', iid=str(sale['id']), values=(
                 sale['receipt_number'],
                 sale_date,
                 sale['customer_name'] or "Walk-in Customer",
-                item_count,
+                sale['item_count'],
+                sale['unit_count'],
                 f"GHS {sale['total_amount']:.2f}",
                 sale['payment_method'],
                 sale['cashier_name']
             ))
-        
-        # Update summary
-        self.update_summary(sales)
-        
-        self.status_callback(f"Found {len(sales)} sales from {start_date} to {end_date}")
     
-    def update_summary(self, sales):
+    def on_tree_scroll(self, first, last):
+        """Update the scrollbar and fetch another page near the end of the list"""
+        self.sales_scrollbar.set(first, last)
+        if float(last) >= 0.9 and self.next_cursor and not self.page_pending:
+            self.page_pending = True
+            self.parent.after_idle(self.load_more_sales)
+    
+    def update_summary(self, summary):
         """Update sales summary"""
-        if not sales:
+        total_transactions = summary['total_transactions']
+        if not total_transactions:
             self.summary_labels['total_sales'].config(text="GHS 0.00")
             self.summary_labels['total_transactions'].config(text="0")
             self.summary_labels['average_sale'].config(text="GHS 0.00")
             self.summary_labels['best_selling'].config(text="N/A")
             return
         
-        total_amount = sum(sale['total_amount'] for sale in sales)
-        total_transactions = len(sales)
+        total_amount = summary['total_amount']
         average_sale = total_amount / total_transactions if total_transactions > 0 else 0
         
         self.summary_labels['total_sales'].config(text=f"GHS {total_amount:.2f}")
@@ -276,16 +328,8 @@ class SalesHistoryScreen:
         if not selected:
             return None
         
-        # Get receipt number from selected item
-        receipt_number = self.sales_tree.item(selected[0])['values'][0]
-        
-        # Find sale in database
-        sales = self.db.get_sales_by_date(self.start_date_var.get(), self.end_date_var.get())
-        for sale in sales:
-            if sale['receipt_number'] == receipt_number:
-                return sale
-        
-        return None
+        # Treeview item ids are sale ids
+        return self.loaded_sales.get(int(selected[0]))
     
     def view_selected_sale(self):
         """View details of selected sale"""
@@ -429,7 +473,36 @@ class SalesHistoryScreen:
         self.status_callback(f"Reprinted receipt #{sale['receipt_number']}")
     
     def export_sales(self):
-        """Export sales data"""
-        # TODO: Implement export functionality
-        messagebox.showinfo("Export", "Export functionality will be implemented here.\n\nThis will export sales data to CSV/Excel format.")
-        self.status_callback("Export requested") 
\ No newline at end of file
+        """Export the sales in the searched date range to a CSV file"""
+        if not self.current_range:
+            messagebox.showwarning("Warning", "Please search for the sales to export first!")
+            return
+        
+        start_date, end_date = self.current_range
+        filename = filedialog.asksaveasfilename(
+            title="Export Sales",
+            defaultextension=".csv",
+            initialfile=f"sales_{start_date}_to_{end_date}.csv",
+            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")]
+        )
+        if not filename:
+            return
+        
+        # Sales stream from the database into the file on the worker
+        rows = ((sale['receipt_number'], sale['sale_date'], sale['customer_name'] or "Walk-in Customer",
+                 sale['payment_method'], sale['cashier_name'], f"{sale['total_amount']:.2f}")
+                for sale in self.db.iter_sales_by_date(start_date, end_date))
+        headers = ['Receipt #', 'Date', 'Customer', 'Payment', 'Cashier', 'Total']
+        self.status_callback("Exporting sales...")
+        self.executor.submit(export_to_csv, rows, filename, headers,
+                             callback=lambda exported: self.show_export_result(exported, filename),
+                             cancellable=False)
+    
+    def show_export_result(self, exported, filename):
+        """Report the outcome of a sales export"""
+        if exported:
+            messagebox.showinfo("Export Complete", f"Sales exported to {filename}")
+            self.status_callback("Sales exported")
+        else:
+            messagebox.showerror("Error", "Export failed! No file was written.")
+            self.status_callback("Sales export failed")
\ No newline at end of file
@@ -7,12 +7,15 @@ import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 import os
 from datetime import datetime
+from db_worker import InlineExecutor
 
 class SettingsScreen:
-    def __init__(self, parent, db, status_callback):
+    def __init__(self, parent, db, status_callback, executor=None):
         self.parent = parent
         self.db = db
         self.status_callback = status_callback
+        # Backups run on the executor's worker threads
+        self.executor = executor or InlineExecutor()
         
         self.setup_ui()
         self.load_settings()
@@ -472,9 +475,11 @@ This system is designed to help pharmacy staff manage their operations efficient
             value_widget.pack(side=tk.LEFT)
     
     def load_settings(self):
-        """Load current settings from database"""
-        settings = self.db.get_settings()
-        
+        """Load current settings from database in the background"""
+        self.executor.submit(self.db.get_settings, callback=self.show_settings, key='settings-load')
+    
+    def show_settings(self, settings):
+        """Fill the form with the loaded settings"""
         if settings:
             self.pharmacy_name_var.set(settings.get('pharmacy_name', ''))
             self.pharmacy_address_var.set(settings.get('pharmacy_address', ''))
@@ -499,11 +504,7 @@ This system is designed to help pharmacy staff manage their operations efficient
                 'pharmacy_email': self.pharmacy_email_var.get().strip()
             }
             
-            if self.db.update_settings(settings_data):
-                messagebox.showinfo("Success", "Pharmacy information saved successfully!")
-                self.status_callback("Pharmacy information updated")
-            else:
-                messagebox.showerror("Error", "Failed to save pharmacy information!")
+            self.save_settings(settings_data, "Pharmacy information")
                 
         except Exception as e:
             messagebox.showerror("Error", f"Error saving pharmacy information: {str(e)}")
@@ -516,11 +517,7 @@ This system is designed to help pharmacy staff manage their operations efficient
                 'tax_rate': float(self.tax_rate_var.get())
             }
             
-            if self.db.update_settings(settings_data):
-                messagebox.showinfo("Success", "System settings saved successfully!")
-                self.status_callback("System settings updated")
-            else:
-                messagebox.showerror("Error", "Failed to save system settings!")
+            self.save_settings(settings_data, "System settings")
                 
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid tax rate!")
@@ -536,15 +533,33 @@ This system is designed to help pharmacy staff manage their operations efficient
                 'receipt_footer': footer_text
             }
             
-            if self.db.update_settings(settings_data):
-                messagebox.showinfo("Success", "Receipt settings saved successfully!")
-                self.status_callback("Receipt settings updated")
-            else:
-                messagebox.showerror("Error", "Failed to save receipt settings!")
+            self.save_settings(settings_data, "Receipt settings")
                 
         except Exception as e:
             messagebox.showerror("Error", f"Error saving receipt settings: {str(e)}")
     
+    def save_settings(self, settings_data, section):
+        """Save settings in the background and report the outcome
+        
+        Args:
+            settings_data (dict): Settings to update
+            section (str): Name of the settings being saved, e.g. "System settings"
+        """
+        def on_done(saved):
+            if saved:
+                messagebox.showinfo("Success", f"{section} saved successfully!")
+                self.status_callback(f"{section} updated")
+            else:
+                messagebox.showerror("Error", f"Failed to save {section.lower()}!")
+        
+        def on_error(e):
+            messagebox.showerror("Error", f"Error saving {section.lower()}: {str(e)}")
+        
+        self.status_callback(f"Saving {section.lower()}...")
+        # Finish the save and report it even if the user switches screens meanwhile
+        self.executor.submit(self.db.update_settings, settings_data,
+                             callback=on_done, error_callback=on_error, cancellable=False)
+    
     def preview_receipt(self):
         """Preview receipt format"""
         # TODO: Implement receipt preview
@@ -552,15 +567,28 @@ This system is designed to help pharmacy staff manage their operations efficient
         self.status_callback("Receipt preview requested")
     
     def create_backup(self):
-        """Create a backup of the database"""
-        try:
-            from utils import create_backup
-            backup_path = create_backup()
-            messagebox.showinfo("Backup", f"Backup created successfully!\nLocation: {backup_path}")
-            self.status_callback("Backup created successfully")
-        except Exception as e:
-            messagebox.showerror("Backup Error", f"Failed to create backup: {str(e)}")
-            self.status_callback("Backup failed")
+        """Create a backup of the database in the background"""
+        from utils import create_backup
+        
+        def on_progress(done, total, stage):
+            # Called on the worker thread
+            self.executor.call_soon(self.status_callback, f"Backup: {stage} {done * 100 // max(total, 1)}%...")
+        
+        self.status_callback("Creating backup...")
+        # The backup outlives this screen; its results only use message boxes and the status bar
+        self.executor.submit(create_backup, progress_callback=on_progress,
+                             callback=self.show_backup_result, error_callback=self.show_backup_error,
+                             cancellable=False)
+    
+    def show_backup_result(self, backup_path):
+        """Report a finished backup"""
+        messagebox.showinfo("Backup", f"Backup created successfully!\nLocation: {backup_path}")
+        self.status_callback("Backup created successfully")
+    
+    def show_backup_error(self, e):
+        """Report a failed backup"""
+        messagebox.showerror("Backup Error", f"Failed to create backup: {str(e)}")
+        self.status_callback("Backup failed")
     
     def restore_backup(self):
         """Restore from backup"""
@@ -574,7 +602,8 @@ This system is designed to help pharmacy staff manage their operations efficient
                 if messagebox.askyesno("Confirm Restore", 
                                      "This will replace all current data. Are you sure you want to continue?"):
                     from utils import restore_backup
-                    if restore_backup(file_path):
+                    # Restore through the open database so this session sees the restored data
+                    if restore_backup(file_path, self.db):
                         messagebox.showinfo("Restore", "Backup restored successfully!")
                         self.status_callback("Backup restored successfully")
                     else:
@@ -7,6 +7,7 @@ Verifies all components are working correctly
 import sys
 import os
 import sqlite3
+from contextlib import contextmanager
 from datetime import datetime
 
 def test_imports():
@@ -228,15 +229,1165 @@ def test_sample_data():
         print(f"❌ Sample data test failed: {e}")
         return False
 
+def check(condition, failure):
+    """Fail the running check with an ❌ line unless condition holds
+    
+    Raises AssertionError so pytest reports the failure; main() counts it
+    as a failed test.
+    """
+    if not condition:
+        print(f"❌ {failure}")
+        raise AssertionError(failure)
+
+@contextmanager
+def temp_database(name, initialize=True, **options):
+    """A DatabaseManager on a new database in a temporary directory
+    
+    The manager is closed and the directory, with anything the check wrote
+    next to the database, removed when the block exits.
+    """
+    from database import DatabaseManager
+    import shutil
+    import tempfile
+    
+    temp_dir = tempfile.mkdtemp()
+    db = DatabaseManager(os.path.join(temp_dir, name), **options)
+    try:
+        if initialize:
+            db.initialize_database()
+        yield db
+    finally:
+        db.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+def add_test_drug(db, name, quantity, unit_price=1.0):
+    """Add a drug whose stock sits in an unexpired lot and return its id"""
+    db.add_drug({'generic_name': name, 'brand_name': name, 'dosage': '10mg', 'form': 'Tablet',
+                 'batch_number': f"{name.upper()}-1", 'expiry_date': f"{datetime.now().year + 1}-12-31",
+                 'unit_price': unit_price, 'quantity_in_stock': quantity})
+    with db.reader() as conn:
+        return conn.execute("SELECT id FROM drugs WHERE generic_name = ?", (name,)).fetchone()[0]
+
+def sale_line(drug_id, quantity, unit_price=1.0):
+    """A checkout item for quantity units of a drug"""
+    return {'drug_id': drug_id, 'quantity': quantity, 'unit_price': unit_price,
+            'total_price': round(quantity * unit_price, 2)}
+
+def test_checkout_atomicity():
+    """Check that checkout saves a whole sale or, on any failure, nothing at all"""
+    print("\nChecking checkout atomicity...")
+    
+    with temp_database("checkout_check.db") as db:
+        first = add_test_drug(db, 'Firstline', 20, 2.0)
+        second = add_test_drug(db, 'Secondline', 20, 3.0)
+        
+        def snapshot():
+            with db.reader() as conn:
+                return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                        for table in ('sales', 'sale_items', 'sale_item_lots', 'stock_movements', 'receipt_counters')}
+        
+        sale_data = {'total_amount': 10.0, 'cashier_name': 'Test'}
+        sale_id = db.checkout(sale_data, [sale_line(first, 2, 2.0), sale_line(second, 2, 3.0)])
+        sale = db.get_sale(sale_id) if sale_id else None
+        check(sale and len(sale['items']) == 2 and sale['receipt_number'] == sale_data['receipt_number'],
+              f"Checkout saved {sale}")
+        check((db.get_drug(first)['quantity_in_stock'], db.get_drug(second)['quantity_in_stock']) == (18, 18),
+              "Stock not taken by the sale")
+        print("✅ Sale header, items and stock saved together")
+        
+        # The second line is malformed, so the failure comes after the first line was written
+        before = snapshot()
+        broken = sale_line(second, 1, 3.0)
+        del broken['total_price']
+        result = db.checkout({'total_amount': 5.0, 'cashier_name': 'Test'}, [sale_line(first, 1, 2.0), broken])
+        after = snapshot()
+        stock = db.get_drug(first)['quantity_in_stock']
+        with db.reader() as conn:
+            cached = conn.execute("SELECT quantity_in_stock FROM drugs WHERE id = ?", (first,)).fetchone()[0]
+        db.close()
+        
+        check(result is None, f"Failed checkout returned {result}")
+        check(after == before, f"Failed checkout left rows behind: {before} -> {after}")
+        check(stock == cached == 18, f"Failed checkout changed stock (cache {stock}, database {cached})")
+        print("✅ A checkout failing part way leaves no sale, stock or ledger change")
+    return True
+
+def test_receipt_numbers():
+    """Check that receipt numbers come from the sale transaction without gaps or repeats"""
+    print("\nChecking receipt number allocation...")
+    
+    from database import DatabaseManager
+    import threading
+    
+    with temp_database("receipt_check.db") as db:
+        drug_id = add_test_drug(db, 'Receipted', 500)
+        other = DatabaseManager(db.db_path)
+        
+        preview = db.generate_receipt_number()
+        first = {'total_amount': 1.0, 'cashier_name': 'Test'}
+        db.checkout(first, [sale_line(drug_id, 1)])
+        check(first['receipt_number'] == preview, f"Allocated {first['receipt_number']}, previewed {preview}")
+        
+        # A checkout that rolls back must hand its number to the next sale
+        broken = sale_line(drug_id, 1)
+        del broken['total_price']
+        db.checkout({'total_amount': 1.0, 'cashier_name': 'Test'}, [broken])
+        check(db.generate_receipt_number() == preview[:-4] + "0002", "Rolled back checkout used up a receipt number")
+        print("✅ Numbers are previewed, allocated and released with the sale transaction")
+        
+        # Two terminals with the same prefix selling at once
+        receipts = []
+        def sell(manager):
+            for _ in range(20):
+                sale_data = {'total_amount': 1.0, 'cashier_name': 'Test'}
+                if manager.checkout(sale_data, [sale_line(drug_id, 1)]):
+                    receipts.append(sale_data['receipt_number'])
+        threads = [threading.Thread(target=sell, args=(manager,)) for manager in (db, other)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other.close()
+        db.close()
+        
+        expected = [f"{preview[:-4]}{number:04d}" for number in range(2, 42)]
+        check(sorted(receipts) == expected, f"Concurrent receipts: {sorted(receipts)}")
+        print("✅ Concurrent terminals get consecutive, unique receipt numbers")
+    
+    # Prefixes that extend one another; without counters each terminal
+    # resumes from its own receipts only
+    with temp_database("receipt_prefix_check.db") as db:
+        drug_id = add_test_drug(db, 'Prefixed', 50)
+        today = datetime.now().strftime('%Y%m%d')
+        terminals = {prefix: DatabaseManager(db.db_path, receipt_prefix=prefix)
+                     for prefix in ("T1", "T10", f"T1{today}")}
+        for sales, terminal in enumerate(terminals.values(), 1):
+            for _ in range(sales):
+                terminal.checkout({'total_amount': 1.0, 'cashier_name': 'Test'}, [sale_line(drug_id, 1)])
+        with db.transaction() as cursor:
+            cursor.execute("DELETE FROM receipt_counters")
+        previews = {prefix: terminal.generate_receipt_number() for prefix, terminal in terminals.items()}
+        previews[""] = db.generate_receipt_number()
+        for terminal in terminals.values():
+            terminal.close()
+    
+    check(previews == {"T1": f"T1{today}0002", "T10": f"T10{today}0003",
+                       f"T1{today}": f"T1{today}{today}0004", "": f"{today}0001"},
+          f"Receipt numbers resumed per prefix: {previews}")
+    print("✅ Receipts are counted per prefix when one prefix extends another")
+    return True
+
+def test_keyset_pages():
+    """Check that drug and sale pages walk every row once, including ties on the sort key"""
+    print("\nChecking keyset pagination...")
+    
+    with temp_database("pages_check.db") as db:
+        # Several drugs share a generic name, so pages must break ties on id
+        for index in range(12):
+            add_test_drug(db, f"Paged {index % 3}", 50)
+        expected = [drug['id'] for drug in db.iter_drugs()]
+        
+        seen = []
+        drugs, cursor = db.get_drugs_page(page_size=5)
+        seen.extend(drug['id'] for drug in drugs)
+        # A drug added mid-walk sorts before the cursor and must not shift later pages
+        add_test_drug(db, 'Aardvark Extract', 1)
+        while cursor:
+            drugs, cursor = db.get_drugs_page(cursor, page_size=5)
+            seen.extend(drug['id'] for drug in drugs)
+        check(seen == expected, f"Drug pages returned {len(seen)} ids, expected {len(expected)} in order")
+        print(f"✅ {len(expected)} drugs paged in order with no repeats or gaps")
+        
+        # Sales in the same second tie on sale_date
+        drug_id = add_test_drug(db, 'Soldmany', 100)
+        sale_ids = [db.checkout({'total_amount': 1.0 * quantity, 'cashier_name': 'Test'},
+                                [sale_line(drug_id, quantity)])
+                    for quantity in range(1, 13)]
+        today = datetime.now().strftime('%Y-%m-%d')
+        pages = []
+        cursor = None
+        while True:
+            sales, cursor = db.get_sales_page(today, today, cursor, page_size=5)
+            pages.append(sales)
+            if not cursor:
+                break
+        db.close()
+        
+        paged = [sale['id'] for page in pages for sale in page]
+        counts = {sale['id']: (sale['item_count'], sale['unit_count']) for page in pages for sale in page}
+        check([len(page) for page in pages] == [5, 5, 2] and paged == sorted(sale_ids, reverse=True),
+              f"Sale pages: {[[sale['id'] for sale in page] for page in pages]}")
+        check(all(counts[sale_id] == (1, quantity) for quantity, sale_id in enumerate(sale_ids, 1)),
+              f"Item and unit counts: {counts}")
+        print("✅ Sales paged newest first with their item and unit counts")
+    return True
+
+def test_concurrent_checkout():
+    """Check that two terminals racing for the last units make exactly one sale"""
+    print("\nChecking concurrent checkout of the last units...")
+    
+    from database import DatabaseManager, InsufficientStockError
+    import threading
+    
+    with temp_database("race_check.db") as db:
+        other = DatabaseManager(db.db_path)
+        plenty = add_test_drug(db, 'Plentiful', 100)
+        last = add_test_drug(db, 'Lastunits', 5)
+        
+        # Each terminal's cart takes from a well stocked drug first, then the last units
+        start = threading.Barrier(2)
+        outcomes = []
+        def sell(manager, cashier):
+            start.wait()
+            try:
+                outcomes.append(manager.checkout({'total_amount': 7.0, 'cashier_name': cashier},
+                                                 [sale_line(plenty, 2), sale_line(last, 5)]))
+            except InsufficientStockError as e:
+                outcomes.append(e)
+        threads = [threading.Thread(target=sell, args=(manager, f"Cashier {index}"))
+                   for index, manager in enumerate((db, other), 1)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        other.close()
+        
+        sales = [outcome for outcome in outcomes if isinstance(outcome, int)]
+        refused = [outcome for outcome in outcomes if isinstance(outcome, InsufficientStockError)]
+        check(len(sales) == 1 and len(refused) == 1, f"Checkout outcomes: {outcomes}")
+        check([(s['drug_id'], s['available']) for s in refused[0].shortages] == [(last, 0)],
+              f"Refused sale reported {refused[0].shortages}")
+        print("✅ One checkout succeeded and the other was refused")
+        
+        # Nothing from the refused cart may remain, including its first line
+        with db.reader() as conn:
+            rows = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                    for table in ('sales', 'sale_items', 'sale_item_lots')}
+            moved = conn.execute("SELECT COUNT(*) FROM stock_movements WHERE reason = 'sale'").fetchone()[0]
+            stock = dict(conn.execute("SELECT id, quantity_in_stock FROM drugs WHERE id IN (?, ?)", (plenty, last)))
+            lots = dict(conn.execute("SELECT drug_id, SUM(quantity) FROM stock_lots GROUP BY drug_id"))
+            daily = tuple(conn.execute("SELECT SUM(transactions), SUM(gross_amount) FROM daily_sales_summary").fetchone())
+            units = dict(conn.execute("SELECT drug_id, SUM(units) FROM drug_daily_sales GROUP BY drug_id"))
+        db.close()
+        
+        check(rows == {'sales': 1, 'sale_items': 2, 'sale_item_lots': 2} and moved == 2,
+              f"Rows left after the race: {rows}, {moved} sale movements")
+        check(stock == {plenty: 98, last: 0} and lots[plenty] == 98 and lots[last] == 0,
+              f"Stock after the race: {stock}, lots {lots}")
+        check(daily == (1, 7.0) and units == {plenty: 2, last: 5}, f"Rollups after the race: {daily}, {units}")
+        print("✅ Refused checkout rolled back every line, lot and rollup row")
+    return True
+
+def test_sales_rollups():
+    """Check that the trigger-maintained daily rollup always matches the raw sales"""
+    print("\nChecking daily sales rollup...")
+    
+    from datetime import timedelta
+    
+    with temp_database("rollup_check.db") as db:
+        drug_id = add_test_drug(db, 'Rolledup', 100, 2.5)
+        for quantity, method in ((1, 'Cash'), (2, 'Cash'), (3, 'Cash'), (1, 'Mobile Money'), (4, 'Mobile Money')):
+            db.checkout({'total_amount': 2.5 * quantity, 'payment_method': method, 'cashier_name': 'Test'},
+                        [sale_line(drug_id, quantity, 2.5)])
+        today = datetime.now().strftime('%Y-%m-%d')
+        days = db.get_daily_sales_range(today, today)
+        check(len(days) == 1 and days[0]['total_transactions'] == 5 and days[0]['total_amount'] == 27.5
+              and days[0]['payment_methods'] == {'Cash': {'transactions': 3, 'amount': 15.0},
+                                                 'Mobile Money': {'transactions': 2, 'amount': 12.5}},
+              f"Rollup for today: {days}")
+        print("✅ Checkouts are rolled up by day and payment method")
+        
+        # A corrected sale moves from its old bucket to its new one
+        yesterday = (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%d')
+        with db.transaction() as cursor:
+            cursor.execute('''
+                UPDATE sales SET payment_method = 'Card', sale_date = ?, total_amount = 3.0
+                WHERE id = (SELECT MIN(id) FROM sales)
+            ''', (f"{yesterday} 18:00:00",))
+        
+        def rollup_rows():
+            with db.reader() as conn:
+                return conn.execute("SELECT * FROM daily_sales_summary ORDER BY day, payment_method").fetchall()
+        with db.reader() as conn:
+            raw = conn.execute('''
+                SELECT substr(sale_date, 1, 10), payment_method, COUNT(*), SUM(total_amount)
+                FROM sales GROUP BY 1, 2 ORDER BY 1, 2
+            ''').fetchall()
+        maintained = rollup_rows()
+        db.rebuild_sales_rollups()
+        rebuilt = rollup_rows()
+        summary = db.get_sales_summary(yesterday, today)
+        db.close()
+        
+        live = [tuple(row) for row in maintained if row['transactions']]
+        check(live == [tuple(row) for row in raw] and live == [tuple(row) for row in rebuilt],
+              f"Rollup {live} disagrees with sales {[tuple(row) for row in raw]}")
+        check(summary == {'total_transactions': 5, 'total_amount': 28.0}, f"Summary after correction: {summary}")
+        print("✅ Corrected sales move buckets and the rollup matches a full rebuild")
+    return True
+
+def test_top_drugs():
+    """Check that top drugs are ranked by units with ties sharing a rank"""
+    print("\nChecking top drugs ranking...")
+    
+    with temp_database("top_drugs_check.db") as db:
+        pricey = add_test_drug(db, 'Pricey', 50, 4.0)
+        cheap = add_test_drug(db, 'Cheap', 50, 1.0)
+        slow = add_test_drug(db, 'Slowseller', 50, 10.0)
+        for cart in ([sale_line(pricey, 6, 4.0), sale_line(cheap, 4, 1.0)],
+                     [sale_line(pricey, 4, 4.0), sale_line(cheap, 6, 1.0), sale_line(slow, 2, 10.0)]):
+            db.checkout({'total_amount': sum(item['total_price'] for item in cart), 'cashier_name': 'Test'}, cart)
+        today = datetime.now().strftime('%Y-%m-%d')
+        top = db.get_top_drugs(today, today)
+        first_two = db.get_top_drugs(today, today, limit=2)
+        db.close()
+        
+        # Pricey and Cheap tie on 10 units (revenue breaks the display order), Slowseller ranks third
+        ranking = [(row['rank'], row['drug_id'], row['units'], row['revenue']) for row in top]
+        check(ranking == [(1, pricey, 10, 40.0), (1, cheap, 10, 10.0), (3, slow, 2, 20.0)], f"Ranking: {ranking}")
+        check(abs(sum(row['share'] for row in top) - 1.0) < 1e-9 and abs(top[0]['share'] - 0.571428) < 1e-6,
+              f"Revenue shares: {[row['share'] for row in top]}")
+        check([row['drug_id'] for row in first_two] == [pricey, cheap] and top[0]['generic_name'] == 'Pricey',
+              f"Limited ranking: {first_two}")
+        print("✅ Ties share a rank, shares add up and the limit applies")
+    return True
+
+def test_drug_import():
+    """Check that a CSV import inserts new drugs, updates existing ones and keeps stock consistent"""
+    print("\nChecking bulk drug import...")
+    
+    from utils import read_drug_csv
+    
+    with temp_database("import_check.db") as db:
+        drug_count = len(db.get_all_drugs())
+        csv_path = os.path.join(os.path.dirname(db.db_path), "drugs.csv")
+        with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file:
+            csv_file.write("generic_name,brand_name,dosage,form,batch_number,expiry_date,unit_price,quantity_in_stock\n"
+                           "Importol,Importex,5mg,Tablet,IMP-1,2030-01-31,1.20,10\n"
+                           "Paracetamol,Panadol,500mg,Tablet,BATCH001,2030-06-30,3.00,40\n"
+                           "Badrow,Badrow,1mg,Tablet,BAD-1,2030-01-31,1.00,-5\n"
+                           "Importol,Importex,5mg,Tablet,IMP-1,2030-01-31,1.25,12\n")
+        
+        errors = []
+        result = db.import_drugs(read_drug_csv(csv_path, errors), batch_size=2)
+        check(result and (result['staged'], result['inserted'], result['updated']) == (3, 1, 1),
+              f"Import result: {result}")
+        check([line for line, _ in errors] == [4], f"Rejected rows: {errors}")
+        
+        drugs = {drug['generic_name']: drug for drug in db.get_all_drugs()}
+        imported, updated = drugs.get('Importol'), drugs['Paracetamol']
+        check(len(drugs) == drug_count + 1 and imported and imported['quantity_in_stock'] == 12
+              and imported['unit_price'] == 1.25, f"Imported drug: {imported}")
+        check((updated['quantity_in_stock'], updated['unit_price'], updated['expiry_date']) == (40, 3.0, '2030-06-30'),
+              f"Updated drug: {updated}")
+        check([drug['id'] for drug in db.search_drugs("Importol")] == [imported['id']], "Imported drug not searchable")
+        print("✅ New rows inserted, existing rows updated, the later duplicate wins")
+        
+        # Importing the same file again changes nothing
+        again = db.import_drugs(read_drug_csv(csv_path), batch_size=2)
+        with db.reader() as conn:
+            mismatched = conn.execute('''
+                SELECT COUNT(*) FROM drugs d
+                WHERE quantity_in_stock != (SELECT COALESCE(SUM(quantity_change), 0) FROM stock_movements
+                                            WHERE drug_id = d.id)
+                   OR quantity_in_stock != (SELECT COALESCE(SUM(quantity), 0) FROM stock_lots
+                                            WHERE drug_id = d.id)
+            ''').fetchone()[0]
+            movements = conn.execute("SELECT COUNT(*) FROM stock_movements WHERE reason = 'import'").fetchone()[0]
+        db.close()
+        
+        check(again and (again['inserted'], again['updated']) == (0, 2) and movements == 2,
+              f"Re-import: {again}, {movements} import movements")
+        check(not mismatched, f"{mismatched} drugs disagree with their ledger or lots")
+        print("✅ Re-import is idempotent and stock, ledger and lots agree")
+    return True
+
+def test_drug_search():
+    """Check that search matches word prefixes, ranks names first and follows drug edits"""
+    print("\nChecking drug search...")
+    
+    with temp_database("search_check.db") as db:
+        def add(name, dosage, form):
+            db.add_drug({'generic_name': name, 'brand_name': name, 'dosage': dosage, 'form': form,
+                         'batch_number': 'S1', 'expiry_date': f"{datetime.now().year + 1}-12-31",
+                         'unit_price': 1.0, 'quantity_in_stock': 5})
+            return db.search_drugs(f"{name} {dosage}", limit=1)[0]['id']
+        
+        def names(term, limit=50):
+            return [(drug['generic_name'], drug['dosage']) for drug in db.search_drugs(term, limit)]
+        
+        add('Amoxicillin', '500mg', 'Capsule')
+        relief = add('Tablet Relief', '5ml', 'Syrup')
+        for index in range(60):
+            add(f"Bulkpack {index:02d}", '1mg', 'Sachet')
+        
+        check(names("parac") == [('Paracetamol', '500mg')], f"Prefix search: {names('parac')}")
+        check(sorted(names("amox")) == [('Amoxicillin', '250mg'), ('Amoxicillin', '500mg')]
+              and names("amox 250") == [('Amoxicillin', '250mg')], f"Multi-word search: {names('amox 250')}")
+        print("✅ Words match as prefixes and every word must match")
+        
+        tablets = db.search_drugs("tablet")
+        check(tablets[0]['id'] == relief and len(tablets) > 1 and all(
+              drug['form'] == 'Tablet' for drug in tablets[1:]), f"Ranking for 'tablet': {names('tablet')}")
+        check(len(names("bulkpack")) == 50 and len(names("bulkpack", None)) == 60
+              and len(names("bulkpack", 5)) == 5, "limit not applied")
+        print("✅ Name matches rank above dosage and form matches; limit=None returns every match")
+        
+        fts = {term: sorted(names(term, None)) for term in ("amox 250", "parac", "tablet relief", "capsule 500")}
+        db.fts_enabled = False
+        like = {term: sorted(names(term, None)) for term in fts}
+        db.fts_enabled = True
+        check(like == fts and fts["capsule 500"] == [('Amoxicillin', '500mg')],
+              f"LIKE fallback found {like}, FTS {fts}")
+        print("✅ The LIKE fallback matches every word across the same columns")
+        
+        drug = db.get_drug(relief)
+        db.update_drug(relief, dict(drug, generic_name='Zincovit', brand_name='Zincovit'))
+        renamed = (names("zincovit"), [drug['id'] for drug in db.search_drugs("relief")])
+        with db.transaction() as cursor:
+            cursor.execute("DELETE FROM drugs WHERE id = ?", (relief,))
+        deleted = names("zincovit")
+    
+    check(renamed == ([('Zincovit', '5ml')], []) and deleted == [],
+          f"Search after rename {renamed}, after delete {deleted}")
+    print("✅ The search index follows updates and deletes")
+    return True
+
+def test_inventory_alerts():
+    """Check the alert categories, per-lot expiry rows and when the alert cache is refreshed"""
+    print("\nChecking inventory alerts...")
+    
+    from database import DatabaseManager
+    from datetime import timedelta
+    from utils import inventory_statuses
+    
+    with temp_database("alerts_check.db") as db:
+        other = DatabaseManager(db.db_path)
+        low = add_test_drug(db, 'Lowstock', 5)
+        out = add_test_drug(db, 'Outstock', 0)
+        dated = add_test_drug(db, 'Dated', 50)
+        for batch, days in (('SOON', 10), ('LATER', 20)):
+            db.receive_stock(dated, batch, (datetime.now() + timedelta(days=days)).strftime('%Y-%m-%d'), 5)
+        ours = {low, out, dated}
+        
+        def alerts():
+            found = db.get_inventory_alerts(30)
+            return ([row['id'] for row in found['low_stock'] if row['id'] in ours],
+                    [row['id'] for row in found['out_of_stock'] if row['id'] in ours],
+                    [(row['id'], row['batch_number'], row['lot_quantity'], row['days_left'])
+                     for row in found['expiring'] if row['id'] in ours],
+                    {drug_id: status for drug_id, status in inventory_statuses(found).items() if drug_id in ours})
+        
+        first = alerts()
+        check(first[:3] == ([low], [out], [(dated, 'SOON', 5, 10), (dated, 'LATER', 5, 20)]),
+              f"Alerts: {first[:3]}")
+        check(first[3] == {low: "LOW STOCK", out: "OUT OF STOCK", dated: "EXPIRING SOON"},
+              f"Statuses: {first[3]}")
+        print("✅ Low stock excludes out of stock and each expiring lot is listed with its days left")
+        
+        misses = db.get_cache_stats()['alerts_misses']
+        cached = alerts()
+        db.update_stock(low, 10)
+        own_write = alerts()
+        other.update_stock(out, 3)
+        other_write = alerts()
+        other.close()
+        stats = db.get_cache_stats()
+    
+    check(cached == first and stats['alerts_misses'] == misses + 2,
+          f"Alert cache: {stats['alerts_misses'] - misses} misses for one repeat and two writes")
+    check(own_write[:2] == ([], [out]) and other_write[:2] == ([out], []),
+          f"After writes: {own_write[:2]} then {other_write[:2]}")
+    print("✅ Alerts cached until stock changes here or on another connection")
+    return True
+
+def test_stock_ledger():
+    """Check that every stock change is in the ledger and get_stock_at replays it"""
+    print("\nChecking stock ledger...")
+    
+    with temp_database("ledger_check.db") as db:
+        
+        def backdate(table, column, timestamp):
+            # Stamp the newest row of table as if it had been written at timestamp
+            with db.transaction() as cursor:
+                cursor.execute(f"UPDATE {table} SET {column} = ? WHERE id = (SELECT MAX(id) FROM {table})",
+                               (timestamp,))
+        
+        drug_id = add_test_drug(db, 'Ledgered', 20)
+        backdate('stock_movements', 'created_at', '2025-01-01 09:00:00')
+        db.take_stock_snapshot(force=True)
+        with db.transaction() as cursor:
+            cursor.execute("UPDATE stock_snapshots SET taken_at = '2025-01-02 00:00:00' WHERE drug_id = ?", (drug_id,))
+        sale_id = db.checkout({'total_amount': 5.0, 'cashier_name': 'Test'}, [sale_line(drug_id, 5)])
+        backdate('stock_movements', 'created_at', '2025-01-03 10:00:00')
+        db.receive_stock(drug_id, 'LEDGER-2', f"{datetime.now().year + 2}-01-31", 10)
+        backdate('stock_movements', 'created_at', '2025-01-05 10:00:00')
+        db.update_stock(drug_id, -2, 'write_off')
+        backdate('stock_movements', 'created_at', '2025-01-06 10:00:00')
+        
+        with db.reader() as conn:
+            ledger = [tuple(row) for row in conn.execute('''
+                SELECT reason, quantity_change, reference_id FROM stock_movements WHERE drug_id = ? ORDER BY id
+            ''', (drug_id,))]
+            sale_item_id = conn.execute("SELECT id FROM sale_items WHERE sale_id = ?", (sale_id,)).fetchone()[0]
+        expected = [('receipt', 20, None), ('sale', -5, sale_item_id), ('receipt', 10, None), ('write_off', -2, None)]
+        check(ledger == expected, f"Ledger: {ledger}")
+        print("✅ Receipts, sales and write-offs recorded with their references")
+        
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        levels = {at: db.get_stock_at(at, drug_id).get(drug_id)
+                  for at in ('2025-01-01', '2025-01-02', '2025-01-04', '2025-01-05 12:00:00', now)}
+        current = db.get_drug(drug_id)['quantity_in_stock']
+        db.close()
+        
+        check(list(levels.values()) == [0, 20, 15, 25, 23] and current == 23,
+              f"Stock replayed from the ledger: {levels}, current {current}")
+        print("✅ get_stock_at replays the ledger before and after a snapshot")
+    return True
+
+def test_sales_archive():
+    """Check that archived sales stay readable, late sales follow them and backups carry the archives"""
+    print("\nChecking sales archives...")
+    
+    import utils
+    import zipfile
+    
+    with temp_database("archive_check.db") as db:
+        drug_id = add_test_drug(db, 'Archived', 100)
+        last_year = datetime.now().year - 1
+        today = datetime.now().strftime('%Y-%m-%d')
+        
+        def sell(quantity, sale_date=None):
+            sale_id = db.checkout({'total_amount': float(quantity), 'cashier_name': 'Test'},
+                                  [sale_line(drug_id, quantity)])
+            if sale_date:
+                with db.transaction() as cursor:
+                    cursor.execute("UPDATE sales SET sale_date = ? WHERE id = ?", (sale_date, sale_id))
+            return sale_id
+        
+        def sale_ids(start_date):
+            return [sale['id'] for sale in db.iter_sales_by_date(start_date, today)]
+        
+        old = [sell(day, f"{last_year}-03-0{day} 10:00:00") for day in (1, 2, 3)]
+        new = [sell(4), sell(5)]
+        summary = db.get_sales_summary(f"{last_year}-01-01", today)
+        march = db.get_daily_sales_range(f"{last_year}-03-01", f"{last_year}-03-31")
+        
+        result = db.archive_sales(last_year)
+        with db.reader() as conn:
+            live = [row[0] for row in conn.execute("SELECT id FROM sales ORDER BY id")]
+        archived = db.get_sale(old[0])
+        check(result and (result['sales'], result['items']) == (3, 3) and live == new,
+              f"Archive moved {result}, live sales left {live}")
+        check(archived and archived['total_amount'] == 1.0 and len(archived['items']) == 1,
+              f"Archived sale read back as {archived}")
+        print("✅ Closed year moved to its archive and its sales still found by id")
+        
+        pages = []
+        cursor = None
+        while True:
+            sales, cursor = db.get_sales_page(f"{last_year}-01-01", today, cursor, page_size=2)
+            pages.append([sale['id'] for sale in sales])
+            if not cursor:
+                break
+        check(pages == [new[::-1], [old[2], old[1]], [old[0]]], f"Pages across the archive: {pages}")
+        check(sale_ids(f"{last_year}-01-01") == new[::-1] + old[::-1], "Iterating across the archive lost sales")
+        check(db.get_sales_summary(f"{last_year}-01-01", today) == summary
+              and db.get_daily_sales_range(f"{last_year}-03-01", f"{last_year}-03-31") == march,
+              "Rollup totals changed by archiving")
+        print("✅ Pages, iterators and rollup totals span live and archived sales")
+        
+        backup_path = utils.create_backup(db.db_path, os.path.join(os.path.dirname(db.db_path), "backups"))
+        
+        # A sale entered late for the archived year follows the others on a re-run
+        late = sell(6, f"{last_year}-12-31 23:00:00")
+        again = db.archive_sales(last_year)
+        registry = db.get_sales_archives()
+        check(again and again['sales'] == 1 and [row['sales'] for row in registry] == [4]
+              and db.get_sale(late) and sale_ids(f"{last_year}-01-01") == new[::-1] + [late] + old[::-1],
+              f"Re-run moved {again}, registry {registry}")
+        print("✅ Re-running the archive moves late sales for the year")
+        
+        with zipfile.ZipFile(backup_path) as backup_zip:
+            names = sorted(backup_zip.namelist())
+        utils.restore_backup(backup_path, db)
+        archive_path = os.path.join(os.path.dirname(db.db_path), registry[0]['path'])
+        conn = sqlite3.connect(archive_path)
+        restored = [row[0] for row in conn.execute("SELECT id FROM sales ORDER BY id")]
+        conn.close()
+        safety_copies = [name for name in os.listdir(os.path.dirname(db.db_path))
+                         if name.startswith(registry[0]['path'] + ".before_restore_")]
+        check(f"archives/{registry[0]['path']}" in names, f"Backup entries: {names}")
+        check(restored == old and db.get_sale(late) is None and db.get_sale(old[1])
+              and sale_ids(f"{last_year}-01-01") == new[::-1] + old[::-1],
+              f"Archive after restore holds {restored}")
+        check(len(safety_copies) == 1, f"Archive safety copies: {safety_copies}")
+        print("✅ Backups include the archives and a restore puts them back")
+    return True
+
+def test_query_plans():
+    """Check that hot queries are served by indexes rather than table scans"""
+    print("\nChecking query plans...")
+    
+    import re
+    
+    with temp_database("plan_check.db") as db:
+        
+        # Load the catalog cache first; that one-off load reads the whole table
+        db.get_all_drugs()
+        # The sample lots may have expired; give the drug sold below a current one
+        db.receive_stock(1, "PLAN-CHECK", f"{datetime.now().year + 1}-12-31", 10)
+        
+        # Record the statements issued by the hot paths
+        statements = []
+        db.set_trace_callback(statements.append)
+        today = datetime.now().strftime('%Y-%m-%d')
+        db.search_drugs("para")
+        db.get_sales_by_date(today, today)
+        db.get_daily_sales(today)
+        db.get_daily_sales_range(today, today)
+        db.get_top_drugs(today, today)
+        db.get_stock_at(today, 1)
+        db.take_stock_snapshot(force=True)
+        db.get_expiring_drugs(30)
+        db.get_low_stock_drugs()
+        db.get_inventory_alerts(30)
+        db.generate_receipt_number()
+        sale_id = db.checkout({'total_amount': 2.50, 'cashier_name': 'Plan Check'},
+                              [{'drug_id': 1, 'quantity': 1, 'unit_price': 2.50, 'total_price': 2.50}])
+        db.get_sale(sale_id)
+        list(db.iter_sale_items(today, today))
+        db.set_trace_callback(None)
+        
+        with db.reader() as conn:
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        
+        full_scans = []
+        for sql in statements:
+            words = sql.split()
+            keyword = words[0].upper() if words else ''
+            # INSERT ... SELECT reads through a query; plain INSERT ... VALUES has no plan
+            if not (keyword in ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+                    or keyword in ('INSERT', 'REPLACE') and re.search(r'\bSELECT\b', sql, re.IGNORECASE)):
+                continue
+            # Plans name a table by its alias; scans of CTEs and subqueries are not table scans
+            aliases = {}
+            references = re.findall(r'\b(?:FROM|JOIN)\s+(?:\w+\.)?(\w+)(?:\s+(?:AS\s+)?(\w+))?',
+                                    sql, re.IGNORECASE)
+            for name, alias in references:
+                aliases[alias or name] = name
+            for detail in db.explain_query_plan(sql):
+                # "SCAN <table>" (older SQLite: "SCAN TABLE <table> [AS <alias>]")
+                # without an index is a full table scan
+                scan = re.match(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$', detail)
+                if scan and aliases.get(scan.group(1), scan.group(1)) in tables:
+                    full_scans.append(f"{detail}: {' '.join(sql.split())[:80]}")
+        
+        db.close()
+        
+        for scan in full_scans:
+            print(f"❌ {scan}")
+        check(not full_scans, f"{len(full_scans)} hot-path statements scan a whole table")
+        print(f"✅ {len(statements)} hot-path statements use indexes")
+    return True
+
+def test_expired_lots():
+    """Check that checkout dispenses lots first-expiry-first-out and never sells expired ones"""
+    print("\nChecking stock lot dispensing...")
+    
+    from database import InsufficientStockError
+    
+    with temp_database("lots_check.db") as db:
+        year = datetime.now().year
+        db.add_drug({'generic_name': 'Lot Check', 'brand_name': 'Lotcheck', 'dosage': '10mg', 'form': 'Tablet',
+                     'batch_number': 'OLD', 'expiry_date': f"{year - 1}-01-31", 'unit_price': 1.0,
+                     'quantity_in_stock': 5})
+        drug_id = db.search_drugs("Lot Check")[0]['id']
+        db.receive_stock(drug_id, 'LATER', f"{year + 2}-06-30", 10)
+        db.receive_stock(drug_id, 'SOONER', f"{year + 1}-06-30", 4)
+        
+        sale_id = db.checkout({'total_amount': 6.0, 'cashier_name': 'Test'},
+                              [{'drug_id': drug_id, 'quantity': 6, 'unit_price': 1.0, 'total_price': 6.0}])
+        lots = {lot['batch_number']: lot['quantity'] for lot in db.get_stock_lots(drug_id)}
+        check(sale_id and lots == {'OLD': 5, 'SOONER': 0, 'LATER': 8}, f"Lots after selling 6: {lots}")
+        print("✅ Sale drawn from the earliest unexpired lots, expired lot untouched")
+        
+        try:
+            db.checkout({'total_amount': 10.0, 'cashier_name': 'Test'},
+                        [{'drug_id': drug_id, 'quantity': 10, 'unit_price': 1.0, 'total_price': 10.0}])
+            shortage = None
+        except InsufficientStockError as e:
+            shortage = e.shortages[0]
+        stock = db.get_drug(drug_id)['quantity_in_stock']
+        db.close()
+        
+        check(shortage and shortage['available'] == 8 and shortage['expired'] == 5,
+              f"Selling into expired stock reported {shortage}")
+        check(stock == 13, f"Stock changed by a refused sale: {stock}")
+        print("✅ Expired units are not sellable and are reported in the shortage")
+    return True
+
+def test_migrations():
+    """Check that migrations bring a database to the latest version and are then skipped"""
+    print("\nChecking schema migrations...")
+    
+    from database import DatabaseManager
+    
+    latest = DatabaseManager.MIGRATIONS[-1][0]
+    with temp_database("migration_check.db", initialize=False) as db:
+        steps = []
+        db.initialize_database(progress_callback=lambda step, total, description: steps.append(step))
+        version = db.get_schema_version()
+        db.close()
+        
+        check(version == latest and sorted(set(steps)) == list(range(1, latest + 1)),
+              f"Fresh database at version {version}, steps reported: {sorted(set(steps))}")
+        print(f"✅ Fresh database migrated to version {version}")
+        
+        # A current database should only have its version read
+        statements = []
+        warm = DatabaseManager(db.db_path)
+        warm.set_trace_callback(statements.append)
+        warm.initialize_database(progress_callback=lambda step, total, description: steps.append(step))
+        warm.close()
+        
+        # Ignore connection setup pragmas and SQLite's "--" traces of nested statements
+        queries = [sql for sql in statements if not sql.lstrip().startswith(('PRAGMA', '--'))]
+        check(len(queries) == 1, f"Warm start ran {len(queries)} queries")
+        print("✅ Warm start reads only the schema version")
+    return True
+
+def test_settings_cache():
+    """Check that settings are cached and that changes from another connection are picked up"""
+    print("\nChecking settings cache...")
+    
+    from database import DatabaseManager
+    
+    with temp_database("settings_check.db") as db:
+        other = DatabaseManager(db.db_path)
+        
+        db.get_settings()
+        statements = []
+        db.set_trace_callback(statements.append)
+        db.get_currency()
+        db.get_receipt_footer()
+        db.set_trace_callback(None)
+        check(all(sql.lstrip().startswith(('PRAGMA', '--')) for sql in statements),
+              "Cached settings still queried the settings table")
+        print("✅ Repeated settings reads served from the cache")
+        
+        settings = other.get_settings()
+        settings['currency'] = 'USD'
+        other.update_settings(settings)
+        currency = db.get_currency()
+        other.close()
+        db.close()
+        
+        check(currency == 'USD', f"Change from another connection not seen (currency {currency})")
+        print("✅ Settings saved by another connection picked up")
+    return True
+
+def test_catalog_cache():
+    """Check that the drug catalog patches in changes from another connection without reloading"""
+    print("\nChecking drug catalog cache...")
+    
+    from database import DatabaseManager
+    import threading
+    
+    with temp_database("catalog_check.db") as db:
+        other = DatabaseManager(db.db_path)
+        
+        drugs = db.get_all_drugs()
+        stock = db.get_drug(1)['quantity_in_stock']
+        other.update_stock(1, -3)
+        drug = dict(other.get_drug(2), generic_name='Zinc Sulfate')
+        other.update_drug(2, drug)
+        
+        refreshed = db.get_drug(1)['quantity_in_stock']
+        names = [drug['generic_name'] for drug in db.get_all_drugs()]
+        stats = db.get_cache_stats()
+        check(refreshed == stock - 3 and names[-1] == 'Zinc Sulfate' and len(names) == len(drugs),
+              f"Changes from another connection not seen (stock {refreshed}, last drug {names[-1]})")
+        check(stats['catalog_reloads'] == 1 and stats['catalog_refreshes'] == 1,
+              f"Catalog reloaded {stats['catalog_reloads']} times, patched {stats['catalog_refreshes']} times")
+        print("✅ Drugs changed by another connection patched in without a reload")
+        
+        # Our own writes move the catalog past their log entries, so with a
+        # small refresh limit the other terminal's sale is still patched in
+        fresh = add_test_drug(db, 'Ownwrite', 10)
+        db.CATALOG_REFRESH_LIMIT = 3
+        for drug in drugs[:5]:
+            db.update_stock(drug['id'], 1)
+        with db.reader() as conn:
+            logged = conn.execute("SELECT COUNT(*) FROM drug_changes").fetchone()[0]
+        other.checkout({'total_amount': 2.0, 'cashier_name': 'Test'}, [sale_line(fresh, 2)])
+        with db.reader() as conn:
+            checkout_logged = conn.execute("SELECT COUNT(*) FROM drug_changes").fetchone()[0] - logged
+        sold = db.get_drug(fresh)['quantity_in_stock']
+        stats = db.get_cache_stats()
+        check(sold == 8 and stats['catalog_reloads'] == 1 and stats['catalog_refreshes'] == 2,
+              f"After own writes: stock {sold}, {stats['catalog_reloads']} reloads, "
+              f"{stats['catalog_refreshes']} refreshes")
+        check(checkout_logged == 0, "Checkout wrote to the drug change log")
+        print("✅ Own writes are not read back and checkouts reach the catalog through the stock ledger")
+        
+        # Reads racing an invalidation must still see the whole catalog
+        racing = threading.Event()
+        racing.set()
+        def invalidate():
+            while racing.is_set():
+                db._invalidate_catalog()
+        invalidator = threading.Thread(target=invalidate)
+        invalidator.start()
+        try:
+            sizes = {len(db.get_all_drugs()) for _ in range(200)}
+        finally:
+            racing.clear()
+            invalidator.join()
+            other.close()
+            db.close()
+        
+        check(sizes == {len(drugs) + 1}, f"Catalog reads during invalidation returned sizes {sorted(sizes)}")
+        print("✅ Catalog reads are consistent while the cache is invalidated")
+    return True
+
+def test_row_iterators():
+    """Check that streaming reads raise on failure instead of stopping short"""
+    print("\nChecking streaming row iterators...")
+    
+    with temp_database("iterator_check.db") as db:
+        
+        # abs() of the smallest integer overflows, failing the query on its sixth row
+        rows = []
+        try:
+            for row in db._iter_rows('''
+                SELECT id, CASE WHEN id > 5 THEN abs(-9223372036854775807 - 1) END AS overflow
+                FROM drugs ORDER BY id
+            ''', (), 1):
+                rows.append(row)
+            failure = None
+        except sqlite3.Error as e:
+            failure = e
+        check(failure is not None and 0 < len(rows) < 5, f"Failed query yielded {len(rows)} rows without raising")
+        print("✅ Errors part way through a query reach the caller")
+        
+        def failing_after(count):
+            def iterate(start_date, end_date):
+                for sale_id in range(count):
+                    yield {'id': sale_id}
+                raise sqlite3.OperationalError("disk I/O error")
+            return iterate
+        
+        db.iter_sales_by_date = failing_after(0)
+        empty = db.get_sales_by_date('2025-01-01', '2025-01-31')
+        db.iter_sales_by_date = failing_after(3)
+        partial = db.get_sales_by_date('2025-01-01', '2025-01-31')
+        
+        check(empty == [], f"Query failing outright returned {empty}")
+        check(partial == [], f"Query failing part way returned {partial}")
+        print("✅ get_sales_by_date returns [] rather than a partial list")
+        
+        from utils import export_to_csv
+        export_path = os.path.join(os.path.dirname(db.db_path), "sales.csv")
+        rows = ([sale['id']] for sale in failing_after(3)('2025-01-01', '2025-01-31'))
+        failed_export = export_to_csv(rows, export_path, ['ID'])
+        check(not failed_export, "Export of a failing query reported success")
+        check(not os.path.exists(export_path) and not os.path.exists(export_path + ".partial"),
+              "Export of a failing query left a truncated file behind")
+        
+        rows = ([sale_id] for sale_id in range(3))
+        exported = export_to_csv(rows, export_path, ['ID'])
+        with open(export_path, encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        check(exported and lines == ['ID', '0', '1', '2'], f"Export wrote {lines}")
+        print("✅ CSV exports stream rows and write nothing when the read fails")
+    return True
+
+def test_db_executor():
+    """Check that screen changes spare app-level requests and failing callbacks do not stop polling"""
+    print("\nChecking background database executor...")
+    
+    from db_worker import DatabaseExecutor
+    import time
+    
+    class ManualRoot:
+        """Stands in for Tk: after() callbacks run when pump() is called"""
+        def __init__(self):
+            self.scheduled = []
+        def after(self, delay, func):
+            self.scheduled.append(func)
+        def pump(self, seconds=2.0):
+            deadline = time.time() + seconds
+            while self.scheduled and time.time() < deadline:
+                time.sleep(0.01)
+                func = self.scheduled.pop(0)
+                func()
+    
+    root = ManualRoot()
+    executor = DatabaseExecutor(root, workers=1)
+    delivered = []
+    executor.submit(time.sleep, 0.1, callback=lambda result: delivered.append('screen'), key='search')
+    executor.submit(lambda: 'backup', callback=delivered.append, cancellable=False)
+    executor.cancel_pending()
+    root.pump()
+    check(delivered == ['backup'], f"Delivered after cancel_pending: {delivered}")
+    print("✅ cancel_pending drops screen results and keeps app-level ones")
+    
+    # A failing callback must not stop later results from being delivered
+    def broken(result):
+        raise ValueError("callback failed")
+    executor.call_soon(broken, None)
+    executor.submit(lambda: 'first', callback=broken)
+    root.pump()
+    executor.submit(lambda: 'second', callback=delivered.append)
+    root.pump()
+    check(delivered == ['backup', 'second'], f"Delivered after a failing callback: {delivered}")
+    print("✅ Polling carries on after a callback raises")
+    
+    # A worker's UI call must be delivered even when no request is pending
+    import threading
+    worker = threading.Thread(target=executor.call_soon, args=(delivered.append, 'progress'))
+    worker.start()
+    worker.join()
+    root.pump()
+    executor.shutdown()
+    
+    check(delivered == ['backup', 'second', 'progress'], f"Delivered after an idle call_soon: {delivered}")
+    print("✅ call_soon starts polling when the executor is idle")
+    return True
+
+def test_sql_profiler():
+    """Check that the SQL profiler records calls and is absent unless enabled"""
+    print("\nChecking SQL profiler...")
+    
+    from database import DatabaseManager
+    from db_profiler import SQLProfiler
+    
+    with temp_database("plain.db", initialize=False) as db:
+        plain = type(db.connection) is sqlite3.Connection
+        check(plain, "Connections are instrumented without a profiler")
+        print("✅ Plain connections when profiling is off")
+        
+        temp_dir = os.path.dirname(db.db_path)
+        profiler = SQLProfiler(slow_query_ms=0, log_dir=os.path.join(temp_dir, "logs"))
+        profiled = DatabaseManager(os.path.join(temp_dir, "profiled.db"), profiler=profiler)
+        profiled.initialize_database()
+        profiled.search_drugs("para")
+        profiled.close()
+        
+        summary = profiler.summary()
+        search = summary['methods'].get('search_drugs', {})
+        check(search.get('calls') == 1 and search.get('rows') and summary['slow_queries'],
+              f"Profile incomplete: {search}")
+        check(profiler.dump(os.path.join(temp_dir, "profile.json")), "Profile could not be written")
+        print(f"✅ Profiled {len(summary['statements'])} statements across {len(summary['methods'])} methods")
+    return True
+
+def test_data_generator():
+    """Check that generated data is reproducible and its stock ledger adds up"""
+    print("\nChecking synthetic data generator...")
+    
+    from datetime import date
+    from generate_data import generate
+    
+    checksums = []
+    for name in ("generated_a.db", "generated_b.db"):
+        with temp_database(name) as db:
+            generate(db, seed=7, drugs=200, sales=500, items=1500, days=30, end_date=date(2025, 3, 31))
+            with db.reader() as conn:
+                checksums.append([conn.execute(sql).fetchall() for sql in (
+                    "SELECT * FROM sales ORDER BY id",
+                    "SELECT * FROM sale_items ORDER BY id",
+                )])
+                mismatched = conn.execute('''
+                    SELECT COUNT(*) FROM drugs d
+                    WHERE quantity_in_stock != (SELECT SUM(quantity_change) FROM stock_movements
+                                                WHERE drug_id = d.id)
+                ''').fetchone()[0]
+                drug_count = conn.execute("SELECT COUNT(*) FROM drugs").fetchone()[0]
+            cached_count = len(db.get_all_drugs())
+            db.close()
+            
+            check(not mismatched, f"{mismatched} drugs disagree with their stock ledger")
+            check(drug_count == cached_count == 200,
+                  f"Generated 200 drugs but found {drug_count} ({cached_count} cached)")
+        
+    check(checksums[0] == checksums[1] and len(checksums[0][0]) == 500, "Same seed produced different sales")
+    print(f"✅ Same seed reproduces {len(checksums[0][0])} sales and {len(checksums[0][1])} items")
+    print("✅ Stock ledger matches generated stock levels")
+    print("✅ Sample drugs are replaced by the generated catalog")
+    return True
+
+def test_benchmark():
+    """Check that the benchmark suite runs every hot path and flags regressions"""
+    print("\nChecking benchmark suite...")
+    
+    from datetime import date
+    from generate_data import generate
+    from benchmark import BENCHMARKS, run_suite, compare
+    
+    with temp_database("benchmark_check.db") as db:
+        generate(db, seed=3, drugs=300, sales=300, items=900, days=30, end_date=date(2025, 3, 31))
+        db.close()
+        
+        results = run_suite(db.db_path, 3, 0.05)
+        failing = [name for name, stats in results.items() if stats['errors']]
+        check(sorted(results) == sorted(name for name, _, _ in BENCHMARKS) and not failing,
+              f"Benchmarks missing or failing: {failing}")
+        print(f"✅ {len(results)} hot paths timed without errors")
+        
+        # A baseline twice as fast as this run must be reported as a regression
+        current = {'datasets': {'check': results}}
+        baseline = {'datasets': {'check': {'create_backup': dict(results['create_backup'],
+                                                                 p95_ms=results['create_backup']['p95_ms'] / 2)}}}
+        check(compare(current, baseline, 0.25) and not compare(current, current, 0.25),
+              "Baseline comparison did not flag the regression")
+        print("✅ Baseline comparison flags regressions")
+    return True
+
+def test_load_simulator():
+    """Check that concurrent cashiers leave stock and sales consistent"""
+    print("\nChecking multi-cashier load test...")
+    
+    from datetime import date
+    from generate_data import generate
+    from load_test import run_load_test
+    
+    with temp_database("load_check.db") as db:
+        generate(db, seed=5, drugs=200, sales=200, items=600, days=10, end_date=date(2025, 3, 31))
+        db.close()
+        
+        summary, checks = run_load_test(db.db_path, cashiers=3, duration=1.5, rate=0, threads=True)
+        check(summary['sales'] and not summary['failed'], f"{summary['sales']} sales, {summary['failed']} failed")
+        print(f"✅ 3 cashiers completed {summary['sales']} sales")
+        
+        for name, passed, detail in checks:
+            check(passed, f"{name}: {detail}")
+        print(f"✅ {len(checks)} consistency checks passed")
+    return True
+
+def test_online_backup():
+    """Check that a backup taken during sales is complete, verified and atomic"""
+    print("\nChecking online backups...")
+    
+    from database import InsufficientStockError
+    from datetime import date
+    from generate_data import generate
+    import threading
+    import zipfile
+    import utils
+    
+    with temp_database("backup_check.db") as db:
+        temp_dir = os.path.dirname(db.db_path)
+        backup_dir = os.path.join(temp_dir, "backups")
+        generate(db, seed=9, drugs=300, sales=2000, items=6000, days=30, end_date=date(2025, 3, 31))
+        with db.reader() as conn:
+            drug_ids = [row[0] for row in conn.execute("SELECT id FROM drugs WHERE quantity_in_stock > 0")]
+        
+        # Keep selling from another connection while the backup copies
+        selling = threading.Event()
+        selling.set()
+        def sell():
+            while selling.is_set() and drug_ids:
+                drug_id = drug_ids[len(drug_ids) // 2]
+                try:
+                    db.checkout({'total_amount': 1.0, 'cashier_name': 'Test'},
+                                [{'drug_id': drug_id, 'quantity': 1, 'unit_price': 1.0, 'total_price': 1.0}])
+                except InsufficientStockError:
+                    drug_ids.remove(drug_id)
+        seller = threading.Thread(target=sell)
+        seller.start()
+        
+        stages = set()
+        copied = []
+        def on_progress(done, total, stage):
+            stages.add(stage)
+            if stage == "Copying database":
+                copied.append(done)
+        pages_per_step = utils.BACKUP_PAGES_PER_STEP
+        utils.BACKUP_PAGES_PER_STEP = 16
+        try:
+            backup_path = utils.create_backup(db.db_path, backup_dir, progress_callback=on_progress)
+        finally:
+            utils.BACKUP_PAGES_PER_STEP = pages_per_step
+            selling.clear()
+            seller.join()
+            db.close()
+        
+        check(os.listdir(backup_dir) == [os.path.basename(backup_path)],
+              f"Unexpected files left in the backup folder: {os.listdir(backup_dir)}")
+        check(stages == {"Copying database", "Compressing"}, f"Progress stages reported: {sorted(stages)}")
+        check(copied == sorted(copied), "Sales during the copy made it start over")
+        print("✅ Backup copied from one snapshot and written atomically with progress reported")
+        
+        with zipfile.ZipFile(backup_path) as backup_zip:
+            backup_zip.extract("pharmacy.db", temp_dir)
+        conn = sqlite3.connect(os.path.join(temp_dir, "pharmacy.db"))
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        sales = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+        conn.close()
+        check(result == "ok" and sales >= 2000, f"Backup copy: integrity {result}, {sales} sales")
+        print(f"✅ Backup taken during sales is intact ({sales} sales)")
+    return True
+
+def test_restore_backup():
+    """Check that a restore shows through the open DatabaseManager and keeps a full safety copy"""
+    print("\nChecking backup restore...")
+    
+    import glob
+    import utils
+    
+    with temp_database("restore_check.db") as db:
+        db_path = db.db_path
+        temp_dir = os.path.dirname(db_path)
+        drug_count = len(db.get_all_drugs())
+        backup_path = utils.create_backup(db_path, os.path.join(temp_dir, "backups"))
+        
+        # Changes made after the backup, partly still in the WAL
+        settings = db.get_settings()
+        settings['currency'] = 'USD'
+        db.update_settings(settings)
+        db.add_drug({'generic_name': 'After Backup', 'brand_name': 'Later', 'dosage': '1mg', 'form': 'Tablet',
+                     'batch_number': 'B1', 'expiry_date': f"{datetime.now().year + 1}-12-31",
+                     'unit_price': 1.0, 'quantity_in_stock': 10})
+        
+        utils.restore_backup(backup_path, db)
+        drugs = db.get_all_drugs()
+        currency = db.get_currency()
+        check(len(drugs) == drug_count and currency != 'USD',
+              f"Manager still sees post-backup data: {len(drugs)} drugs, currency {currency}")
+        print("✅ Restored data visible through the open manager")
+        
+        db.update_stock(drugs[0]['id'], 5)
+        db.close()
+        conn = sqlite3.connect(db_path)
+        stock = conn.execute("SELECT quantity_in_stock FROM drugs WHERE id = ?", (drugs[0]['id'],)).fetchone()[0]
+        conn.close()
+        check(stock == drugs[0]['quantity_in_stock'] + 5, f"Write after restore not persisted (stock {stock})")
+        print("✅ Writes after the restore land in the restored database")
+        
+        safety_copies = glob.glob(db_path + ".before_restore_*")
+        check(len(safety_copies) == 1, f"Safety copies written: {safety_copies}")
+        conn = sqlite3.connect(safety_copies[0])
+        later = conn.execute("SELECT COUNT(*) FROM drugs WHERE generic_name = 'After Backup'").fetchone()[0]
+        conn.close()
+        check(later == 1, "Safety copy is missing changes made after the backup")
+        print("✅ Safety copy taken before the restore includes the write-ahead log")
+    return True
+
 def run_performance_test():
-    """Run basic performance tests"""
+    """Run basic performance tests
+    
+    Set PHARMACY_PERF_DB to time a database built by generate_data.py.
+    """
     print("\nRunning performance tests...")
     
     try:
         from database import DatabaseManager
         import time
         
-        db = DatabaseManager()
+        db_path = os.environ.get('PHARMACY_PERF_DB', 'pharmacy.db')
+        db = DatabaseManager(db_path)
         
         # Test search performance
         start_time = time.time()
@@ -248,8 +1399,14 @@ def run_performance_test():
         else:
             print(f"⚠️  Search performance: {search_time:.3f}s (slow)")
         
+        # Repeated catalog reads should be served from the cache
+        db.get_all_drugs()
+        db.get_all_drugs()
+        stats = db.get_cache_stats()
+        print(f"✅ Catalog cache: {stats['catalog_hits']} hits, {stats['catalog_misses']} misses")
+        
         # Test database size
-        db_size = os.path.getsize("pharmacy.db") / (1024 * 1024)  # MB
+        db_size = os.path.getsize(db_path) / (1024 * 1024)  # MB
         print(f"✅ Database size: {db_size:.2f} MB")
         
         db.close()
@@ -274,6 +1431,30 @@ def main():
         ("Database Integrity", test_database_integrity),
         ("Sample Data", test_sample_data),
         ("Utility Functions", test_utils),
+        ("Query Plans", test_query_plans),
+        ("Expired Lots", test_expired_lots),
+        ("Checkout Atomicity", test_checkout_atomicity),
+        ("Receipt Numbers", test_receipt_numbers),
+        ("Concurrent Checkout", test_concurrent_checkout),
+        ("Keyset Pagination", test_keyset_pages),
+        ("Sales Rollups", test_sales_rollups),
+        ("Top Drugs", test_top_drugs),
+        ("Drug Import", test_drug_import),
+        ("Drug Search", test_drug_search),
+        ("Inventory Alerts", test_inventory_alerts),
+        ("Stock Ledger", test_stock_ledger),
+        ("Sales Archive", test_sales_archive),
+        ("Schema Migrations", test_migrations),
+        ("Settings Cache", test_settings_cache),
+        ("Catalog Cache", test_catalog_cache),
+        ("Row Iterators", test_row_iterators),
+        ("Database Executor", test_db_executor),
+        ("SQL Profiler", test_sql_profiler),
+        ("Data Generator", test_data_generator),
+        ("Benchmark Suite", test_benchmark),
+        ("Load Simulator", test_load_simulator),
+        ("Online Backup", test_online_backup),
+        ("Backup Restore", test_restore_backup),
         ("Performance", run_performance_test)
     ]
     
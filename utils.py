@@ -6,20 +6,198 @@ Backup, restore, and other utility functions
 import os
 import shutil
 import sqlite3
+import tempfile
+import time
 from datetime import datetime
 import zipfile
 import json
 
-def create_backup():
+# Pages copied per backup step
+BACKUP_PAGES_PER_STEP = 1024
+# Pause between steps (seconds) so checkouts get the database in between
+BACKUP_STEP_PAUSE = 0.005
+# Writes from other connections restart a stepped copy of a database that is
+# not in WAL mode; each restart doubles the pause and after this many the
+# copy fails
+BACKUP_MAX_RESTARTS = 3
+# Bytes compressed between progress reports
+BACKUP_CHUNK_SIZE = 1024 * 1024
+
+class _BackupRestarted(Exception):
+    """Raised from the backup progress handler to give up on a stepped copy"""
+
+def _copy_database(source_path, target_path, progress_callback=None):
     """
-    Create a backup of the pharmacy database and settings
+    Copy a database that may be in use with the SQLite backup API
+    
+    A WAL database is copied from one read snapshot, so sales carry on
+    during the copy without restarting it. Other databases are copied
+    between writes, backing off when a write restarts the copy.
+    
+    Args:
+        source_path (str): Database to copy
+        target_path (str): New file to copy it to
+        progress_callback (callable): Called with (pages done, total pages, stage)
+        
+    Returns:
+        int: Number of pages copied
+    
+    Raises:
+        Exception: If writes kept restarting the copy
+    """
+    restarts = 0
+    last_remaining = None
+    pause = BACKUP_STEP_PAUSE
+    
+    def on_step(status, remaining, total):
+        nonlocal restarts, last_remaining, pause
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > BACKUP_MAX_RESTARTS:
+                raise _BackupRestarted()
+            pause *= 2
+        last_remaining = remaining
+        if progress_callback:
+            progress_callback(total - remaining, total, "Copying database")
+        time.sleep(pause)
+    
+    source = sqlite3.connect(source_path, isolation_level=None)
+    target = sqlite3.connect(target_path)
+    try:
+        # An open read transaction pins the WAL snapshot the steps copy from
+        if source.execute("PRAGMA journal_mode").fetchone()[0] == "wal":
+            source.execute("BEGIN")
+            source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        try:
+            source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=on_step)
+        except _BackupRestarted:
+            raise Exception(f"{os.path.basename(source_path)} changed during the copy "
+                            f"{restarts} times; try again when it is not being written to")
+        finally:
+            if source.in_transaction:
+                source.execute("COMMIT")
+        
+        # The copy inherits WAL mode; make it a self-contained file
+        target.execute("PRAGMA journal_mode = DELETE")
+        problems = [row[0] for row in target.execute("PRAGMA quick_check").fetchall()]
+        if problems != ["ok"]:
+            raise Exception(f"backup copy failed quick_check: {'; '.join(problems[:5])}")
+        return target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+def _copy_archives(db_path, copy_path, work_dir, progress_callback=None):
+    """
+    Copy the sales archives registered in a copy of the database
+    
+    The registry is read from the copy, and each archive is cut back to the
+    sales it held at that snapshot: archive_sales may have moved late sales
+    in since, and those are still in the copied database.
+    
+    Args:
+        db_path (str): Live database the archive paths are relative to
+        copy_path (str): Copy of the live database
+        work_dir (str): Folder the archive copies are written to
+        progress_callback (callable): Passed on to _copy_database
+        
+    Returns:
+        list: (archive file name, path of its copy) pairs
+    """
+    conn = sqlite3.connect(copy_path)
+    try:
+        registry = conn.execute("SELECT path, last_sale_id, sales FROM sales_archives ORDER BY year").fetchall()
+    except sqlite3.OperationalError:
+        # Databases from before archiving have no registry
+        registry = []
+    finally:
+        conn.close()
+    
+    copies = []
+    try:
+        for path, last_sale_id, sales in registry:
+            source_path = os.path.join(os.path.dirname(os.path.abspath(db_path)), path)
+            if not os.path.exists(source_path):
+                print(f"Sales archive missing, leaving it out of the backup: {source_path}")
+                continue
+            fd, target_path = tempfile.mkstemp(prefix=".pharmacy_backup_", suffix=".db", dir=work_dir)
+            os.close(fd)
+            copies.append((path, target_path))
+            _copy_database(source_path, target_path, progress_callback)
+            
+            archive = sqlite3.connect(target_path)
+            try:
+                with archive:
+                    archive.execute('''
+                        DELETE FROM sale_item_lots WHERE sale_item_id IN (
+                            SELECT id FROM sale_items WHERE sale_id > ?
+                        )
+                    ''', (last_sale_id,))
+                    archive.execute("DELETE FROM sale_items WHERE sale_id > ?", (last_sale_id,))
+                    archive.execute("DELETE FROM sales WHERE id > ?", (last_sale_id,))
+                archived = archive.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+            finally:
+                archive.close()
+            if archived != sales:
+                raise Exception(f"sales archive {path} changed during the backup "
+                                f"({archived} sales, {sales} registered)")
+        return copies
+    except Exception:
+        for _, target_path in copies:
+            os.remove(target_path)
+        raise
+
+def _compress_file(backup_zip, path, name, progress_callback=None):
+    """Add a file to an open backup archive in chunks, reporting progress"""
+    size = os.path.getsize(path)
+    done = 0
+    with open(path, 'rb') as source, backup_zip.open(name, 'w', force_zip64=True) as target:
+        while True:
+            chunk = source.read(BACKUP_CHUNK_SIZE)
+            if not chunk:
+                break
+            target.write(chunk)
+            done += len(chunk)
+            if progress_callback:
+                progress_callback(done, size, "Compressing")
+
+def _write_database(source_path, target_path):
+    """Overwrite a database with another through the SQLite backup API
+    
+    Writing through SQLite's locks, rather than replacing the file, means
+    connections that have it open see the new contents on their next read.
+    """
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+def create_backup(db_path="pharmacy.db", backup_dir="backups", progress_callback=None):
+    """
+    Create a backup of the pharmacy database, its sales archives and settings
+    
+    The database is copied page by page with the SQLite backup API, so it
+    is consistent even while sales are being recorded, then checked with
+    PRAGMA quick_check and compressed. The sales archives it registers are
+    copied after it, under archives/ in the backup. The archive only
+    appears in backup_dir once it is complete.
+    
+    Args:
+        db_path (str): Database to back up
+        backup_dir (str): Folder the backup is saved in
+        progress_callback (callable): Called with (done, total, stage) while
+            copying and compressing; may be called from a worker thread
     
     Returns:
         str: Path to the created backup file
     """
+    copy_path = partial_path = None
+    archives = []
     try:
         # Create backups directory if it doesn't exist
-        backup_dir = "backups"
         if not os.path.exists(backup_dir):
             os.makedirs(backup_dir)
         
@@ -28,11 +206,26 @@ def create_backup():
         backup_filename = f"pharmacy_backup_{timestamp}.backup"
         backup_path = os.path.join(backup_dir, backup_filename)
         
+        # Work files live next to the backup so the final rename is atomic
+        fd, copy_path = tempfile.mkstemp(prefix=".pharmacy_backup_", suffix=".db", dir=backup_dir)
+        os.close(fd)
+        fd, partial_path = tempfile.mkstemp(prefix=".pharmacy_backup_", suffix=".partial", dir=backup_dir)
+        os.close(fd)
+        
+        pages = 0
+        if os.path.exists(db_path):
+            pages = _copy_database(db_path, copy_path, progress_callback)
+            archives = _copy_archives(db_path, copy_path, backup_dir, progress_callback)
+        
         # Create backup archive
-        with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as backup_zip:
+        with zipfile.ZipFile(partial_path, 'w', zipfile.ZIP_DEFLATED) as backup_zip:
             # Add database file
-            if os.path.exists("pharmacy.db"):
-                backup_zip.write("pharmacy.db", "pharmacy.db")
+            if pages:
+                _compress_file(backup_zip, copy_path, "pharmacy.db", progress_callback)
+            
+            # Add sales archives
+            for name, archive_copy in archives:
+                _compress_file(backup_zip, archive_copy, f"archives/{name}", progress_callback)
             
             # Add settings file if exists
             if os.path.exists("settings.json"):
@@ -42,67 +235,108 @@ def create_backup():
             metadata = {
                 "backup_date": datetime.now().isoformat(),
                 "version": "1.0.0",
-                "description": "Ghanaian Pharmacy POS System Backup"
+                "description": "Ghanaian Pharmacy POS System Backup",
+                "sqlite_version": sqlite3.sqlite_version,
+                "pages": pages,
+                "quick_check": "ok" if pages else None,
+                "archives": [name for name, _ in archives],
             }
             
             backup_zip.writestr("metadata.json", json.dumps(metadata, indent=2))
         
+        # The checked copy is only kept if it made it into the archive intact
+        with zipfile.ZipFile(partial_path) as backup_zip:
+            damaged = backup_zip.testzip()
+        if damaged:
+            raise Exception(f"archive entry {damaged} is corrupt")
+        
+        os.replace(partial_path, backup_path)
+        partial_path = None
         return backup_path
         
     except Exception as e:
         raise Exception(f"Failed to create backup: {str(e)}")
+    finally:
+        for path in [copy_path, partial_path] + [archive_copy for _, archive_copy in archives]:
+            if path and os.path.exists(path):
+                os.remove(path)
 
-def restore_backup(backup_path):
+def restore_backup(backup_path, db=None, db_path="pharmacy.db"):
     """
     Restore pharmacy data from a backup file
     
+    The backup is copied into the live database with the SQLite backup API
+    rather than by replacing files, so connections that are open keep
+    working and see the restored data. Sales archives in the backup are
+    written back beside the database the same way. Pass the application's
+    DatabaseManager as db so its caches are reset and its schema brought up
+    to date as well.
+    
     Args:
         backup_path (str): Path to the backup file
+        db (DatabaseManager): Open manager for the database being restored
+        db_path (str): Database to restore when no manager is given
         
     Returns:
         bool: True if restore was successful, False otherwise
     """
+    temp_dir = tempfile.mkdtemp(prefix="pharmacy_restore_")
     try:
         # Verify backup file exists
         if not os.path.exists(backup_path):
             raise Exception("Backup file not found")
         
-        # Create temporary directory for extraction
-        temp_dir = "temp_restore"
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        os.makedirs(temp_dir)
-        
         # Extract backup
         with zipfile.ZipFile(backup_path, 'r') as backup_zip:
             backup_zip.extractall(temp_dir)
         
         # Verify backup contents
-        if not os.path.exists(os.path.join(temp_dir, "pharmacy.db")):
+        restored_path = os.path.join(temp_dir, "pharmacy.db")
+        if not os.path.exists(restored_path):
             raise Exception("Invalid backup: database file not found")
-        
-        # Create backup of current database before restore
-        if os.path.exists("pharmacy.db"):
-            current_backup = f"pharmacy.db.before_restore_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            shutil.copy2("pharmacy.db", current_backup)
-        
-        # Restore database
-        shutil.copy2(os.path.join(temp_dir, "pharmacy.db"), "pharmacy.db")
+        archives_dir = os.path.join(temp_dir, "archives")
+        archives = sorted(os.listdir(archives_dir)) if os.path.isdir(archives_dir) else []
+        for path in [restored_path] + [os.path.join(archives_dir, name) for name in archives]:
+            conn = sqlite3.connect(path)
+            try:
+                problems = [row[0] for row in conn.execute("PRAGMA quick_check").fetchall()]
+            finally:
+                conn.close()
+            if problems != ["ok"]:
+                raise Exception(f"Invalid backup: {os.path.basename(path)}: {'; '.join(problems[:5])}")
+        
+        if db is not None:
+            db_path = db.db_path
+        
+        # Keep a copy of the current database, including its write-ahead log,
+        # and of any archive the restore overwrites
+        targets = [(restored_path, db_path)] + [
+            (os.path.join(archives_dir, name), os.path.join(os.path.dirname(os.path.abspath(db_path)), name))
+            for name in archives
+        ]
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        for _, target_path in targets:
+            if os.path.exists(target_path):
+                _copy_database(target_path, f"{target_path}.before_restore_{timestamp}")
+        
+        # Restore database, then the archives its registry refers to
+        if db is not None:
+            db.restore_from(restored_path)
+        else:
+            _write_database(restored_path, db_path)
+        for source_path, target_path in targets[1:]:
+            _write_database(source_path, target_path)
         
         # Restore settings if exists
         if os.path.exists(os.path.join(temp_dir, "settings.json")):
             shutil.copy2(os.path.join(temp_dir, "settings.json"), "settings.json")
         
-        # Clean up temporary directory
-        shutil.rmtree(temp_dir)
-        
         return True
         
     except Exception as e:
-        # Clean up on error
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
         raise Exception(f"Failed to restore backup: {str(e)}")
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
 
 def validate_database():
     """
@@ -211,6 +445,64 @@ def format_date(date_string, format_type="YYYY-MM-DD"):
     except Exception:
         return date_string
 
+def format_inventory_alerts(alerts):
+    """
+    Turn DatabaseManager.get_inventory_alerts() into display lines
+    
+    Args:
+        alerts (dict): low_stock, expiring and out_of_stock rows
+        
+    Returns:
+        list: Lines of text; headings start with ⚠️, 🚫 or ✅
+    """
+    lines = []
+    
+    if alerts['low_stock']:
+        lines.append("⚠️ LOW STOCK ALERTS:")
+        for drug in alerts['low_stock']:
+            lines.append(f"  • {drug['generic_name']} ({drug['brand_name']}) - {drug['quantity_in_stock']} left")
+        lines.append("")
+    
+    if alerts['expiring']:
+        lines.append("⚠️ EXPIRING SOON ALERTS:")
+        for drug in alerts['expiring']:
+            lines.append(f"  • {drug['generic_name']} ({drug['brand_name']}) batch {drug['batch_number']}, "
+                         f"{drug['lot_quantity']} units - Expires in {drug['days_left']} days")
+        lines.append("")
+    
+    if alerts['out_of_stock']:
+        lines.append("🚫 OUT OF STOCK ALERTS:")
+        for drug in alerts['out_of_stock']:
+            lines.append(f"  • {drug['generic_name']} ({drug['brand_name']})")
+        lines.append("")
+    
+    if not lines:
+        lines.append("✅ All inventory items are in good condition!")
+    
+    return lines
+
+def inventory_statuses(alerts):
+    """
+    Map the drugs in DatabaseManager.get_inventory_alerts() to a status
+    
+    A lot expiring within the alert window outranks the stock level.
+    
+    Args:
+        alerts (dict): low_stock, expiring and out_of_stock rows
+        
+    Returns:
+        dict: Drug id -> "LOW STOCK", "OUT OF STOCK" or "EXPIRING SOON";
+            drugs without an alert are left out
+    """
+    statuses = {}
+    for drug in alerts['low_stock']:
+        statuses[drug['id']] = "LOW STOCK"
+    for drug in alerts['out_of_stock']:
+        statuses[drug['id']] = "OUT OF STOCK"
+    for lot in alerts['expiring']:
+        statuses[lot['id']] = "EXPIRING SOON"
+    return statuses
+
 def calculate_tax(amount, tax_rate):
     """
     Calculate tax amount
@@ -372,18 +664,23 @@ def export_to_csv(data, filename, headers=None):
     """
     Export data to CSV file
     
+    Rows are written as they are produced, so data can be a generator over
+    one of the DatabaseManager iter_* methods. The file is written under a
+    temporary name and only replaces filename once every row is in.
+    
     Args:
-        data (list): List of data rows
+        data (iterable): Data rows
         filename (str): Output filename
         headers (list): Column headers
         
     Returns:
         bool: True if successful, False otherwise
     """
+    partial_path = f"{filename}.partial"
     try:
         import csv
         
-        with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        with open(partial_path, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
             
             if headers:
@@ -392,12 +689,64 @@ def export_to_csv(data, filename, headers=None):
             for row in data:
                 writer.writerow(row)
         
+        os.replace(partial_path, filename)
         return True
         
     except Exception as e:
         print(f"Error exporting to CSV: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
         return False
 
+# Columns accepted by read_drug_csv; reorder_level is optional
+DRUG_CSV_COLUMNS = ['generic_name', 'brand_name', 'dosage', 'form', 'batch_number',
+                    'expiry_date', 'unit_price', 'quantity_in_stock', 'reorder_level']
+
+def read_drug_csv(filename, errors=None):
+    """
+    Stream validated drug rows from a CSV file
+    
+    Rows are read one at a time, so files of any size can be imported.
+    Invalid rows are skipped and reported through the errors list.
+    
+    Args:
+        filename (str): CSV file with a header row (see DRUG_CSV_COLUMNS)
+        errors (list): Receives (line_number, message) for rejected rows
+        
+    Yields:
+        dict: Drug data ready for DatabaseManager.import_drugs
+    """
+    import csv
+    
+    if errors is None:
+        errors = []
+    
+    with open(filename, newline='', encoding='utf-8-sig') as csvfile:
+        reader = csv.DictReader(csvfile)
+        header = [name.strip().lower() for name in reader.fieldnames or []]
+        missing = [column for column in DRUG_CSV_COLUMNS[:-1] if column not in header]
+        if missing:
+            errors.append((1, f"Missing columns: {', '.join(missing)}"))
+            return
+        reader.fieldnames = header
+        
+        for row in reader:
+            try:
+                drug = {column: (row.get(column) or '').strip() for column in DRUG_CSV_COLUMNS}
+                for column in DRUG_CSV_COLUMNS[:5]:
+                    if not drug[column]:
+                        raise ValueError(f"{column} is required")
+                drug['expiry_date'] = datetime.strptime(drug['expiry_date'], '%Y-%m-%d').strftime('%Y-%m-%d')
+                drug['unit_price'] = float(drug['unit_price'])
+                drug['quantity_in_stock'] = int(drug['quantity_in_stock'])
+                drug['reorder_level'] = int(drug['reorder_level']) if drug['reorder_level'] else 10
+                if drug['unit_price'] < 0 or drug['quantity_in_stock'] < 0:
+                    raise ValueError("price and quantity must not be negative")
+            except ValueError as e:
+                errors.append((reader.line_num, str(e)))
+                continue
+            yield drug
+
 def log_activity(activity, user="System"):
     """
     Log system activity